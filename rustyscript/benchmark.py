@@ -0,0 +1,206 @@
+"""Steps per second of the tree walking Interpreter vs the bytecode VM,
+without and with fused loops.
+
+    $ python benchmark.py [--optimize]
+"""
+
+import argparse
+import time
+
+from rsinterpreter.interpreter import Lexer, Parser, SemanticAnalyzer, Interpreter
+from rsinterpreter.compiler import Compiler
+from rsinterpreter.vm import VM
+from rsinterpreter.optimizer import optimize
+from rsinterpreter.fusion import fuse
+
+
+class BenchModule:
+    """Stand-in for LegsModule: the same call shape, no game state."""
+
+    name = "legs"
+
+    def __init__(self):
+        self.func = {"up": self.step, "down": self.step}
+        self.other = {
+            "up": {"n_params": 0, "duration": 2},
+            "down": {"n_params": 0, "duration": 2},
+        }
+
+    @staticmethod
+    def step():
+        return 1
+
+
+PROGRAMS = {
+    "counting loop": """
+        program count;
+        var i: integer;
+        begin
+            i := 0;
+            while i < 1000 do begin
+                i := i + 1
+            end
+        end.
+    """,
+    "arithmetic": """
+        program arith;
+        var i, x, y: integer;
+        begin
+            i := 0; x := 3; y := 0;
+            while i < 1000 do begin
+                y := (x * 2 + i) - (y div 3) * 2 + 1;
+                if y > 100 then begin y := y - 100 end else begin y := y + 7 end;
+                i := i + 1
+            end
+        end.
+    """,
+    "real arithmetic": """
+        program reals;
+        var i: integer;
+        x, y: real;
+        begin
+            i := 0; x := 0.5; y := 0;
+            while i < 1000 do begin
+                y := (x * 2 + i) / 3 - -y / 4;
+                if y > 100 then begin y := y - 100.5 end;
+                i := i + 1
+            end
+        end.
+    """,
+    "module calls": """
+        program walk;
+        use legs;
+        var i: integer;
+        begin
+            i := 0;
+            while i < 1000 do begin
+                up();
+                down();
+                i := i + 1
+            end
+        end.
+    """,
+    "procedure calls": """
+        program calls;
+        var i, x: integer;
+        procedure add(k: integer);
+        begin
+            x := x + k
+        end;
+        procedure countdown(n: integer);
+        begin
+            if n > 0 then begin countdown(n - 1) end
+        end;
+        begin
+            i := 0; x := 0;
+            while i < 1000 do begin
+                add(i);
+                i := i + 1
+            end;
+            i := 0;
+            while i < 100 do begin
+                countdown(20);
+                i := i + 1
+            end
+        end.
+    """,
+    "guard conditions": """
+        program guards;
+        var i, x: integer;
+        begin
+            i := 0; x := 0;
+            while i < 1000 and x > 0 - 1 do begin
+                if x > 5 or i div 2 * 2 = i and x < 3 then begin x := x + 1 end;
+                if x = 10 and i > 500 or x > 20 then begin x := 0 end;
+                i := i + 1
+            end
+        end.
+    """,
+    "constant conditions": """
+        program consts;
+        var i, x: integer;
+        begin
+            i := 0; x := 0;
+            while i < 1000 do begin
+                if 2 * 3 + 1 = 7 then begin x := x + (10 - 4) * 2 end;
+                if 1 = 2 then begin x := 0 end else begin x := x - 1 end;
+                while 0 > 1 do begin x := 0 end;
+                i := i + 1
+            end
+        end.
+    """,
+}
+
+
+def tree_walker(tree, modules):
+    return Interpreter(tree, modules=modules).interpret()
+
+
+def bytecode_vm(tree, modules):
+    return VM(Compiler(modules).compile(tree), modules=modules).run()
+
+
+def fused_vm(tree, modules):
+    compiler = Compiler(modules)
+    code = compiler.compile(tree)
+    fuse(code, compiler.loops)
+    return VM(code, modules=modules).run()
+
+
+ENGINES = {
+    "tree walker": tree_walker,
+    "bytecode vm": bytecode_vm,
+    "fused vm": fused_vm,
+}
+
+
+def measure(engine, tree, modules, repeat):
+    best = None
+    n_steps = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_steps = 0
+        for _ in engine(tree, modules):
+            n_steps += 1
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return n_steps, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ShizoSkript engine benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--optimize",
+        help="Run the step preserving AST optimizer first",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    for title, text in PROGRAMS.items():
+        modules = {"legs": BenchModule()}
+        tree = Parser(Lexer(text)).parse()
+        SemanticAnalyzer(modules).visit(tree)
+
+        print(title)
+        if args.optimize:
+            tree, stats = optimize(tree)
+            print(f"  optimizer: {stats.report()}")
+        results = {}
+        for name, engine in ENGINES.items():
+            n_steps, elapsed = measure(engine, tree, modules, args.repeat)
+            results[name] = (n_steps, elapsed)
+            print(
+                f"  {name:<12} {n_steps:>8} steps {elapsed * 1e3:>9.2f} ms"
+                f" {n_steps / elapsed:>12.0f} steps/s"
+            )
+        steps = {n_steps for n_steps, _ in results.values()}
+        assert len(steps) == 1, f"step counts differ: {results}"
+        base = results["tree walker"][1]
+        for name, (_, elapsed) in results.items():
+            if name != "tree walker":
+                print(f"  {name} speedup: {base / elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
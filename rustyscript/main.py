@@ -1,99 +1,286 @@
 from loguru import logger
-from rsinterpreter.interpreter import (
-    Lexer,
-    Parser,
-    LexerError,
-    ParserError,
-    SemanticAnalyzer,
-    SemanticError,
-    Error,
-)
-
-from rsinterpreter.game import CircusMission, Mission
+from rsinterpreter.interpreter import Error
+
+from rsinterpreter.game import Mission, FrameMode, MISSIONS
+from rsinterpreter.budget import Budget
+from rsinterpreter.cache import ProgramCache, ResultCache
+from rsinterpreter.frames import FrameEncoder, FRAME_FORMAT
 
 import pika.exceptions
 import multiprocessing
 import environs
+import binascii
+import random
+import base64
 import typing
+import time
 import json
 import pika
 
 env: environs.Env = environs.Env()
 RABBITMQ_CONNECTION_URI: str = env.str("RABBITMQ_CONNECTION_URI")
 N_WORKERS: int = env.int("N_WORKERS")
-MISSIONS: typing.Dict[str, Mission] = {"circus": CircusMission}
+PROGRAM_CACHE_SIZE: int = env.int("PROGRAM_CACHE_SIZE", 1024)
+CACHE_SHARED: bool = env.bool("CACHE_SHARED", False)
+RESULT_CACHE_SIZE: int = env.int("RESULT_CACHE_SIZE", 256)
+PREFETCH_COUNT: int = env.int("PREFETCH_COUNT", 1)
+RECONNECT_DELAY: float = env.float("RECONNECT_DELAY", 1.0)
+MAX_FRAME_CHUNK: int = env.int("MAX_FRAME_CHUNK", 32)
+BUDGET_INSTRUCTIONS: int = env.int("BUDGET_INSTRUCTIONS", 1_000_000)
+BUDGET_SECONDS: float = env.float("BUDGET_SECONDS", 5.0)
+BUDGET_INT_BITS: int = env.int("BUDGET_INT_BITS", 4096)
+BUDGET_FRAMES: int = env.int("BUDGET_FRAMES", 10_000)
+BUDGET_CALL_DEPTH: int = env.int("BUDGET_CALL_DEPTH", 256)
+BUDGET_ARRAY_CELLS: int = env.int("BUDGET_ARRAY_CELLS", 1 << 16)
+# signs the snapshots of paused jobs, slicing is off without it
+SNAPSHOT_KEY: bytes = env.str("SNAPSHOT_KEY", "").encode()
+MAX_SNAPSHOT_SIZE: int = env.int("MAX_SNAPSHOT_SIZE", 1 << 22)
 
 
-parameters = pika.URLParameters(RABBITMQ_CONNECTION_URI)
-while True:
-    try:
-        connection = pika.BlockingConnection(parameters=parameters)
-        break
-    except pika.exceptions.AMQPConnectionError:
-        continue
+program_cache = ProgramCache(maxsize=PROGRAM_CACHE_SIZE)
+result_cache = ResultCache(maxsize=RESULT_CACHE_SIZE)
+
+
+def connect() -> pika.BlockingConnection:
+    parameters = pika.URLParameters(RABBITMQ_CONNECTION_URI)
+    while True:
+        try:
+            return pika.BlockingConnection(parameters=parameters)
+        except pika.exceptions.AMQPConnectionError:
+            time.sleep(RECONNECT_DELAY)
+
+
+class FrameStream:
+    """Publishes frames in numbered chunks while the mission is played.
+
+    The first chunk holds a single frame so that playback can start right
+    away, every next chunk is twice as big up to MAX_FRAME_CHUNK.
+    """
+
+    def __init__(self, reply: typing.Callable[[dict], None], encode: bool = False):
+        self.reply = reply
+        self.encoder = FrameEncoder() if encode else None
+        self.seq = 0
+        self.chunk_size = 1
+        self.buffer = []
 
-channel = connection.channel(0)
-task_queue = multiprocessing.Queue()
+    def send(self, message: dict):
+        message["seq"] = self.seq
+        self.seq += 1
+        self.reply(message)
 
+    def add(self, frame):
+        self.buffer.append(frame)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+            self.chunk_size = min(self.chunk_size * 2, MAX_FRAME_CHUNK)
 
-def event_callback(__, method, _, body):
-    decoded_body = json.loads(body)
-    task_queue.put_nowait({"data": decoded_body, "delivery_tag": method.delivery_tag})
+    def flush(self):
+        if self.buffer:
+            if self.encoder is not None:
+                self.send({"frames": self.encoder.encode(self.buffer)})
+            else:
+                self.send({"frames": self.buffer})
+            self.buffer = []
 
+    def finish(self, response: dict):
+        self.flush()
+        final = {key: value for key, value in response.items() if key != "texts"}
+        final["done"] = True
+        self.send(final)
 
-def consumer():
-    channel.queue_declare(queue="play_mission")
-    channel.basic_consume(queue="play_mission", on_message_callback=event_callback)
-    channel.start_consuming()
 
+def on_message(channel, method, properties, body):
+    event = {}
 
-def work(event: dict) -> dict:
-    code = event["code"]
-    lexer = Lexer(code)
+    def reply(response: dict):
+        reply_to = properties.reply_to or event.get("response_queue")
+        if reply_to:
+            channel.basic_publish(
+                "",
+                routing_key=reply_to,
+                body=json.dumps(response),
+                properties=pika.BasicProperties(
+                    correlation_id=properties.correlation_id
+                ),
+            )
+
+    stream = None
     try:
-        parser = Parser(lexer)
-        tree = parser.parse()
-    except (LexerError, ParserError) as e:
-        return {"error": e.message}
+        event = json.loads(body)
+        encode = event.get("format") == FRAME_FORMAT
+        if event.get("stream"):
+            stream = FrameStream(reply, encode=encode)
+            stream.finish(work(event, on_frame=stream.add))
+        else:
+            response = work(event)
+            if encode and "texts" in response:
+                texts = FrameEncoder().encode(response["texts"])
+                response = dict(response, texts=texts)
+            reply(response)
+    except Exception as ex:
+        # a job that crashes the worker would crash every worker it is
+        # redelivered to, so answer it and drop it
+        logger.exception(ex)
+        response = {"error": "Internal error!"}
+        if stream is not None:
+            stream.finish(response)
+        else:
+            reply(response)
+    # ack only after the response is published: if the worker dies before
+    # that, the broker hands the job to another worker
+    channel.basic_ack(method.delivery_tag)
+
+
+def work(event: dict, on_frame: typing.Callable[[list], None] = None) -> dict:
+    turns = event.get("turns")
+    if turns is not None and (not isinstance(turns, int) or turns < 1):
+        return {"error": "turns must be a positive integer!"}
+    if (turns is not None or "snapshot" in event) and not SNAPSHOT_KEY:
+        return {"error": "Snapshots are disabled!"}
+    if "snapshot" in event:
+        return resume(event["snapshot"], turns, on_frame)
 
     mission = MISSIONS.get(event["level"])
     if mission is None:
         return {"error": "Mission not found!"}
 
+    program = program_cache.get(event["code"], mission)
+    if (program_cache.hits + program_cache.misses) % 100 == 0:
+        logger.info(f"Program cache: {program_cache.stats()}")
+        logger.info(f"Optimizer: {Mission.optimizer_stats.report()}")
+    if program.error is not None:
+        return {"error": program.error.message}
+
+    seed = event.get("seed")
+    if seed is None:
+        seed = random.getrandbits(32)
+
     try:
-        mission = mission(tree)
-    except SemanticError as e:
+        frame_mode = FrameMode(event.get("frames", FrameMode.ALL.value))
+    except ValueError:
+        return {"error": "Unknown frame mode!"}
+    frame_every = event.get("frame_every", 2)
+    if not isinstance(frame_every, int) or frame_every < 1:
+        return {"error": "frame_every must be a positive integer!"}
+    # results with different frames are different results
+    level = "{}:{}:{}".format(event["level"], frame_mode.value, frame_every)
+
+    response = result_cache.get(level, program.key, seed)
+    if (result_cache.hits + result_cache.misses) % 100 == 0:
+        logger.info(f"Result cache: {result_cache.stats()}")
+    if response is None:
+        budget = new_budget()
+        mission = mission(
+            program.code,
+            seed=seed,
+            frame_mode=frame_mode,
+            frame_every=frame_every,
+            budget=budget,
+        )
+        mission.on_frame = on_frame
+        response = play(mission, turns)
+        response["seed"] = seed
+        # the same job may finish in time on a less busy worker
+        if not budget.timed_out and "snapshot" not in response:
+            result_cache.put(level, program.key, seed, response)
+    elif on_frame is not None:
+        for frame in response.get("texts", []):
+            on_frame(frame)
+    return response
+
+
+def new_budget() -> Budget:
+    return Budget(
+        instructions=BUDGET_INSTRUCTIONS,
+        seconds=BUDGET_SECONDS,
+        int_bits=BUDGET_INT_BITS,
+        frames=BUDGET_FRAMES,
+        call_depth=BUDGET_CALL_DEPTH,
+        array_cells=BUDGET_ARRAY_CELLS,
+    )
+
+
+def resume(
+    snapshot: str, turns: int = None, on_frame: typing.Callable[[list], None] = None
+) -> dict:
+    """Go on with a job paused on any worker, under the limits of this one."""
+    if not isinstance(snapshot, str):
+        return {"error": "Bad snapshot!"}
+    try:
+        blob = base64.b64decode(snapshot, validate=True)
+    except binascii.Error:
+        return {"error": "Bad snapshot!"}
+    try:
+        mission = Mission.restore(
+            blob, SNAPSHOT_KEY, budget=new_budget(), max_size=MAX_SNAPSHOT_SIZE
+        )
+    except Error as e:
         return {"error": e.message}
+    mission.on_frame = on_frame
+    return play(mission, turns)
 
+
+def play(mission: Mission, turns: int = None) -> dict:
+    """Play the mission, or only ``turns`` turns of it. A paused job
+    answers with the frames of this slice and the snapshot to resume from.
+    """
     try:
-        result = mission.play()
+        result = mission.play(turns)
     except Error as e:
         return {"error": e.message}
 
-    if result["result"]:
-        return {"result": 1, "texts": mission.get_text(), "n_steps": mission.n_steps}
-    return {"result": 0, "texts": mission.get_text(), "n_steps": mission.n_steps}
+    if result is None:
+        response = {"n_steps": mission.n_steps}
+    else:
+        response = {"result": 1 if result["result"] else 0, "n_steps": mission.n_steps}
+    if mission.frame_mode is not FrameMode.NONE:
+        response["texts"] = mission.get_text()
+    if result is None:
+        # the next slice sends only its own frames
+        mission.texts = []
+        snapshot = mission.snapshot(SNAPSHOT_KEY)
+        response["snapshot"] = base64.b64encode(snapshot).decode()
+    return response
 
 
 def worker():
+    """Consume play_mission with an own connection.
+
+    The broker never sends more than PREFETCH_COUNT unacked jobs to one
+    worker, so the load is spread between the workers by RabbitMQ.
+    """
     while True:
         try:
-            event = task_queue.get()
-            response = work(event["data"])
-            channel.basic_publish(
-                "",
-                routing_key=event["data"]["response_queue"],
-                body=json.dumps(response),
-            )
-            channel.basic_ack(event["delivery_tag"])
+            connection = connect()
+            channel = connection.channel()
+            channel.queue_declare(queue="play_mission")
+            channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+            channel.basic_consume(queue="play_mission", on_message_callback=on_message)
+            channel.start_consuming()
+        except pika.exceptions.AMQPConnectionError as ex:
+            logger.warning(f"Connection lost: {ex!r}, reconnecting.")
         except Exception as ex:
             logger.exception(ex)
+            time.sleep(RECONNECT_DELAY)
+
+
+def start_worker() -> multiprocessing.Process:
+    process = multiprocessing.Process(target=worker, daemon=True)
+    process.start()
+    return process
 
 
 if __name__ == "__main__":
     logger.info(f"Starting {N_WORKERS} workers.")
-    for i in range(N_WORKERS):
-        multiprocessing.Process(target=worker).start()
-    consumer_process = multiprocessing.Process(target=consumer)
-    consumer_process.start()
-    consumer_process.join()
+    if CACHE_SHARED:
+        manager = multiprocessing.Manager()
+        program_cache.share(manager)
+        result_cache.share(manager)
+    workers = [start_worker() for _ in range(N_WORKERS)]
+    while True:
+        for i, process in enumerate(workers):
+            process.join(timeout=1)
+            if not process.is_alive():
+                logger.warning(f"Worker {process.pid} exited, restarting.")
+                workers[i] = start_worker()
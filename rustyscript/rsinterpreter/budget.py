@@ -0,0 +1,120 @@
+"""Limits of the resources one job may use."""
+
+import time
+
+from .interpreter import BudgetError, ErrorCode, MAX_CALL_DEPTH, MAX_ARRAY_CELLS
+
+# instructions between two looks at the clock
+CLOCK_CHECK_INTERVAL = 1024
+
+
+class Budget:
+    """Instruction, wall-clock and memory limits of one job.
+
+    One budget is shared by every robot of a mission. ``instructions``
+    counts the VM instructions executed, so it aborts a program at the same
+    point on every run; ``seconds`` is a wall-clock deadline counted from
+    the creation of the budget and is checked every CLOCK_CHECK_INTERVAL
+    instructions. The job state a program can grow is bounded by
+    ``int_bits``, the size of every value stored in a variable, and
+    ``frames``, the number of captured frames. None means no limit.
+    ``call_depth`` bounds the nested procedure calls and ``array_cells``
+    the array elements alive at once, 8 bytes each; both are always set,
+    so a runaway recursion or a huge array fails fast instead of filling
+    the memory.
+
+    A pickled budget keeps the seconds left, not the deadline, so a job
+    restored in another worker runs for the rest of its time.
+    """
+
+    def __init__(
+        self,
+        instructions: int = None,
+        seconds: float = None,
+        int_bits: int = None,
+        frames: int = None,
+        call_depth: int = MAX_CALL_DEPTH,
+        array_cells: int = MAX_ARRAY_CELLS,
+    ):
+        self.instructions = instructions
+        self.seconds = seconds
+        self.int_bits = int_bits
+        self.frames = frames
+        self.call_depth = call_depth
+        self.array_cells = array_cells
+        self.used = 0
+        self.n_frames = 0
+        # a run that hit the deadline is not reproducible
+        self.timed_out = False
+        self.max_used = float("inf") if instructions is None else instructions
+        if seconds is None:
+            self.deadline = None
+            self.next_clock_check = float("inf")
+        else:
+            self.deadline = time.monotonic() + seconds
+            self.next_clock_check = CLOCK_CHECK_INTERVAL
+        # charge() looks at the limits only once used reaches next_check
+        self.next_check = min(self.max_used + 1, self.next_clock_check)
+        # every int stored in a variable is in (-int_limit, int_limit)
+        self.int_limit = None if int_bits is None else 1 << int_bits
+
+    @staticmethod
+    def error(message: str):
+        return BudgetError(error_code=ErrorCode.BUDGET_EXCEEDED, message=message)
+
+    def charge(self, instructions: int):
+        self.used += instructions
+        if self.used >= self.next_check:
+            self.check()
+
+    def check(self):
+        """The limits of charge(), inlined by the fused loops."""
+        if self.used > self.max_used:
+            raise self.error(f"more than {self.instructions} instructions")
+        if self.used >= self.next_clock_check:
+            self.next_clock_check = self.used + CLOCK_CHECK_INTERVAL
+            if time.monotonic() > self.deadline:
+                self.timed_out = True
+                raise self.error(f"longer than {self.seconds} seconds")
+        self.next_check = min(self.max_used + 1, self.next_clock_check)
+
+    def check_value(self, value):
+        limit = self.int_limit
+        if limit is not None and value.__class__ is int and not -limit < value < limit:
+            raise self.error(f"a value larger than {self.int_bits} bits")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.deadline is not None:
+            # the clock of another process starts elsewhere, keep the time
+            # left instead
+            state["deadline"] = self.deadline - time.monotonic()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.deadline is not None:
+            self.deadline += time.monotonic()
+
+    def renew(self, limits: "Budget"):
+        """Run on under the limits and the deadline of ``limits``, keeping
+        the resources used so far."""
+        self.instructions = limits.instructions
+        self.seconds = limits.seconds
+        self.int_bits = limits.int_bits
+        self.frames = limits.frames
+        self.call_depth = limits.call_depth
+        self.array_cells = limits.array_cells
+        self.max_used = limits.max_used
+        self.deadline = limits.deadline
+        if self.deadline is None:
+            self.next_clock_check = float("inf")
+        else:
+            self.next_clock_check = self.used + CLOCK_CHECK_INTERVAL
+        self.next_check = min(self.max_used + 1, self.next_clock_check)
+        self.int_limit = limits.int_limit
+
+    def add_frame(self):
+        self.n_frames += 1
+        if self.frames is not None and self.n_frames > self.frames:
+            raise self.error(f"more than {self.frames} frames")
@@ -0,0 +1,144 @@
+"""Content-addressed caches of compiled programs and simulation results."""
+
+import collections
+import hashlib
+
+from .interpreter import Lexer, Parser, Error
+
+
+class CacheEntry:
+    """A compiled program or the error it failed to compile with."""
+
+    def __init__(self, key: str, code=None, error: Error = None):
+        self.key = key
+        self.code = code
+        self.error = error
+
+    def __repr__(self):
+        return f"<CacheEntry(code={self.code}, error={self.error and self.error.message})>"
+
+
+def normalize(text: str) -> str:
+    """Drop trailing whitespace so that it doesn't change the cache key.
+
+    Only whitespace at the end of lines is removed, so the line and column
+    numbers in error messages stay the same as for the original text.
+    """
+    return "\n".join(line.rstrip() for line in text.split("\n")).rstrip()
+
+
+class LRUCache:
+    """Size bounded LRU with hit/miss counters.
+
+    Every process keeps its own LRU. After share() the entries are also
+    published into a dict owned by a multiprocessing.Manager, so a value
+    computed by one worker is a hit for all the others.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.manager = None
+        self.shared = None
+        self.hits = 0
+        self.misses = 0
+
+    def share(self, manager):
+        # keep a reference, the manager process shuts down once it is collected
+        self.manager = manager
+        self.shared = manager.dict()
+
+    def lookup(self, key: str):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.hits += 1
+                self._store(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def store(self, key: str, value):
+        self._store(key, value)
+        if self.shared is not None:
+            self._publish(key, value)
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def _publish(self, key, value):
+        self.shared[key] = value
+        # the shared dict keeps insertion order, so evict the oldest entries
+        overflow = len(self.shared) - self.maxsize
+        if overflow > 0:
+            for old_key in list(self.shared.keys())[:overflow]:
+                self.shared.pop(old_key, None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "shared_size": len(self.shared) if self.shared is not None else None,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+class ProgramCache(LRUCache):
+    """Mission.compile() results keyed by source and the level's modules."""
+
+    @staticmethod
+    def key(text: str, mission) -> str:
+        modules = ",".join(sorted(module.name for module in mission.build()))
+        digest = hashlib.sha256(modules.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, text: str, mission) -> CacheEntry:
+        text = normalize(text)
+        key = self.key(text, mission)
+        entry = self.lookup(key)
+        if entry is None:
+            entry = self.compile(key, text, mission)
+            self.store(key, entry)
+        return entry
+
+    @staticmethod
+    def compile(key: str, text: str, mission) -> CacheEntry:
+        try:
+            tree = Parser(Lexer(text)).parse()
+            return CacheEntry(key, code=mission.compile(tree))
+        except Error as e:
+            return CacheEntry(key, error=e)
+
+
+class ResultCache(LRUCache):
+    """Finished simulation results keyed by (level, program, seed).
+
+    A run is fully determined by these three, so a stored result can be
+    returned instead of simulating the mission again.
+    """
+
+    @staticmethod
+    def key(level: str, program_key: str, seed: int) -> str:
+        return f"{level}:{program_key}:{seed}"
+
+    def get(self, level: str, program_key: str, seed: int):
+        return self.lookup(self.key(level, program_key, seed))
+
+    def put(self, level: str, program_key: str, seed: int, result: dict):
+        self.store(self.key(level, program_key, seed), result)
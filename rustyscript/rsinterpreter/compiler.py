@@ -0,0 +1,376 @@
+"""Bytecode compiler for the ShizoSkript AST."""
+
+from .interpreter import (
+    NodeVisitor,
+    BoolOp,
+    ArrayType,
+    Subscript,
+    ARRAY_TYPECODES,
+    TokenType,
+    Error,
+    ErrorCode,
+)
+
+# Maximum number of iterations of a single while statement, same as in
+# Interpreter.visit_WhileStatement
+MAX_LOOP_ITERATIONS = 1000
+
+
+class Op:
+    # instructions that take one step each (they are followed by a yield)
+    STEP = 0  # NoOp, VarDecl, ProcedureDecl, program start
+    CONST = 1  # push consts[arg]
+    LOAD = 2  # push slots[arg] of the current record
+    # instructions that are executed between steps
+    STORE = 3  # slots[arg] = pop() of the current record
+    ADD = 4
+    SUB = 5
+    MUL = 6
+    INTEGER_DIV = 7
+    FLOAT_DIV = 8
+    EQUAL = 9
+    NOT_EQUAL = 10
+    MORE = 11
+    LESS = 12
+    BINARY_NONE = 13  # unsupported comparison, pushes None
+    NEG = 14
+    POS = 15
+    JUMP = 16  # pc = arg
+    JUMP_IF_FALSE = 17  # pc = arg if not pop()
+    LOOP_ENTER = 18  # push the iteration counter of a while statement
+    LOOP_NEXT = 19  # pc = arg if the counter is exhausted, else increment it
+    POP = 20
+    # arg = (depth, slot, n_params), pumps the module function generator or
+    # enters the procedure, the call of a procedure takes a step
+    CALL = 21
+    HALT = 22
+    JUMP_IF_TRUE = 23  # pc = arg if pop()
+    # short-circuit AND / OR: keep the result (0 or 1) and jump, or pop
+    JUMP_IF_FALSE_OR_POP = 24
+    JUMP_IF_TRUE_OR_POP = 25
+    BOOL = 26  # replace the top with 0 or 1
+    LOAD_OUTER = 27  # arg = (depth, slot) of an enclosing record, a step
+    STORE_OUTER = 28  # arg = (depth, slot) of an enclosing record
+    DEFINE = 29  # arg = (slot, index), slots[slot] = procedures[index]
+    RETURN = 30  # leave the procedure
+    ARRAY = 31  # arg = (slot, typecode, size), allocates the array, a step
+    # arg = (depth, slot, low), the index is on the top of the stack
+    LOAD_ELEMENT = 32  # a step
+    STORE_ELEMENT = 33  # the value is under the index
+    # arg = (depth, slot) of a module function read as a variable, pushes 0,
+    # a step
+    LOAD_FUNC = 34
+    # arg = index of the FusedLoop running the loop that starts here, it is
+    # LOOP_ENTER in the code that was not fused, see fusion.py
+    LOOP_FUSED = 35
+
+    @classmethod
+    def name(cls, op):
+        for key, value in vars(cls).items():
+            if value == op and key.isupper():
+                return key
+        return str(op)
+
+
+BINARY_OPS = {
+    TokenType.PLUS: Op.ADD,
+    TokenType.MINUS: Op.SUB,
+    TokenType.MUL: Op.MUL,
+    TokenType.INTEGER_DIV: Op.INTEGER_DIV,
+    TokenType.FLOAT_DIV: Op.FLOAT_DIV,
+    TokenType.EQUAL: Op.EQUAL,
+    TokenType.NOT_EQUAL: Op.NOT_EQUAL,
+    TokenType.MORE: Op.MORE,
+    TokenType.LESS: Op.LESS,
+}
+
+
+class Procedure:
+    """A user procedure, its code is code[entry:end]."""
+
+    __slots__ = ("name", "entry", "end", "n_params", "n_slots", "names")
+
+    def __init__(self, name, entry, n_params, n_slots, names):
+        self.name = name
+        self.entry = entry
+        self.end = None
+        self.n_params = n_params
+        # size of the activation record
+        self.n_slots = n_slots
+        # slot index -> name of a parameter, variable or procedure
+        self.names = names
+
+    def __repr__(self):
+        return f"<Procedure(name={self.name}, entry={self.entry})>"
+
+
+class CodeObject:
+    def __init__(self, name, code, consts, names, uses, procedures=(), loops=()):
+        self.name = name
+        # list of (op, arg) tuples
+        self.code = code
+        self.consts = consts
+        # slot index -> name of a global variable, module function or procedure
+        self.names = names
+        self.uses = uses
+        self.procedures = list(procedures)
+        # FusedLoops of the LOOP_FUSED instructions
+        self.loops = list(loops)
+
+    def scope(self, pc, depth=0):
+        """Names of the slots of the record ``depth`` scopes out of the one
+        the instruction at pc runs in."""
+        # procedures are compiled inside their enclosing one
+        scopes = sorted(
+            (p for p in self.procedures if p.entry <= pc < p.end),
+            key=lambda p: p.entry,
+            reverse=True,
+        )
+        scopes = [p.names for p in scopes] + [self.names]
+        return scopes[depth]
+
+    def dis(self):
+        lines = [f"CODE {self.name}"]
+        for pc, (op, arg) in enumerate(self.code):
+            if op == Op.CONST:
+                arg = f"{arg} ({self.consts[arg]!r})"
+            elif op in (Op.LOAD, Op.STORE):
+                arg = f"{arg} ({self.scope(pc)[arg]})"
+            elif op in (
+                Op.LOAD_OUTER,
+                Op.STORE_OUTER,
+                Op.LOAD_FUNC,
+                Op.CALL,
+                Op.LOAD_ELEMENT,
+                Op.STORE_ELEMENT,
+            ):
+                arg = f"{arg} ({self.scope(pc, arg[0])[arg[1]]})"
+            elif op == Op.ARRAY:
+                arg = f"{arg} ({self.scope(pc)[arg[0]]})"
+            elif op == Op.DEFINE:
+                arg = f"{arg} ({self.procedures[arg[1]].name})"
+            elif op == Op.LOOP_FUSED:
+                arg = f"{arg} (to {self.loops[arg].end})"
+            for procedure in self.procedures:
+                if procedure.entry == pc:
+                    lines.append(f"PROCEDURE {procedure.name}")
+            lines.append(f"{pc:>5} {Op.name(op):<15} {'' if arg is None else arg}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"<CodeObject(name={self.name}, size={len(self.code)})>"
+
+
+class Compiler(NodeVisitor):
+    """Translates an analyzed AST into a flat list of instructions.
+
+    Every instruction that corresponds to a yield of the tree walking
+    Interpreter is a "step" instruction, so the VM takes exactly the same
+    number of steps as Interpreter.interpret() for the same program.
+    """
+
+    def __init__(self, modules: dict = None):
+        self.modules = modules or {}
+        self.code = []
+        self.consts = []
+        # names of the slots of the scope being compiled
+        self.names = []
+        self.procedures = []
+        # (WhileStatement, pc of its LOOP_ENTER) in the order of the program
+        self.loops = []
+        self._const_index = {}
+
+    def emit(self, op, arg=None):
+        self.code.append((op, arg))
+        return len(self.code) - 1
+
+    def patch(self, index, arg):
+        self.code[index] = (self.code[index][0], arg)
+
+    def const(self, value):
+        key = (type(value), value)
+        if key not in self._const_index:
+            self._const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return self._const_index[key]
+
+    def compile(self, tree) -> CodeObject:
+        self.visit(tree)
+        self.emit(Op.HALT)
+        return CodeObject(
+            name=tree.name,
+            code=self.code,
+            consts=self.consts,
+            names=self.names,
+            uses=list(tree.uses),
+            procedures=self.procedures,
+        )
+
+    def visit_Program(self, node):
+        self.emit(Op.STEP)
+        for module in node.uses:
+            if module not in self.modules:
+                raise Error(
+                    error_code=ErrorCode.ID_NOT_FOUND, token=node, message=module
+                )
+        self.names = [None] * node.n_slots
+        for func, slot in node.functions.items():
+            self.names[slot] = func
+        self.visit(node.block)
+
+    def visit_Block(self, node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_VarDecl(self, node):
+        slot = node.var_node.address[1]
+        self.names[slot] = node.var_node.value
+        type_node = node.type_node
+        if isinstance(type_node, ArrayType):
+            typecode = ARRAY_TYPECODES[type_node.element.value]
+            size = type_node.high - type_node.low + 1
+            self.emit(Op.ARRAY, (slot, typecode, size))
+        else:
+            self.emit(Op.STEP)
+
+    def visit_ProcedureDecl(self, node):
+        self.names[node.slot] = node.proc_name
+        self.emit(Op.STEP)
+        self.emit(Op.DEFINE, (node.slot, len(self.procedures)))
+        # the body runs on calls only
+        jump_over = self.emit(Op.JUMP)
+
+        names = self.names
+        self.names = [None] * node.n_slots
+        for slot, param in enumerate(node.params):
+            self.names[slot] = param.var_node.value
+        procedure = Procedure(
+            name=node.proc_name,
+            entry=len(self.code),
+            n_params=len(node.params),
+            n_slots=node.n_slots,
+            names=self.names,
+        )
+        self.procedures.append(procedure)
+        self.visit(node.block_node)
+        self.emit(Op.RETURN)
+        procedure.end = len(self.code)
+        self.names = names
+
+        self.patch(jump_over, len(self.code))
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_NoOp(self, node):
+        for _ in range(node.steps):
+            self.emit(Op.STEP)
+
+    def visit_Num(self, node):
+        self.emit(Op.CONST, self.const(node.value))
+        for _ in range(node.steps - 1):
+            self.emit(Op.STEP)
+
+    def visit_Var(self, node):
+        depth, slot = node.address
+        if node.is_func:
+            self.emit(Op.LOAD_FUNC, node.address)
+        elif depth:
+            self.emit(Op.LOAD_OUTER, node.address)
+        else:
+            self.emit(Op.LOAD, slot)
+
+    def visit_Subscript(self, node):
+        self.visit(node.index)
+        depth, slot = node.var_node.address
+        self.emit(Op.LOAD_ELEMENT, (depth, slot, node.low))
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        if isinstance(node.left, Subscript):
+            self.visit(node.left.index)
+            depth, slot = node.left.var_node.address
+            self.emit(Op.STORE_ELEMENT, (depth, slot, node.left.low))
+            return
+        depth, slot = node.left.address
+        if depth:
+            self.emit(Op.STORE_OUTER, node.left.address)
+        else:
+            self.emit(Op.STORE, slot)
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        if node.op.type == TokenType.MINUS:
+            self.emit(Op.NEG)
+        else:
+            self.emit(Op.POS)
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(BINARY_OPS.get(node.op.type, Op.BINARY_NONE))
+
+    def visit_BoolOp(self, node):
+        self.visit(node.left)
+        if node.op.type == TokenType.AND:
+            jump = self.emit(Op.JUMP_IF_FALSE_OR_POP)
+        else:
+            jump = self.emit(Op.JUMP_IF_TRUE_OR_POP)
+        self.visit(node.right)
+        self.emit(Op.BOOL)
+        self.patch(jump, len(self.code))
+
+    def jump_if(self, node, value: bool) -> list:
+        """Emit a condition that jumps if it is value, else falls through.
+
+        AND / OR compile to chains of jumps without computing the result;
+        returns the jumps to patch with the target.
+        """
+        if isinstance(node, BoolOp):
+            # the operator decides on value when (AND, False) or (OR, True)
+            decides = (node.op.type == TokenType.OR) == value
+            if decides:
+                return self.jump_if(node.left, value) + self.jump_if(
+                    node.right, value
+                )
+            skip = self.jump_if(node.left, not value)
+            jumps = self.jump_if(node.right, value)
+            for index in skip:
+                self.patch(index, len(self.code))
+            return jumps
+        self.visit(node)
+        return [self.emit(Op.JUMP_IF_TRUE if value else Op.JUMP_IF_FALSE)]
+
+    def visit_IfElseStatement(self, node):
+        jumps_to_else = self.jump_if(node.comp, False)
+        self.visit(node.on_true)
+        jump_to_end = self.emit(Op.JUMP)
+        for index in jumps_to_else:
+            self.patch(index, len(self.code))
+        self.visit(node.on_false)
+        self.patch(jump_to_end, len(self.code))
+
+    def visit_WhileStatement(self, node):
+        self.loops.append((node, self.emit(Op.LOOP_ENTER)))
+        start = len(self.code)
+        jumps_if_false = self.jump_if(node.comp, False)
+        loop_next = self.emit(Op.LOOP_NEXT)
+        self.visit(node.body)
+        self.emit(Op.JUMP, start)
+        end = self.emit(Op.POP)
+        for index in jumps_if_false:
+            self.patch(index, end)
+        self.patch(loop_next, end)
+
+    def visit_ProcedureCall(self, node):
+        for param in node.actual_params:
+            self.visit(param)
+        depth, slot = node.address
+        self.emit(Op.CALL, (depth, slot, len(node.actual_params)))
+
+
+def compile_program(tree, modules: dict = None) -> CodeObject:
+    return Compiler(modules).compile(tree)
+
@@ -0,0 +1,70 @@
+"""Compact delta encoding of the frames returned by RustyScriptInterpreter.
+
+A frame is a list of rows of ``(char, color)`` cells. Frames are sent in
+blocks::
+
+    {
+        "v": 1,                 # FRAME_FORMAT
+        "palette": [...],       # colors first used in this block
+        "frames": [...],
+    }
+
+Colors are replaced with their index in the palette, which grows from
+block to block. The first frame (and any frame of a different size) is a
+keyframe ``{"w": width, "k": chars, "c": colors}`` holding every cell in
+row order, every other frame is a flat list ``[index, char, color, ...]``
+of the cells that changed since the previous frame.
+"""
+
+import typing
+
+FRAME_FORMAT = 1
+
+
+class FrameEncoder:
+    """Encodes consecutive frames of one run, block after block."""
+
+    def __init__(self):
+        self.palette: typing.Dict[str, int] = {}
+        self.size = None
+        self.chars = None
+        self.colors = None
+
+    def color(self, name: str, new_colors: list) -> int:
+        index = self.palette.get(name)
+        if index is None:
+            index = self.palette[name] = len(self.palette)
+            new_colors.append(name)
+        return index
+
+    def encode(self, frames: list) -> dict:
+        new_colors = []
+        encoded = []
+        for frame in frames:
+            size = [len(frame[0]) if frame else 0, len(frame)]
+            chars = [cell[0] for row in frame for cell in row]
+            colors = [self.color(cell[1], new_colors) for row in frame for cell in row]
+
+            if size != self.size:
+                self.size = size
+                if all(len(char) == 1 for char in chars):
+                    encoded.append({"w": size[0], "k": "".join(chars), "c": colors})
+                else:
+                    encoded.append({"w": size[0], "k": chars, "c": colors})
+            else:
+                delta = []
+                previous_chars = self.chars
+                previous_colors = self.colors
+                for i in range(len(chars)):
+                    if chars[i] != previous_chars[i] or colors[i] != previous_colors[i]:
+                        delta.extend((i, chars[i], colors[i]))
+                encoded.append(delta)
+
+            self.chars = chars
+            self.colors = colors
+
+        return {
+            "v": FRAME_FORMAT,
+            "palette": new_colors,
+            "frames": encoded,
+        }
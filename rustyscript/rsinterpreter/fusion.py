@@ -0,0 +1,397 @@
+"""Fusion of pure while loops into Python generator functions.
+
+A while loop whose body only computes and stores scalar variables spends
+most of its time in the dispatch chain of VM.run. fuse() replaces the
+first instruction of such a loop with LOOP_FUSED, which runs the whole
+loop as one generated Python generator function: the variables are read
+and written in the same records, the function yields on the same steps,
+charges the budget with the same numbers of instructions and raises the
+same errors as the instructions it replaces, so the scheduling of the
+robots and the budgets do not change. The instructions of the loop stay
+in the code after LOOP_FUSED, a VM pickled inside the loop goes on with
+them, see VM.__getstate__.
+"""
+
+from .compiler import Op, CodeObject, MAX_LOOP_ITERATIONS
+from .interpreter import (
+    NodeVisitor,
+    Error,
+    ErrorCode,
+    TokenType,
+    Num,
+    Var,
+    BinOp,
+    UnaryOp,
+    BoolOp,
+    Assign,
+    Compound,
+    NoOp,
+    IfElseStatement,
+    WhileStatement,
+)
+
+BINARY_SOURCE = {
+    Op.ADD: "{} = {} + {}",
+    Op.SUB: "{} = {} - {}",
+    Op.MUL: "{} = {} * {}",
+    Op.INTEGER_DIV: "{} = {} // {}",
+    Op.FLOAT_DIV: "{} = {} / {}",
+    Op.EQUAL: "{} = 1 if {} == {} else 0",
+    Op.NOT_EQUAL: "{} = 1 if {} != {} else 0",
+    Op.MORE: "{} = 1 if {} > {} else 0",
+    Op.LESS: "{} = 1 if {} < {} else 0",
+}
+BINARY_OPERATORS = {
+    TokenType.PLUS,
+    TokenType.MINUS,
+    TokenType.MUL,
+    TokenType.INTEGER_DIV,
+    TokenType.FLOAT_DIV,
+    TokenType.EQUAL,
+    TokenType.NOT_EQUAL,
+    TokenType.MORE,
+    TokenType.LESS,
+}
+
+
+def is_pure(node) -> bool:
+    """Whether a statement or an expression only reads and writes scalar
+    variables: no calls, arrays or module functions."""
+    if isinstance(node, (Num, NoOp)):
+        return True
+    if isinstance(node, Var):
+        return not node.is_func
+    if isinstance(node, BinOp):
+        return (
+            node.op.type in BINARY_OPERATORS
+            and is_pure(node.left)
+            and is_pure(node.right)
+        )
+    if isinstance(node, BoolOp):
+        return is_pure(node.left) and is_pure(node.right)
+    if isinstance(node, UnaryOp):
+        return is_pure(node.expr)
+    if isinstance(node, Assign):
+        return isinstance(node.left, Var) and is_pure(node.right)
+    if isinstance(node, Compound):
+        return all(is_pure(child) for child in node.children)
+    if isinstance(node, IfElseStatement):
+        return is_pure(node.comp) and is_pure(node.on_true) and is_pure(node.on_false)
+    if isinstance(node, WhileStatement):
+        return is_pure(node.comp) and is_pure(node.body)
+    return False
+
+
+class FusedLoop:
+    """A while loop compiled into the generator function ``loop``.
+
+    ``function(vm, record, executed, budget, check_values, check_value,
+    consts)`` runs code[entry:end] in the activation record ``record`` and
+    returns the instructions executed since the budget was last charged.
+    The source is built from instruction arguments only, the function is
+    compiled on first use and again after unpickling.
+
+    ``stacks[pc]`` are the local variables of the function holding the
+    values the plain instructions would have on the VM stack at the step
+    that ends before pc, bottom first.
+    """
+
+    def __init__(self, source: str, entry: int, end: int, stacks: dict):
+        self.source = source
+        self.entry = entry
+        self.end = end
+        self.stacks = stacks
+        self._function = None
+
+    @property
+    def function(self):
+        if self._function is None:
+            namespace = {"Error": Error, "ErrorCode": ErrorCode}
+            exec(compile(self.source, f"<loop {self.entry}>", "exec"), namespace)
+            self._function = namespace["loop"]
+        return self._function
+
+    def __getstate__(self):
+        return {
+            "source": self.source,
+            "entry": self.entry,
+            "end": self.end,
+            "stacks": self.stacks,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._function = None
+
+    def __repr__(self):
+        return f"<FusedLoop(entry={self.entry}, end={self.end})>"
+
+
+class LoopFuser(NodeVisitor):
+    """Translates a pure while loop into Python source.
+
+    The tree of the loop is walked in the order the Compiler emitted its
+    instructions, taking the instructions one by one, so every step knows
+    its pc and every instruction is counted. The instructions counted
+    since the last step are kept in ``pending`` while the code runs
+    straight, and are added to the ``executed`` variable of the generated
+    function before its control flow splits or joins.
+    """
+
+    def __init__(self, code: list):
+        self.code = code
+        self.pc = 0
+        self.lines = []
+        self.indent = 1
+        self.pending = 0
+        # whether the executed variable holds the uncharged instructions,
+        # it is stale after a step
+        self.dirty = True
+        self.names = 0
+        self.outer = set()
+        self.consts = set()
+        # names of the values on the VM stack of the plain instructions
+        self.stack = []
+        self.stacks = {}
+
+    def fuse(self, node, entry: int) -> FusedLoop:
+        # LOOP_FUSED itself is counted by the VM
+        self.pc = entry + 1
+        self.loop(node)
+        if self.dirty:
+            self.emit(f"return executed + {self.pending}")
+        else:
+            self.emit(f"return {self.pending}")
+
+        prologue = ["slots = record.slots"]
+        for depth in sorted(self.outer):
+            enclosing = "record" + ".enclosing" * depth
+            prologue.append(f"outer{depth} = {enclosing}.slots")
+        for index in sorted(self.consts):
+            prologue.append(f"k{index} = consts[{index}]")
+        lines = [
+            "def loop(vm, record, executed, budget, check_values, check_value, "
+            "consts):"
+        ]
+        lines.extend("    " + line for line in prologue)
+        lines.extend(self.lines)
+        return FusedLoop("\n".join(lines) + "\n", entry, self.pc, self.stacks)
+
+    def emit(self, line: str):
+        self.lines.append("    " * self.indent + line)
+
+    def name(self, prefix: str = "t") -> str:
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def take(self, *ops):
+        """The next (op, arg), op must be one of ops."""
+        op, arg = self.code[self.pc]
+        if op not in ops:
+            raise ValueError(f"can not fuse {Op.name(op)} at {self.pc}")
+        self.pc += 1
+        self.pending += 1
+        return op, arg
+
+    def flush(self):
+        """Add the pending instructions to the executed variable."""
+        if not self.dirty:
+            self.emit(f"executed = {self.pending}")
+        elif self.pending:
+            self.emit(f"executed += {self.pending}")
+        self.dirty = True
+        self.pending = 0
+
+    def step(self):
+        # Budget.charge without the call
+        if self.dirty:
+            self.emit(f"budget.used += executed + {self.pending}")
+        else:
+            self.emit(f"budget.used += {self.pending}")
+        self.emit("if budget.used >= budget.next_check: budget.check()")
+        self.emit(f"vm.pc = {self.pc}")
+        self.emit("yield")
+        self.stacks[self.pc] = tuple(self.stack)
+        self.dirty = False
+        self.pending = 0
+
+    def block(self, visit, *args):
+        """Run visit(*args) one level deeper, the code it emits is a block."""
+        self.indent += 1
+        size = len(self.lines)
+        result = visit(*args)
+        self.flush()
+        if len(self.lines) == size:
+            self.emit("pass")
+        self.indent -= 1
+        return result
+
+    def visit_Num(self, node):
+        _, index = self.take(Op.CONST)
+        self.consts.add(index)
+        value = self.name()
+        self.emit(f"{value} = k{index}")
+        self.stack.append(value)
+        self.step()
+        for _ in range(node.steps - 1):
+            self.take(Op.STEP)
+            self.step()
+        return value
+
+    def visit_Var(self, node):
+        value = self.name()
+        op, arg = self.take(Op.LOAD, Op.LOAD_OUTER)
+        if op == Op.LOAD:
+            self.emit(f"{value} = slots[{arg}]")
+        else:
+            depth, slot = arg
+            self.outer.add(depth)
+            self.emit(f"{value} = outer{depth}[{slot}]")
+        self.stack.append(value)
+        self.step()
+        return value
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.expr)
+        op, _ = self.take(Op.NEG, Op.POS)
+        value = self.name()
+        self.emit(f"{value} = {'-' if op == Op.NEG else '+'}{operand}")
+        self.stack[-1] = value
+        return value
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        op, _ = self.take(*BINARY_SOURCE)
+        if op in (Op.INTEGER_DIV, Op.FLOAT_DIV):
+            self.emit(f"if {right} == 0:")
+            self.emit(f"    raise Error(ErrorCode.ZERO_DIVISION, token={right})")
+        value = self.name()
+        self.emit(BINARY_SOURCE[op].format(value, left, right))
+        self.stack.pop()
+        self.stack[-1] = value
+        return value
+
+    def visit_BoolOp(self, node):
+        left = self.visit(node.left)
+        if node.op.type == TokenType.AND:
+            self.take(Op.JUMP_IF_FALSE_OR_POP)
+            decided = "0"
+        else:
+            self.take(Op.JUMP_IF_TRUE_OR_POP)
+            decided = "1"
+        # the right operand replaces the left one
+        self.stack.pop()
+        value = self.name()
+        self.emit(f"{value} = {decided}")
+        self.flush()
+        self.emit(f"if {left}:" if decided == "0" else f"if not {left}:")
+        self.block(self.bool_right, node.right, value)
+        self.stack.append(value)
+        return value
+
+    def bool_right(self, node, value):
+        right = self.visit(node)
+        self.take(Op.BOOL)
+        self.emit(f"{value} = 1 if {right} else 0")
+        self.stack.pop()
+
+    def condition(self, node) -> str:
+        """Name of a value as true as the condition, see Compiler.jump_if."""
+        if isinstance(node, BoolOp):
+            left = self.condition(node.left)
+            value = self.name()
+            self.emit(f"{value} = {left}")
+            self.flush()
+            if node.op.type == TokenType.AND:
+                self.emit(f"if {value}:")
+            else:
+                self.emit(f"if not {value}:")
+            self.block(self.condition_right, node.right, value)
+            return value
+        value = self.visit(node)
+        self.take(Op.JUMP_IF_TRUE, Op.JUMP_IF_FALSE)
+        self.stack.pop()
+        return value
+
+    def condition_right(self, node, value):
+        self.emit(f"{value} = {self.condition(node)}")
+
+    def visit_Assign(self, node):
+        value = self.visit(node.right)
+        op, arg = self.take(Op.STORE, Op.STORE_OUTER)
+        self.stack.pop()
+        self.emit(f"if check_values: check_value({value})")
+        if op == Op.STORE:
+            self.emit(f"slots[{arg}] = {value}")
+        else:
+            depth, slot = arg
+            self.outer.add(depth)
+            self.emit(f"outer{depth}[{slot}] = {value}")
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_NoOp(self, node):
+        for _ in range(node.steps):
+            self.take(Op.STEP)
+            self.step()
+
+    def visit_IfElseStatement(self, node):
+        value = self.condition(node.comp)
+        self.flush()
+        self.emit(f"if {value}:")
+        self.block(self.on_true, node.on_true)
+        self.emit("else:")
+        self.block(self.visit, node.on_false)
+
+    def on_true(self, node):
+        self.visit(node)
+        self.take(Op.JUMP)
+
+    def visit_WhileStatement(self, node):
+        self.take(Op.LOOP_ENTER)
+        self.loop(node)
+
+    def loop(self, node):
+        counter = self.name("n")
+        self.emit(f"{counter} = 0")
+        self.stack.append(counter)
+        self.flush()
+        self.emit("while True:")
+        self.block(self.iteration, node, counter)
+        self.take(Op.POP)
+        self.stack.pop()
+
+    def iteration(self, node, counter):
+        value = self.condition(node.comp)
+        self.flush()
+        self.emit(f"if not {value}:")
+        self.emit("    break")
+        self.take(Op.LOOP_NEXT)
+        self.flush()
+        self.emit(f"if {counter} >= {MAX_LOOP_ITERATIONS}:")
+        self.emit("    break")
+        self.emit(f"{counter} += 1")
+        self.visit(node.body)
+        self.take(Op.JUMP)
+
+
+def fuse(code: CodeObject, loops: list) -> int:
+    """Fuse the outermost pure loops of the compiled program, returns their
+    number. ``loops`` are the while statements and the pcs of their
+    LOOP_ENTER instructions in the order of the program, see
+    Compiler.loops."""
+    fused = 0
+    end = 0
+    for node, entry in loops:
+        # the loops nested in a fused one run in its function
+        if entry < end or not is_pure(node):
+            continue
+        loop = LoopFuser(code.code).fuse(node, entry)
+        code.code[entry] = (Op.LOOP_FUSED, len(code.loops))
+        code.loops.append(loop)
+        end = loop.end
+        fused += 1
+    return fused
@@ -1,18 +1,32 @@
 import typing
 import random
+import pickle
+import hashlib
+import array
+import hmac
+import zlib
 
 from colorama import Fore
 from pydantic import BaseModel
 from .interpreter import (
-    Interpreter,
     SemanticAnalyzer,
     Parser,
     Lexer,
     LexerError,
     ParserError,
     SemanticError,
+    SnapshotError,
+    ErrorCode,
 )
+from .compiler import Compiler
+from .optimizer import optimize, OptimizerStats
+from .fusion import fuse
+from .vm import VM
+from .budget import Budget
+from .scheduler import Scheduler
+from .modules import describe
 from abc import ABC, abstractmethod
+from enum import Enum
 
 colors = {
     "dust": Fore.LIGHTBLACK_EX,
@@ -20,6 +34,17 @@ colors = {
     "default": Fore.LIGHTBLACK_EX,
 }
 
+# the last step of a mission, counting from 0
+MAX_STEPS = 200
+
+# readable by every Python the workers run on
+SNAPSHOT_PROTOCOL = 4
+# snapshots are signed with an HMAC of this hash
+SNAPSHOT_DIGEST = hashlib.sha256
+SNAPSHOT_DIGEST_SIZE = SNAPSHOT_DIGEST().digest_size
+# bytes of pickled state at most in a snapshot
+MAX_SNAPSHOT_SIZE = 1 << 22
+
 PLAYER_POSITION: typing.List[typing.List[int]] = [[0, 0], [1, 1], [0, 1], [1, 0]]
 
 
@@ -39,14 +64,138 @@ class Tile:
             return self.items[0].get_char()
 
 
+class FrameMode(Enum):
+    ALL = "all"  # every frame_every-th step and the final one
+    FINAL = "final"  # only the final frame
+    NONE = "none"  # no frames at all, only the verdict and the step count
+
+
 class Mission(ABC):
     name: str
     description: str
     game = None
+    frame_mode: FrameMode = FrameMode.ALL
+    frame_every: int = 2
+    # called with every frame as soon as it is captured
+    on_frame: typing.Optional[typing.Callable[[list], None]] = None
+    budget: Budget = None
+    # run the step preserving AST optimizer on the programs
+    optimize_programs: bool = True
+    # statistics of the optimizer over every program compiled here
+    optimizer_stats = OptimizerStats()
+    # run the pure while loops as generated Python functions, see fusion.py
+    fuse_loops: bool = True
+    # ticks played so far, play() goes on from here
+    ticks: int = 0
+    # the verdict of play() once the mission is over
+    result: typing.Optional[dict] = None
+
+    @staticmethod
+    @abstractmethod
+    def build():
+        """Fresh instances of the robot modules available on this level."""
+        raise NotImplementedError
+
+    @classmethod
+    def compile(cls, ast):
+        """Check the program against the level's modules and compile it."""
+        modules = {module.name: module for module in cls.build()}
+        semantic_analyzer = SemanticAnalyzer(modules)
+        semantic_analyzer.visit(ast)
+        if cls.optimize_programs:
+            ast, _ = optimize(ast, stats=cls.optimizer_stats)
+        compiler = Compiler(modules)
+        code = compiler.compile(ast)
+        if cls.fuse_loops:
+            fuse(code, compiler.loops)
+        return code
+
+    def add_frame(self, frame):
+        self.budget.add_frame()
+        self.texts.append(frame)
+        if self.on_frame is not None:
+            self.on_frame(frame)
+
+    def capture(self, start: int, end: int):
+        """Capture the intermediate frames of steps ``start`` to ``end - 1``
+        that the frame mode asks for."""
+        every = self.frame_every
+        first = -(-start // every) * every
+        if self.frame_mode is FrameMode.ALL:
+            for _ in range(first, end, every):
+                self.add_frame(self.game.get_field())
+        elif first < end:
+            # the frames left out still take their particles away, so the
+            # final frame is the last one of an ALL run
+            self.game.drain_particles()
+
+    def capture_final(self):
+        if self.frame_mode is not FrameMode.NONE:
+            self.add_frame(self.game.get_field())
+
+    def snapshot(self, key: bytes) -> bytes:
+        """The whole state of a paused mission as a compressed blob: the
+        arena and its random generator, the robots with their VMs, the
+        scheduler, the budget and the frames captured so far.
+
+        A mission restored from it in any worker plays on exactly as this
+        one would. Unpickling runs code, so the blob is signed with ``key``
+        and restore() only unpickles blobs signed with the same key.
+        """
+        data = zlib.compress(pickle.dumps(self, protocol=SNAPSHOT_PROTOCOL))
+        return hmac.new(key, data, SNAPSHOT_DIGEST).digest() + data
+
+    @staticmethod
+    def restore(
+        blob: bytes,
+        key: bytes,
+        budget: Budget = None,
+        max_size: int = MAX_SNAPSHOT_SIZE,
+    ) -> "Mission":
+        """The mission of a snapshot() blob, it plays on under the limits of
+        ``budget`` if given. Raises SnapshotError for a blob that is not
+        signed with ``key`` or unpacks to more than ``max_size`` bytes."""
+        digest = blob[:SNAPSHOT_DIGEST_SIZE]
+        data = blob[SNAPSHOT_DIGEST_SIZE:]
+        if not hmac.compare_digest(
+            digest, hmac.new(key, data, SNAPSHOT_DIGEST).digest()
+        ):
+            raise SnapshotError(
+                error_code=ErrorCode.BAD_SNAPSHOT, message="wrong signature"
+            )
+        decompressor = zlib.decompressobj()
+        try:
+            state = decompressor.decompress(data, max_size)
+        except zlib.error as e:
+            raise SnapshotError(error_code=ErrorCode.BAD_SNAPSHOT, message=str(e))
+        if decompressor.unconsumed_tail:
+            raise SnapshotError(
+                error_code=ErrorCode.BAD_SNAPSHOT,
+                message=f"larger than {max_size} bytes",
+            )
+        if not decompressor.eof:
+            raise SnapshotError(
+                error_code=ErrorCode.BAD_SNAPSHOT, message="truncated"
+            )
+
+        mission = pickle.loads(state)
+        if budget is not None:
+            mission.budget.renew(budget)
+            # the call stacks copied the limits when the VMs were created
+            for player in mission.game.players:
+                player.vm.call_stack.max_depth = budget.call_depth
+                player.vm.call_stack.max_cells = budget.array_cells
+        return mission
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # a callback of the worker that played the mission so far
+        state.pop("on_frame", None)
+        return state
 
     @abstractmethod
     def check(self):
-        raise NotImplemented
+        raise NotImplementedError
 
 
 class CircusMission(Mission):
@@ -70,32 +219,63 @@ class CircusMission(Mission):
         [0, 0],
     ]
 
-    def __init__(self, ast):
-        build = [LegsModule()]
-        semantic_analyzer = SemanticAnalyzer({module.name: module for module in build})
-        semantic_analyzer.visit(ast)
-        self.player = Player(ast, build=build)
+    def __init__(
+        self,
+        code,
+        seed: int = None,
+        frame_mode: FrameMode = FrameMode.ALL,
+        frame_every: int = 2,
+        budget: Budget = None,
+    ):
+        self.frame_mode = frame_mode
+        self.frame_every = frame_every
+        self.budget = budget if budget is not None else Budget()
+        self.player = Player(code, build=self.build(), budget=self.budget)
         self.player.init_cords(0, 0)
         self.texts = []
-        self.game = RustyScriptInterpreter(players=[self.player], field_size=3)
+        self.game = RustyScriptInterpreter(
+            players=[self.player], field_size=3, seed=seed
+        )
+
+    @staticmethod
+    def build():
+        return [LegsModule()]
 
     def get_text(self):
         return self.texts
 
-    def play(self):
-        for step, _ in enumerate(self.game.turn()):
-            self.n_steps = step + 1
+    def play(self, turns: int = None):
+        """Play the mission to its end and return the verdict, or pause it
+        after ``turns`` turns of the scheduler and return None. The next
+        play() goes on where this one stopped."""
+        if self.result is not None:
+            return self.result
+        for ticks in self.game.turn():
+            # steps start to end - 1, only the first one can change the
+            # arena, the rest are idle
+            start = self.ticks
+            self.ticks = end = start + ticks
+            self.n_steps = start + 1
             if self.check():
-                self.texts.append(self.game.get_field())
-                break
-            if step == 200:
-                self.texts.append(self.game.get_field())
-                return {"result": 0, "description": "You lose!"}
-            if step % 2 == 0:
-                self.texts.append(self.game.get_field())
-        else:
-            return {"result": 0, "description": "You lose!"}
-        return {"result": 1, "description": "You win!"}
+                self.capture_final()
+                self.result = {"result": 1, "description": "You win!"}
+                return self.result
+            if end > MAX_STEPS:
+                self.capture(start, MAX_STEPS)
+                self.n_steps = MAX_STEPS + 1
+                self.capture_final()
+                self.result = {"result": 0, "description": "You lose!"}
+                return self.result
+            self.capture(start, end)
+            self.n_steps = end
+            if turns is not None:
+                turns -= 1
+                if turns <= 0:
+                    return None
+        if self.frame_mode is FrameMode.FINAL:
+            self.capture_final()
+        self.result = {"result": 0, "description": "You lose!"}
+        return self.result
 
     def check(self):
         if self.step == 0 and self.player.cords == self.player_cords[self.step]:
@@ -111,6 +291,10 @@ class CircusMission(Mission):
             return True
 
 
+# the missions by the names of the levels in the server's LEVELS
+MISSIONS: typing.Dict[str, Mission] = {"circus": CircusMission}
+
+
 class BasicParams(BaseModel):
     health: int
     cpu: int
@@ -118,6 +302,16 @@ class BasicParams(BaseModel):
 
 
 class RobotModule(ABC):
+    """A part of the robot, its functions are callable from the program.
+
+    ``other[name]`` describes the function ``func[name]``: ``n_params`` and
+    optionally ``duration``, from the table in modules.py. A function with
+    a duration is a timed action: a plain function that acts at once and
+    takes ``duration`` ticks, or a single tick if it returns a falsy value
+    (nothing was done). Without a duration the function is a generator
+    yielding once per tick.
+    """
+
     func: typing.Dict[str, typing.Callable]
     other: typing.Dict[str, dict]
     basic_params: BasicParams
@@ -132,7 +326,7 @@ class RobotModule(ABC):
 
     @abstractmethod
     def build_func(self):
-        raise NotImplemented
+        raise NotImplementedError
 
 
 class Debug(RobotModule):
@@ -140,12 +334,11 @@ class Debug(RobotModule):
     basic_params: BasicParams = BasicParams(health=0, cpu=0, weigh=1)
 
     def build_func(self):
-        return {"writeln": self.writeln}, {"writeln": {"n_params": -1}}
+        return {"writeln": self.writeln}, describe(self.name)
 
     @staticmethod
     def writeln(*args):
         print(*args)
-        yield from range(1)
 
 
 class LegsModule(RobotModule):
@@ -160,71 +353,49 @@ class LegsModule(RobotModule):
                 "left": self.go_left,
                 "right": self.go_right,
             },
-            {
-                "up": {"n_params": 0},
-                "down": {"n_params": 0},
-                "left": {"n_params": 0},
-                "right": {"n_params": 0},
-            },
+            describe(self.name),
         )
 
     def go_up(self):
-        if self.player.cords[1] - 1 >= 0 and self.player.game.is_empty(
-            self.player.cords[0], self.player.cords[1] - 1
-        ):
-            self.dust()
-            self.player.cords[1] -= 1
-            yield from range(2)
-            return 1
-        yield
-        return 0
+        return self.move(0, -1)
 
     def go_down(self):
-        if self.player.cords[
-            1
-        ] + 1 < self.player.game.field_size and self.player.game.is_empty(
-            self.player.cords[0], self.player.cords[1] + 1
-        ):
-            self.dust()
-            self.player.cords[1] += 1
-            yield from range(2)
-            return 1
-        yield
-        return 0
+        return self.move(0, 1)
 
     def go_left(self):
-        if self.player.cords[0] - 1 >= 0 and self.player.game.is_empty(
-            self.player.cords[0] - 1, self.player.cords[1]
-        ):
-            self.dust()
-            self.player.cords[0] -= 1
-            yield from range(2)
-            return 1
-        yield
-        return 0
+        return self.move(-1, 0)
 
     def go_right(self):
-        if self.player.cords[
-            0
-        ] + 1 < self.player.game.field_size and self.player.game.is_empty(
-            self.player.cords[0] + 1, self.player.cords[1]
-        ):
+        return self.move(1, 0)
+
+    def move(self, dx, dy):
+        game = self.player.game
+        x = self.player.cords[0] + dx
+        y = self.player.cords[1] + dy
+        if game.in_bounds(x, y) and game.is_empty(x, y):
             self.dust()
-            self.player.cords[0] += 1
-            yield from range(2)
+            game.move_player(self.player, x, y)
             return 1
-        yield
         return 0
 
     def dust(self):
-        if random.randint(0, 3) != 0:
-            particle = random.choice("%")
+        rng = self.player.game.random
+        if rng.randint(0, 3) != 0:
+            particle = rng.choice("%")
             self.player.game.add_particle(*self.player.cords, (particle, "dust"))
 
 
 class Player:
-    def __init__(self, ast, build: typing.List[RobotModule]):
+    def __init__(
+        self,
+        code,
+        build: typing.List[RobotModule],
+        quantum: int = None,
+        budget: Budget = None,
+    ):
         self.cords = None
+        # steps per turn, the arena's step_per_turn if None
+        self.quantum = quantum
         self.timeout = 0
         self.scope = {}
         self.game = None
@@ -232,7 +403,18 @@ class Player:
             module.init_player(self)
 
         self.build = {module.name: module for module in build}
-        self.interpreter = Interpreter(ast, modules=self.build).interpret()
+        self.vm = VM(code, modules=self.build, budget=budget)
+        self.interpreter = self.vm.run()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the VM keeps the state of the program, a new run() goes on with it
+        del state["interpreter"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.interpreter = self.vm.run()
 
     def init_cords(self, x, y):
         self.cords = [x, y]
@@ -246,69 +428,102 @@ class Player:
 
 
 class RustyScriptInterpreter:
+    """The arena.
+
+    Cells are stored in flat row-major arrays indexed by ``y * field_size + x``:
+    the rendered tiles, the particles and the occupancy (index of the player
+    standing on a cell or -1), so that collision checks are O(1) and
+    rendering only copies the tile layer and touches the changed cells.
+    """
+
     def __init__(
         self,
         players: typing.List[Player],
         field_size: int = 7,
         field: typing.List[typing.List[Tile]] = None,
         step_per_turn: int = 10,
+        seed: int = None,
     ):
         self.step_per_turn = step_per_turn
+        # every random event of the game comes from here, so a run is
+        # reproducible from its seed
+        self.random = random.Random(seed)
+        self.field_size = field_size
         self.field = field or [
             [Tile(self) for __ in range(field_size)] for _ in range(field_size)
         ]
-        self.particles = [[None for __ in range(field_size)] for _ in range(field_size)]
+        self.tiles = [tile for row in self.field for tile in row]
+        self.background = [tile.get_char() for tile in self.tiles]
+        self.particles = [None] * (field_size * field_size)
+        # indexes of the cells in self.particles that are not None
+        self.dirty = []
+        self.occupancy = array.array("i", [-1]) * (field_size * field_size)
         self.players = players
-        self.field_size = field_size
-        for player in players:
+        self.scheduler = Scheduler(players, quantum=step_per_turn)
+        for i, player in enumerate(players):
             player.init_game(self)
+            if player.cords is not None:
+                self.occupancy[self.index(*player.cords)] = i
+
+    def index(self, x, y):
+        return y * self.field_size + x
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.field_size and 0 <= y < self.field_size
+
+    def update_tile(self, x, y):
+        """Re-render a tile after its items have changed."""
+        index = self.index(x, y)
+        self.background[index] = self.tiles[index].get_char()
 
     def get_field(self):
-        field = [["." for _ in range(self.field_size)] for _ in range(self.field_size)]
-        for x in range(self.field_size):
-            for y in range(self.field_size):
-                field[y][x] = self.field[y][x].get_char()
+        size = self.field_size
+        cells = self.background[:]
 
         for i, player in enumerate(self.players):
             xy = player.cords
-            field[xy[1]][xy[0]] = (player.get_char(), f"player_{i}")
+            cells[xy[1] * size + xy[0]] = (player.get_char(), f"player_{i}")
+
+        particles = self.particles
+        for index in self.dirty:
+            cells[index] = particles[index]
+            particles[index] = None
+        self.dirty = []
 
-        for y in range(self.field_size):
-            for x in range(self.field_size):
-                if self.particles[x][y] is not None:
-                    field[y][x] = self.particles[x][y]
-                    self.particles[x][y] = None
+        return [cells[start : start + size] for start in range(0, size * size, size)]
 
-        return field
+    def drain_particles(self):
+        """Drop the particles like get_field() does, without the frame."""
+        particles = self.particles
+        for index in self.dirty:
+            particles[index] = None
+        self.dirty = []
 
     def turn(self):
-        playable = set(self.players)
-        while len(playable) != 0:
-            for player in self.players:
-                for step in range(self.step_per_turn):
-                    try:
-                        yield next(player.interpreter)
-                    except StopIteration:
-                        playable.remove(player)
-                        break
-                    if step == 10:
-                        break
+        return self.scheduler.run()
 
     def add_particle(self, x, y, particle):
-        if x < 0 or x >= self.field_size or y < 0 or y >= self.field_size:
+        if not self.in_bounds(x, y):
             return
-        self.particles[x][y] = particle
+        index = self.index(x, y)
+        if self.particles[index] is None:
+            self.dirty.append(index)
+        self.particles[index] = particle
 
     def is_empty(self, x, y):
-        for player in self.players:
-            if player.cords == (x, y):
-                return False
-        return True
+        return self.occupancy[self.index(x, y)] < 0
+
+    def move_player(self, player, x, y):
+        old = self.index(*player.cords)
+        new = self.index(x, y)
+        self.occupancy[new] = self.occupancy[old]
+        self.occupancy[old] = -1
+        player.cords[0] = x
+        player.cords[1] = y
 
     def trigger_move(self):
         for player in self.players:
-            xy = player.cords
-            self.field[xy[0]][xy[1]].on_player_enter(player)
+            self.tiles[self.index(*player.cords)].on_player_enter(player)
 
 
 if __name__ == "__main__":
@@ -322,15 +537,13 @@ if __name__ == "__main__":
         print(e.message)
         exit(1)
 
-    modules = [LegsModule()]
-    semantic_analyzer = SemanticAnalyzer({module.name: module for module in modules})
     try:
-        semantic_analyzer.visit(tree)
+        code = CircusMission.compile(tree)
     except SemanticError as e:
         print(e.message)
         exit(1)
 
-    result = CircusMission(tree).play()
+    result = CircusMission(code).play()
     if result["result"]:
         print(Fore.LIGHTGREEN_EX + result["description"] + Fore.RESET)
     else:
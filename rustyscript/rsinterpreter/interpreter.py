@@ -1,15 +1,29 @@
 """SPI - Simple Pascal Interpreter."""
 
 import typing
+import array
+import bisect
 import abc
+import re
 import argparse
 import sys
-import types
+import operator
 from enum import Enum
 
 _SHOULD_LOG_SCOPE = False  # see '--scope' command line option
 _SHOULD_LOG_STACK = False  # see '--stack' command line option
 
+# Maximum number of nested procedure calls. A call of the tree walking
+# Interpreter takes a couple of Python frames per statement nested in the
+# procedure, so a deeper recursion would run out of Python stack; the VM
+# keeps its records on the heap and can be given more, see Budget.
+MAX_CALL_DEPTH = 32
+# Maximum number of array elements alive at once in a job
+MAX_ARRAY_CELLS = 1 << 16
+
+# array.array type codes of the element types, 8 bytes per element
+ARRAY_TYPECODES = {"INTEGER": "q", "REAL": "d"}
+
 
 class ErrorCode(Enum):
     UNEXPECTED_TOKEN = "Unexpected token"
@@ -17,6 +31,11 @@ class ErrorCode(Enum):
     DUPLICATE_ID = "Duplicate id found"
     WRONG_PARAMS_NUM = "Wrong number of arguments"
     ZERO_DIVISION = "Division by zero"
+    INDEX_OUT_OF_RANGE = "Index out of range"
+    WRONG_ELEMENT = "Value does not fit into the array"
+    TYPE_MISMATCH = "Type mismatch"
+    BUDGET_EXCEEDED = "Budget exceeded"
+    BAD_SNAPSHOT = "Bad snapshot"
 
 
 class Error(Exception):
@@ -39,6 +58,14 @@ class SemanticError(Error):
     pass
 
 
+class BudgetError(Error):
+    pass
+
+
+class SnapshotError(Error):
+    pass
+
+
 ###############################################################################
 #                                                                             #
 #  LEXER                                                                      #
@@ -54,8 +81,11 @@ class TokenType(Enum):
     FLOAT_DIV = "/"
     LPAREN = "("
     RPAREN = ")"
+    LBRACKET = "["
+    RBRACKET = "]"
     SEMI = ";"
     DOT = "."
+    RANGE = ".."
     COLON = ":"
     COMMA = ","
     # bin operations
@@ -69,6 +99,9 @@ class TokenType(Enum):
     REAL = "REAL"
     INTEGER_DIV = "DIV"
     VAR = "VAR"
+    ARRAY = "ARRAY"
+    OF = "OF"
+    PROCEDURE = "PROCEDURE"
     IF = "IF"
     THEN = "THEN"
     ELSE = "ELSE"
@@ -88,12 +121,17 @@ class TokenType(Enum):
 
 
 class Token:
+    __slots__ = ("type", "value", "lineno", "column")
+
     def __init__(self, type, value, lineno=None, column=None):
         self.type = type
         self.value = value
         self.lineno = lineno
         self.column = column
 
+    def __reduce__(self):
+        return Token, (self.type, self.value, self.lineno, self.column)
+
     def __str__(self):
         """String representation of the class instance.
 
@@ -144,169 +182,129 @@ def _build_reserved_keywords():
 RESERVED_KEYWORDS = _build_reserved_keywords()
 
 
+SYMBOL_TOKENS = {
+    token_type.value: token_type
+    for token_type in TokenType
+    if not token_type.value[0].isalpha()
+}
+
+# One alternative per token class, tried in order at every position.
+# ':=' and '<>' come before ':' and '<' because the alternatives are sorted
+# by length. A number does not take the first dot of '..', so '0..9' is a
+# range.
+_TOKEN_REGEX = re.compile(
+    r"(?P<WHITESPACE>\s+)"
+    r"|(?P<COMMENT>\{[^}]*\}?)"
+    r"|(?P<NUMBER>\d+(?:\.(?!\.)\d*)?)"
+    r"|(?P<ID>[^\W\d_][^\W_]*)"
+    r"|(?P<SYMBOL>"
+    + "|".join(
+        re.escape(symbol) for symbol in sorted(SYMBOL_TOKENS, key=len, reverse=True)
+    )
+    + r")"
+    r"|(?P<ERROR>.)",
+    re.DOTALL,
+)
+
+
 class Lexer:
     def __init__(self, text):
         # client string input, e.g. "4 + 2 * 3 - 6 / 2"
         self.text = text
-        # self.pos is an index into self.text
-        self.pos = 0
-        if len(text) == 0:
-            self.current_char = None
-        else:
-            self.current_char = self.text[self.pos]
-        # token line number and column number
-        self.lineno = 1
-        self.column = 1
+        self.tokens = None
+        # offset in the text where every token but EOF ends
+        self.ends = None
+        # index of the next token returned by get_next_token()
+        self.index = 0
 
-    def error(self):
+    def error(self, lexeme, lineno, column):
         s = "Lexer error on '{lexeme}' line: {lineno} column: {column}".format(
-            lexeme=self.current_char, lineno=self.lineno, column=self.column,
+            lexeme=lexeme, lineno=lineno, column=column,
         )
-        raise LexerError(message=s)
-
-    def advance(self):
-        """Advance the `pos` pointer and set the `current_char` variable."""
-        if self.current_char == "\n":
-            self.lineno += 1
-            self.column = 0
-
-        self.pos += 1
-        if self.pos > len(self.text) - 1:
-            self.current_char = None  # Indicates end of input
-        else:
-            self.current_char = self.text[self.pos]
-            self.column += 1
-
-    def peek(self):
-        peek_pos = self.pos + 1
-        if peek_pos > len(self.text) - 1:
-            return None
-        else:
-            return self.text[peek_pos]
-
-    def skip_whitespace(self):
-        while self.current_char is not None and self.current_char.isspace():
-            self.advance()
-
-    def skip_comment(self):
-        while self.current_char != "}":
-            self.advance()
-        self.advance()  # the closing curly brace
-
-    def number(self):
-        """Return a (multidigit) integer or float consumed from the input."""
-
-        # Create a new token with current line and column number
-        token = Token(type=None, value=None, lineno=self.lineno, column=self.column)
-
-        result = ""
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-
-        if self.current_char == ".":
-            result += self.current_char
-            self.advance()
-
-            while self.current_char is not None and self.current_char.isdigit():
-                result += self.current_char
-                self.advance()
-
-            token.type = TokenType.REAL_CONST
-            token.value = float(result)
-        else:
-            token.type = TokenType.INTEGER_CONST
-            token.value = int(result)
-
-        return token
-
-    def _id(self):
-        """Handle identifiers and reserved keywords"""
-
-        # Create a new token with current line and column number
-        token = Token(type=None, value=None, lineno=self.lineno, column=self.column)
+        raise LexerError(message=s, token=Token(None, lexeme, lineno, column))
 
-        value = ""
-        while self.current_char is not None and self.current_char.isalnum():
-            value += self.current_char
-            self.advance()
+    def tokenize(self, previous=None):
+        """Break the whole input apart into a list of tokens in one pass.
 
-        token_type = RESERVED_KEYWORDS.get(value.upper())
-        if token_type is None:
-            token.type = TokenType.ID
-            token.value = value
-        else:
-            # reserved keyword
-            token.type = token_type
-            token.value = value.upper()
-
-        return token
-
-    def get_next_token(self):
-        """Lexical analyzer (also known as scanner or tokenizer)
-
-        This method is responsible for breaking a sentence
-        apart into tokens. One token at a time.
+        The list always ends with an EOF token. ``previous`` is a lexer
+        that has tokenized an earlier version of the text: its tokens
+        that end before the first changed character are reused and the
+        text is only scanned from there.
         """
-        while self.current_char is not None:
-            if self.current_char.isspace():
-                self.skip_whitespace()
-                continue
-
-            if self.current_char == "{":
-                self.advance()
-                self.skip_comment()
+        if self.tokens is not None:
+            return self.tokens
+
+        text = self.text
+        tokens = []
+        ends = []
+        append = tokens.append
+        lineno = 1
+        line_start = 0
+        pos = 0
+        if previous is not None and previous.ends:
+            old = previous.text
+            prefix = 0
+            limit = min(len(old), len(text))
+            while prefix < limit and old[prefix] == text[prefix]:
+                prefix += 1
+            # a token ending right at the change may go on in the new text
+            n = bisect.bisect_left(previous.ends, prefix)
+            if n:
+                tokens = previous.tokens[:n]
+                ends = previous.ends[:n]
+                append = tokens.append
+                pos = ends[-1]
+                lineno = tokens[-1].lineno
+                line_start = text.rfind("\n", 0, pos) + 1
+
+        for match in _TOKEN_REGEX.finditer(text, pos):
+            kind = match.lastgroup
+            value = match.group()
+            start = match.start()
+
+            if kind == "WHITESPACE" or kind == "COMMENT":
+                newlines = value.count("\n")
+                if newlines:
+                    lineno += newlines
+                    line_start = text.rindex("\n", start, match.end()) + 1
                 continue
 
-            if self.current_char.isalpha():
-                return self._id()
-
-            if self.current_char.isdigit():
-                return self.number()
-
-            if self.current_char == ":" and self.peek() == "=":
-                token = Token(
-                    type=TokenType.ASSIGN,
-                    value=TokenType.ASSIGN.value,  # ':='
-                    lineno=self.lineno,
-                    column=self.column,
-                )
-                self.advance()
-                self.advance()
-                return token
-
-            if self.current_char == "<" and self.peek() == ">":
-                token = Token(
-                    type=TokenType.NOT_EQUAL,
-                    value=TokenType.NOT_EQUAL.value,
-                    lineno=self.lineno,
-                    column=self.column,
-                )
-                self.advance()
-                self.advance()
-                return token
-            # single-character token
-            try:
-                # get enum member by value, e.g.
-                # TokenType(';') --> TokenType.SEMI
-                token_type = TokenType(self.current_char)
-            except ValueError:
-                # no enum member with value equal to self.current_char
-                self.error()
+            column = start - line_start + 1
+            if kind == "ID":
+                if not value[0].isalpha():
+                    self.error(value[0], lineno, column)
+                token_type = RESERVED_KEYWORDS.get(value.upper())
+                if token_type is None:
+                    append(Token(TokenType.ID, value, lineno, column))
+                else:
+                    # reserved keyword
+                    append(Token(token_type, value.upper(), lineno, column))
+            elif kind == "SYMBOL":
+                token_type = SYMBOL_TOKENS[value]
+                append(Token(token_type, token_type.value, lineno, column))
+            elif kind == "NUMBER":
+                if "." in value:
+                    append(Token(TokenType.REAL_CONST, float(value), lineno, column))
+                else:
+                    append(Token(TokenType.INTEGER_CONST, int(value), lineno, column))
             else:
-                # create a token with a single-character lexeme as its value
-                token = Token(
-                    type=token_type,
-                    value=token_type.value,  # e.g. ';', '.', etc
-                    lineno=self.lineno,
-                    column=self.column,
-                )
-                self.advance()
-                return token
+                self.error(value, lineno, column)
+            ends.append(match.end())
 
         # EOF (end-of-file) token indicates that there is no more
         # input left for lexical analysis
-        return Token(type=TokenType.EOF, value=None)
+        append(Token(type=TokenType.EOF, value=None))
+        self.tokens = tokens
+        self.ends = ends
+        return tokens
+
+    def get_next_token(self):
+        """Return the tokens of the input one at a time."""
+        tokens = self.tokenize()
+        token = tokens[self.index]
+        if self.index < len(tokens) - 1:
+            self.index += 1
+        return token
 
 
 ###############################################################################
@@ -314,33 +312,80 @@ class Lexer:
 #  PARSER                                                                     #
 #                                                                             #
 ###############################################################################
+def _rebuild_node(cls, values):
+    node = cls.__new__(cls)
+    for name, value in zip(cls.__slots__, values):
+        setattr(node, name, value)
+    return node
+
+
 class AST:
-    pass
+    """Base of the nodes, every node class lists its fields in __slots__."""
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        # pickle the fields as a tuple, without their names
+        return (
+            _rebuild_node,
+            (self.__class__, tuple(getattr(self, name) for name in self.__slots__)),
+        )
 
 
 class BinOp(AST):
+    __slots__ = ("left", "token", "op", "right", "type", "operator")
+
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
         self.right = right
+        # static type of the result and the function computing it, set by
+        # SemanticAnalyzer
+        self.type = None
+        self.operator = None
 
     def __repr__(self):
         return f"<BinOp(left={self.left}, op={self.op}, right={self.right})>"
 
 
+class BoolOp(AST):
+    """AND / OR, the right operand is only evaluated if the left one does
+    not decide the result."""
+
+    __slots__ = ("left", "token", "op", "right", "type")
+
+    def __init__(self, left, op, right):
+        self.left = left
+        self.token = self.op = op
+        self.right = right
+        self.type = None
+
+    def __repr__(self):
+        return f"<BoolOp(left={self.left}, op={self.op}, right={self.right})>"
+
+
 class Num(AST):
-    def __init__(self, token):
+    __slots__ = ("token", "value", "steps", "type")
+
+    def __init__(self, token, steps=1, type=None):
         self.token = token
         self.value = token.value
+        # steps taken to evaluate it, more than one for folded expressions
+        self.steps = steps
+        self.type = type
 
     def __repr__(self):
         return f"<Num(token={self.token}, value={self.value})>"
 
 
 class UnaryOp(AST):
+    __slots__ = ("token", "op", "expr", "type", "operator")
+
     def __init__(self, op, expr):
         self.token = self.op = op
         self.expr = expr
+        self.type = None
+        self.operator = None
 
     def __repr__(self):
         return f"<UnaryOp(op={self.op}, expr={self.expr})>"
@@ -349,6 +394,8 @@ class UnaryOp(AST):
 class Compound(AST):
     """Represents a 'BEGIN ... END' block"""
 
+    __slots__ = ("children",)
+
     def __init__(self):
         self.children = []
 
@@ -357,6 +404,8 @@ class Compound(AST):
 
 
 class Assign(AST):
+    __slots__ = ("left", "token", "op", "right")
+
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
@@ -369,29 +418,65 @@ class Assign(AST):
 class Var(AST):
     """The Var node is constructed out of ID token."""
 
+    __slots__ = ("token", "value", "address", "is_func", "type")
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
+        # (depth, slot) and static type of the variable, set by
+        # SemanticAnalyzer
+        self.address = None
+        self.is_func = False
+        self.type = None
 
     def __repr__(self):
         return f"<Var(token={self.token}, value={self.value})>"
 
 
+class Subscript(AST):
+    """An element of an array variable, var_node[index]."""
+
+    __slots__ = ("var_node", "token", "index", "low", "type")
+
+    def __init__(self, var_node, index):
+        self.var_node = var_node
+        self.token = var_node.token
+        self.index = index
+        # lower bound and element type of the array, set by SemanticAnalyzer
+        self.low = 0
+        self.type = None
+
+    def __repr__(self):
+        return f"<Subscript(var={self.var_node}, index={self.index})>"
+
+
 class NoOp(AST):
-    pass
+    __slots__ = ("steps",)
+
+    def __init__(self, steps=1):
+        # more than one for the conditions of removed statements
+        self.steps = steps
 
 
 class Program(AST):
+    __slots__ = ("name", "block", "uses", "n_slots", "functions")
+
     def __init__(self, name, block, uses):
         self.name = name
         self.block = block
         self.uses = uses
+        # size of the global activation record and the slots of the module
+        # functions, set by SemanticAnalyzer
+        self.n_slots = 0
+        self.functions = {}
 
     def __repr__(self):
         return f"<Program(name={self.name}, block={self.block}, uses={self.uses})>"
 
 
 class Block(AST):
+    __slots__ = ("declarations", "compound_statement")
+
     def __init__(self, declarations, compound_statement):
         self.declarations = declarations
         self.compound_statement = compound_statement
@@ -401,6 +486,8 @@ class Block(AST):
 
 
 class VarDecl(AST):
+    __slots__ = ("var_node", "type_node")
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
@@ -410,6 +497,8 @@ class VarDecl(AST):
 
 
 class Type(AST):
+    __slots__ = ("token", "value")
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
@@ -418,7 +507,25 @@ class Type(AST):
         return f"<Type(token={self.token}, value={self.value})>"
 
 
+class ArrayType(AST):
+    """array[low..high] of element, the bounds are constants."""
+
+    __slots__ = ("token", "value", "element", "low", "high")
+
+    def __init__(self, token, element, low, high):
+        self.token = token
+        self.value = token.value
+        self.element = element  # a Type node
+        self.low = low
+        self.high = high
+
+    def __repr__(self):
+        return f"<ArrayType(element={self.element}, low={self.low}, high={self.high})>"
+
+
 class Param(AST):
+    __slots__ = ("var_node", "type_node")
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
@@ -428,6 +535,8 @@ class Param(AST):
 
 
 class IfElseStatement(AST):
+    __slots__ = ("comp", "on_true", "on_false")
+
     def __init__(self, comp, on_true, on_false):
         self.comp = comp
         self.on_true = on_true
@@ -438,6 +547,8 @@ class IfElseStatement(AST):
 
 
 class WhileStatement(AST):
+    __slots__ = ("comp", "body")
+
     def __init__(self, comp, body):
         self.comp = comp
         self.body = body
@@ -447,6 +558,8 @@ class WhileStatement(AST):
 
 
 class UseExternal(AST):
+    __slots__ = ("name",)
+
     def __init__(self, name):
         self.name = name
 
@@ -455,20 +568,30 @@ class UseExternal(AST):
 
 
 class ProcedureDecl(AST):
+    __slots__ = ("proc_name", "params", "block_node", "slot", "n_slots")
+
     def __init__(self, proc_name, params, block_node):
         self.proc_name = proc_name
         self.params = params  # a list of Param nodes
         self.block_node = block_node
+        # slot of the procedure in the enclosing scope and size of its
+        # activation record, set by SemanticAnalyzer
+        self.slot = None
+        self.n_slots = 0
 
     def __repr__(self):
         return f"<ProcedureDecl(name={self.proc_name}, params={self.params}, block={self.block_node})>"
 
 
 class ProcedureCall(AST):
+    __slots__ = ("proc_name", "actual_params", "token", "address")
+
     def __init__(self, proc_name, actual_params, token):
         self.proc_name = proc_name
         self.actual_params = actual_params  # a list of AST nodes
         self.token = token
+        # (depth, slot) of the procedure, set by SemanticAnalyzer
+        self.address = None
 
     def __repr__(self):
         return f"<ProcedureCall(name={self.proc_name}, params={self.actual_params}, token={self.token})>"
@@ -477,11 +600,19 @@ class ProcedureCall(AST):
 class Parser:
     def __init__(self, lexer):
         self.lexer = lexer
+        self.tokens = lexer.tokenize()
+        # self.pos is an index into self.tokens
+        self.pos = 0
         # set current token to the first token taken from the input
-        self.current_token = self.get_next_token()
+        self.current_token = self.tokens[0]
 
     def get_next_token(self):
-        return self.lexer.get_next_token()
+        if self.pos < len(self.tokens) - 1:
+            self.pos += 1
+        return self.tokens[self.pos]
+
+    def peek(self):
+        return self.tokens[min(self.pos + 1, len(self.tokens) - 1)]
 
     def error(self, error_code, token):
         raise ParserError(
@@ -536,6 +667,9 @@ class Parser:
                 declarations.extend(var_decl)
                 self.eat(TokenType.SEMI)
 
+        while self.current_token.type == TokenType.PROCEDURE:
+            declarations.append(self.procedure_declaration())
+
         return declarations
 
     def formal_parameters(self):
@@ -592,7 +726,7 @@ class Parser:
 
     def if_statement(self):
         self.eat(TokenType.IF)
-        comp = self.bin_expr()
+        comp = self.condition()
         self.eat(TokenType.THEN)
         on_true = self.compound_statement()
         if self.current_token.type == TokenType.ELSE:
@@ -604,7 +738,7 @@ class Parser:
 
     def while_statement(self):
         self.eat(TokenType.WHILE)
-        comp = self.bin_expr()
+        comp = self.condition()
         self.eat(TokenType.DO)
         body = self.compound_statement()
         return WhileStatement(comp, body)
@@ -623,12 +757,43 @@ class Parser:
         self.eat(TokenType.SEMI)
         return names
 
-    def bin_expr(self):
-        left = self.expr()
-        op = self.current_token
-        self.eat(op.type)
-        right = self.expr()
-        return BinOp(left, op, right)
+    def condition(self):
+        """condition : conjunction (OR conjunction)*"""
+        node = self.conjunction()
+
+        while self.current_token.type == TokenType.OR:
+            token = self.current_token
+            self.eat(TokenType.OR)
+            node = BoolOp(left=node, op=token, right=self.conjunction())
+
+        return node
+
+    def conjunction(self):
+        """conjunction : comparison (AND comparison)*"""
+        node = self.comparison()
+
+        while self.current_token.type == TokenType.AND:
+            token = self.current_token
+            self.eat(TokenType.AND)
+            node = BoolOp(left=node, op=token, right=self.comparison())
+
+        return node
+
+    def comparison(self):
+        """comparison : expr ((EQUAL | NOT_EQUAL | LESS | MORE) expr)?"""
+        node = self.expr()
+
+        if self.current_token.type in (
+            TokenType.EQUAL,
+            TokenType.NOT_EQUAL,
+            TokenType.LESS,
+            TokenType.MORE,
+        ):
+            token = self.current_token
+            self.eat(token.type)
+            node = BinOp(left=node, op=token, right=self.expr())
+
+        return node
 
     def procedure_declaration(self):
         """procedure_declaration :
@@ -653,18 +818,41 @@ class Parser:
     def type_spec(self):
         """type_spec : INTEGER
                      | REAL
-                     | BOOL
+                     | array_type
         """
+        if self.current_token.type == TokenType.ARRAY:
+            return self.array_type()
         token = self.current_token
         if self.current_token.type == TokenType.INTEGER:
             self.eat(TokenType.INTEGER)
-        elif self.current_token.type == TokenType.BOOL:
-            self.eat(TokenType.BOOL)
         else:
             self.eat(TokenType.REAL)
         node = Type(token)
         return node
 
+    def array_type(self):
+        """array_type : ARRAY LBRACKET bound RANGE bound RBRACKET OF type_spec"""
+        token = self.current_token
+        self.eat(TokenType.ARRAY)
+        self.eat(TokenType.LBRACKET)
+        low = self.bound()
+        self.eat(TokenType.RANGE)
+        high = self.bound()
+        self.eat(TokenType.RBRACKET)
+        self.eat(TokenType.OF)
+        element = self.type_spec()
+        return ArrayType(token, element, low, high)
+
+    def bound(self):
+        """bound : MINUS? INTEGER_CONST"""
+        sign = 1
+        if self.current_token.type == TokenType.MINUS:
+            self.eat(TokenType.MINUS)
+            sign = -1
+        token = self.current_token
+        self.eat(TokenType.INTEGER_CONST)
+        return sign * token.value
+
     def compound_statement(self):
         """
         compound_statement: BEGIN statement_list END
@@ -703,7 +891,10 @@ class Parser:
         """
         if self.current_token.type == TokenType.BEGIN:
             node = self.compound_statement()
-        elif self.current_token.type == TokenType.ID and self.lexer.current_char == "(":
+        elif (
+            self.current_token.type == TokenType.ID
+            and self.peek().type == TokenType.LPAREN
+        ):
             node = self.proccall_statement()
         elif self.current_token.type == TokenType.ID:
             node = self.assignment_statement()
@@ -741,12 +932,12 @@ class Parser:
 
     def assignment_statement(self):
         """
-        assignment_statement : variable ASSIGN expr
+        assignment_statement : variable_access ASSIGN condition
         """
-        left = self.variable()
+        left = self.variable_access()
         token = self.current_token
         self.eat(TokenType.ASSIGN)
-        right = self.expr()
+        right = self.condition()
         node = Assign(left, token, right)
         return node
 
@@ -758,6 +949,17 @@ class Parser:
         self.eat(TokenType.ID)
         return node
 
+    def variable_access(self):
+        """
+        variable_access : variable (LBRACKET expr RBRACKET)?
+        """
+        node = self.variable()
+        if self.current_token.type == TokenType.LBRACKET:
+            self.eat(TokenType.LBRACKET)
+            node = Subscript(node, self.expr())
+            self.eat(TokenType.RBRACKET)
+        return node
+
     def empty(self):
         """An empty production"""
         return NoOp()
@@ -805,8 +1007,8 @@ class Parser:
                   | MINUS factor
                   | INTEGER_CONST
                   | REAL_CONST
-                  | LPAREN expr RPAREN
-                  | variable
+                  | LPAREN condition RPAREN
+                  | variable_access
         """
         token = self.current_token
         if token.type == TokenType.PLUS:
@@ -825,11 +1027,11 @@ class Parser:
             return Num(token)
         elif token.type == TokenType.LPAREN:
             self.eat(TokenType.LPAREN)
-            node = self.expr()
+            node = self.condition()
             self.eat(TokenType.RPAREN)
             return node
         else:
-            node = self.variable()
+            node = self.variable_access()
             return node
 
     def parse(self):
@@ -850,7 +1052,11 @@ class Parser:
 
         formal_parameters : ID (COMMA ID)* COLON type_spec
 
-        type_spec : INTEGER | REAL
+        type_spec : INTEGER | REAL | array_type
+
+        array_type : ARRAY LBRACKET bound RANGE bound RBRACKET OF type_spec
+
+        bound : MINUS? INTEGER_CONST
 
         compound_statement : BEGIN statement_list END
 
@@ -860,14 +1066,29 @@ class Parser:
         statement : compound_statement
                   | proccall_statement
                   | assignment_statement
+                  | if_statement
+                  | while_statement
                   | empty
 
+        if_statement : IF condition THEN compound_statement
+                       (ELSE compound_statement)?
+
+        while_statement : WHILE condition DO compound_statement
+
         proccall_statement : ID LPAREN (expr (COMMA expr)*)? RPAREN
 
-        assignment_statement : variable ASSIGN expr
+        assignment_statement : variable_access ASSIGN condition
+
+        variable_access : variable (LBRACKET expr RBRACKET)?
 
         empty :
 
+        condition : conjunction (OR conjunction)*
+
+        conjunction : comparison (AND comparison)*
+
+        comparison : expr ((EQUAL | NOT_EQUAL | LESS | MORE) expr)?
+
         expr : term ((PLUS | MINUS) term)*
 
         term : factor ((MUL | INTEGER_DIV | FLOAT_DIV) factor)*
@@ -876,8 +1097,8 @@ class Parser:
                | MINUS factor
                | INTEGER_CONST
                | REAL_CONST
-               | LPAREN expr RPAREN
-               | variable
+               | LPAREN condition RPAREN
+               | variable_access
 
         variable: ID
         """
@@ -934,6 +1155,10 @@ class Symbol:
     def __init__(self, name, type=None):
         self.name = name
         self.type = type
+        # where the value lives at runtime: the slot in the activation
+        # record of the scope of level scope_level
+        self.slot = None
+        self.scope_level = None
 
 
 class VarSymbol(Symbol):
@@ -961,10 +1186,28 @@ class BuiltinTypeSymbol(Symbol):
         )
 
 
+class ArrayTypeSymbol(Symbol):
+    def __init__(self, element, low, high):
+        super().__init__(f"ARRAY[{low}..{high}] OF {element}")
+        self.element = element
+        self.low = low
+        self.high = high
+        self.size = high - low + 1
+
+    def __str__(self):
+        return self.name
+
+    __repr__ = __str__
+
+
 class FuncSymbol(Symbol):
-    def __init__(self, name, n_params=None):
+    def __init__(self, name, n_params=None, procedure=None):
         super().__init__(name, type="FUNC")
         self.n_params = n_params
+        # VarSymbols of the parameters of a user procedure
+        self.params = []
+        # ProcedureDecl of a user procedure, None for module functions
+        self.procedure = procedure
 
     def __str__(self):
         return "<{class_name}(name={name}, n_parameters={params})>".format(
@@ -980,6 +1223,8 @@ class ScopedSymbolTable:
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
+        # size of the activation record of the scope
+        self.n_slots = 0
 
     def _init_builtins(self):
         self.insert(BuiltinTypeSymbol("INTEGER"))
@@ -1013,6 +1258,10 @@ class ScopedSymbolTable:
 
     def insert(self, symbol):
         self.log(f"Insert: {symbol.name}")
+        if not isinstance(symbol, BuiltinTypeSymbol):
+            symbol.slot = self.n_slots
+            symbol.scope_level = self.scope_level
+            self.n_slots += 1
         self._symbols[symbol.name] = symbol
 
     def lookup(self, name, current_scope_only=False):
@@ -1031,10 +1280,67 @@ class ScopedSymbolTable:
             return self.enclosing_scope.lookup(name)
 
 
+def integer_div(left, right):
+    if right == 0:
+        raise Error(ErrorCode.ZERO_DIVISION, token=right)
+    return left // right
+
+
+def float_div(left, right):
+    if right == 0:
+        raise Error(ErrorCode.ZERO_DIVISION, token=right)
+    return left / right
+
+
+def equal(left, right):
+    return int(left == right)
+
+
+def not_equal(left, right):
+    return int(left != right)
+
+
+def more(left, right):
+    return int(left > right)
+
+
+def less(left, right):
+    return int(left < right)
+
+
+# functions of the operators, bound to the nodes by SemanticAnalyzer so
+# that the Interpreter does not look the operator up on every evaluation
+BINARY_OPERATORS = {
+    TokenType.PLUS: operator.add,
+    TokenType.MINUS: operator.sub,
+    TokenType.MUL: operator.mul,
+    TokenType.INTEGER_DIV: integer_div,
+    TokenType.FLOAT_DIV: float_div,
+    TokenType.EQUAL: equal,
+    TokenType.NOT_EQUAL: not_equal,
+    TokenType.MORE: more,
+    TokenType.LESS: less,
+}
+UNARY_OPERATORS = {TokenType.PLUS: operator.pos, TokenType.MINUS: operator.neg}
+# operators keeping INTEGER operands INTEGER, the others give REAL
+ARITHMETIC = {TokenType.PLUS, TokenType.MINUS, TokenType.MUL}
+
+
 class SemanticAnalyzer(NodeVisitor):
+    """Resolves the names and infers the static type of every expression.
+
+    The visits of the expressions return their BuiltinTypeSymbol and set
+    the ``type`` of the node. An INTEGER operation of INTEGER operands is
+    INTEGER, ``/`` is REAL, comparisons and AND / OR are INTEGER. A REAL
+    value can not be stored where an INTEGER is expected, ``div`` and array
+    indexes take INTEGER operands only.
+    """
+
     def __init__(self, modules: dict = None):
         self.current_scope = None
         self.modules = modules or {}
+        self.integer = None
+        self.real = None
 
     def log(self, msg):
         if _SHOULD_LOG_SCOPE:
@@ -1047,6 +1353,18 @@ class SemanticAnalyzer(NodeVisitor):
             message=f"{error_code.value} -> {message or token}",
         )
 
+    def address(self, symbol):
+        """(depth, slot) of a symbol seen from the current scope."""
+        return self.current_scope.scope_level - symbol.scope_level, symbol.slot
+
+    def check_type(self, expected, value_type, token, message):
+        if expected is self.integer and value_type is not self.integer:
+            self.error(
+                error_code=ErrorCode.TYPE_MISMATCH,
+                token=token,
+                message=f"{value_type} {message}, {expected} expected",
+            )
+
     def visit_Block(self, node):
         for declaration in node.declarations:
             self.visit(declaration)
@@ -1061,21 +1379,24 @@ class SemanticAnalyzer(NodeVisitor):
         )
         global_scope._init_builtins()
         self.current_scope = global_scope
+        self.integer = global_scope.lookup("INTEGER")
+        self.real = global_scope.lookup("REAL")
 
         for module in node.uses:
             if module not in self.modules:
                 self.error(ErrorCode.ID_NOT_FOUND, node, module)
             else:
                 for func in self.modules[module].func.keys():
-                    self.current_scope.insert(
-                        FuncSymbol(
-                            name=func,
-                            n_params=self.modules[module].other[func]["n_params"],
-                        )
+                    symbol = FuncSymbol(
+                        name=func,
+                        n_params=self.modules[module].other[func]["n_params"],
                     )
+                    self.current_scope.insert(symbol)
+                    node.functions[func] = symbol.slot
 
         # visit subtree
         self.visit(node.block)
+        node.n_slots = global_scope.n_slots
 
         self.log(global_scope)
 
@@ -1090,13 +1411,43 @@ class SemanticAnalyzer(NodeVisitor):
         pass
 
     def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        op = node.op.type
+        if op == TokenType.INTEGER_DIV:
+            if left is not self.integer or right is not self.integer:
+                self.error(
+                    error_code=ErrorCode.TYPE_MISMATCH,
+                    token=node.token,
+                    message=f"{left} div {right}",
+                )
+            node.type = self.integer
+        elif op in ARITHMETIC:
+            if left is self.integer and right is self.integer:
+                node.type = self.integer
+            else:
+                node.type = self.real
+        elif op == TokenType.FLOAT_DIV:
+            node.type = self.real
+        else:
+            node.type = self.integer
+        node.operator = BINARY_OPERATORS[op]
+        return node.type
+
+    def visit_BoolOp(self, node):
         self.visit(node.left)
         self.visit(node.right)
+        node.type = self.integer
+        return node.type
 
     def visit_ProcedureDecl(self, node):
         proc_name = node.proc_name
-        proc_symbol = FuncSymbol(proc_name)
+        proc_symbol = FuncSymbol(proc_name, n_params=len(node.params), procedure=node)
+        if self.current_scope.lookup(proc_name, current_scope_only=True):
+            self.error(error_code=ErrorCode.DUPLICATE_ID, token=node, message=proc_name)
+        # inserted before the body is visited, so it can call itself
         self.current_scope.insert(proc_symbol)
+        node.slot = proc_symbol.slot
 
         self.log(f"ENTER scope: {proc_name}")
         # Scope for parameters and local variables
@@ -1109,22 +1460,54 @@ class SemanticAnalyzer(NodeVisitor):
 
         # Insert parameters into the procedure scope
         for param in node.params:
+            if isinstance(param.type_node, ArrayType):
+                self.error(
+                    error_code=ErrorCode.UNEXPECTED_TOKEN,
+                    token=param.type_node.token,
+                    message="arrays can not be parameters!",
+                )
             param_type = self.current_scope.lookup(param.type_node.value)
             param_name = param.var_node.value
             var_symbol = VarSymbol(param_name, param_type)
+            if self.current_scope.lookup(param_name, current_scope_only=True):
+                self.error(
+                    error_code=ErrorCode.DUPLICATE_ID, token=param.var_node.token,
+                )
+            # the parameters take the first slots of the record
             self.current_scope.insert(var_symbol)
             proc_symbol.params.append(var_symbol)
 
         self.visit(node.block_node)
+        node.n_slots = procedure_scope.n_slots
 
         self.log(procedure_scope)
 
         self.current_scope = self.current_scope.enclosing_scope
         self.log(f"LEAVE scope: {proc_name}")
 
+    def array_type(self, node):
+        element = node.element
+        if isinstance(element, ArrayType) or element.value not in ARRAY_TYPECODES:
+            self.error(
+                error_code=ErrorCode.UNEXPECTED_TOKEN,
+                token=element.token,
+                message="arrays hold integer or real values!",
+            )
+        if node.high < node.low:
+            self.error(
+                error_code=ErrorCode.UNEXPECTED_TOKEN,
+                token=node.token,
+                message=f"empty array [{node.low}..{node.high}]!",
+            )
+        element_symbol = self.current_scope.lookup(element.value)
+        return ArrayTypeSymbol(element_symbol, node.low, node.high)
+
     def visit_VarDecl(self, node):
-        type_name = node.type_node.value
-        type_symbol = self.current_scope.lookup(type_name)
+        if isinstance(node.type_node, ArrayType):
+            type_symbol = self.array_type(node.type_node)
+        else:
+            type_name = node.type_node.value
+            type_symbol = self.current_scope.lookup(type_name)
 
         # We have all the information we need to create a variable symbol.
         # Create the symbol and insert it into the symbol table.
@@ -1139,12 +1522,16 @@ class SemanticAnalyzer(NodeVisitor):
             )
 
         self.current_scope.insert(var_symbol)
+        node.var_node.address = self.address(var_symbol)
 
     def visit_Assign(self, node):
         # right-hand side
-        self.visit(node.right)
+        value_type = self.visit(node.right)
         # left-hand side
-        self.visit(node.left)
+        var_type = self.visit(node.left)
+        self.check_type(
+            var_type, value_type, node.token, f"assigned to {node.left.token.value}"
+        )
 
     def visit_IfElseStatement(self, node):
         self.visit(node.comp)
@@ -1160,12 +1547,50 @@ class SemanticAnalyzer(NodeVisitor):
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
             self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+        if isinstance(var_symbol, FuncSymbol) and var_symbol.procedure is not None:
+            self.error(
+                error_code=ErrorCode.UNEXPECTED_TOKEN,
+                token=node.token,
+                message=f"{var_name} is not a variable!",
+            )
+        if isinstance(var_symbol.type, ArrayTypeSymbol):
+            self.error(
+                error_code=ErrorCode.UNEXPECTED_TOKEN,
+                token=node.token,
+                message=f"{var_name} is an array!",
+            )
+        node.address = self.address(var_symbol)
+        node.is_func = isinstance(var_symbol, FuncSymbol)
+        # a module function read as a variable is 0
+        node.type = self.integer if node.is_func else var_symbol.type
+        return node.type
+
+    def visit_Subscript(self, node):
+        var_name = node.var_node.value
+        var_symbol = self.current_scope.lookup(var_name)
+        if var_symbol is None:
+            self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+        if not isinstance(var_symbol.type, ArrayTypeSymbol):
+            self.error(
+                error_code=ErrorCode.UNEXPECTED_TOKEN,
+                token=node.token,
+                message=f"{var_name} is not an array!",
+            )
+        node.var_node.address = self.address(var_symbol)
+        node.low = var_symbol.type.low
+        index_type = self.visit(node.index)
+        self.check_type(self.integer, index_type, node.token, f"index of {var_name}")
+        node.type = var_symbol.type.element
+        return node.type
 
     def visit_Num(self, node):
-        pass
+        node.type = self.real if isinstance(node.value, float) else self.integer
+        return node.type
 
     def visit_UnaryOp(self, node):
-        pass
+        node.type = self.visit(node.expr)
+        node.operator = UNARY_OPERATORS[node.op.type]
+        return node.type
 
     def visit_ProcedureCall(self, node):
         var_name = node.proc_name
@@ -1186,9 +1611,19 @@ class SemanticAnalyzer(NodeVisitor):
                 token=node.token,
                 message=f"{var_symbol.n_params} expected but got {len(node.actual_params)}",
             )
-
-        for param_node in node.actual_params:
-            self.visit(param_node)
+        node.address = self.address(var_symbol)
+
+        for i, param_node in enumerate(node.actual_params):
+            value_type = self.visit(param_node)
+            # module functions take any values
+            if i < len(var_symbol.params):
+                param = var_symbol.params[i]
+                self.check_type(
+                    param.type,
+                    value_type,
+                    param_node.token,
+                    f"passed as {param.name} of {var_name}",
+                )
 
 
 ###############################################################################
@@ -1200,11 +1635,42 @@ class SemanticAnalyzer(NodeVisitor):
 
 class ARType(Enum):
     PROGRAM = "PROGRAM"
+    PROCEDURE = "PROCEDURE"
+
+
+def array_index(items, index, low: int, name: str) -> int:
+    """Offset of name[index] in the items of an array, checks the bounds."""
+    if index.__class__ is not int or not low <= index < low + len(items):
+        raise Error(
+            error_code=ErrorCode.INDEX_OUT_OF_RANGE,
+            message=f"{ErrorCode.INDEX_OUT_OF_RANGE.value} -> {name}[{index}]",
+        )
+    return index - low
+
+
+def store_element(items, offset: int, value, name: str):
+    try:
+        items[offset] = value
+    except (TypeError, OverflowError):
+        raise Error(
+            error_code=ErrorCode.WRONG_ELEMENT,
+            message=f"{ErrorCode.WRONG_ELEMENT.value} -> {name} := {value}",
+        )
 
 
 class CallStack:
-    def __init__(self):
+    def __init__(
+        self, max_depth: int = MAX_CALL_DEPTH, max_cells: int = MAX_ARRAY_CELLS
+    ):
         self._records = []
+        self.max_depth = max_depth
+        # array elements allocated by the records on the stack
+        self.cells = 0
+        self.max_cells = max_cells
+        # records of the returned calls by size, reused by the next calls
+        self._pool = {}
+        # a blank record of every size, copied over the reused ones
+        self._blank = {}
 
     def push(self, ar):
         self._records.append(ar)
@@ -1212,9 +1678,67 @@ class CallStack:
     def pop(self):
         return self._records.pop()
 
+    def enter(self, name, size, enclosing):
+        """Push the record of a procedure call, fails past max_depth calls."""
+        if len(self._records) > self.max_depth:
+            raise BudgetError(
+                error_code=ErrorCode.BUDGET_EXCEEDED,
+                message=f"more than {self.max_depth} nested calls",
+            )
+        pool = self._pool.get(size)
+        if pool:
+            ar = pool.pop()
+            ar.name = name
+            ar.nesting_level = enclosing.nesting_level + 1
+            ar.enclosing = enclosing
+            ar.slots[:] = self._blank[size]
+            ar.cells = 0
+        else:
+            ar = ActivationRecord(
+                name=name,
+                type=ARType.PROCEDURE,
+                nesting_level=enclosing.nesting_level + 1,
+                size=size,
+                enclosing=enclosing,
+            )
+            if size not in self._blank:
+                self._pool[size] = []
+                self._blank[size] = (None,) * size
+        self._records.append(ar)
+        return ar
+
+    def leave(self):
+        """Pop the record of a procedure call and keep it for the next one."""
+        ar = self._records.pop()
+        self.cells -= ar.cells
+        self._pool[len(ar.slots)].append(ar)
+        return ar
+
+    def allocate(self, ar, typecode: str, size: int):
+        """A zeroed array of the record, fails past max_cells elements."""
+        if self.cells + size > self.max_cells:
+            raise BudgetError(
+                error_code=ErrorCode.BUDGET_EXCEEDED,
+                message=f"more than {self.max_cells} array elements",
+            )
+        self.cells += size
+        ar.cells += size
+        return array.array(typecode, [0]) * size
+
+    def __len__(self):
+        return len(self._records)
+
     def peek(self):
         return self._records[-1]
 
+    def record(self, depth):
+        """The activation record ``depth`` scopes out of the current one."""
+        ar = self._records[-1]
+        while depth:
+            ar = ar.enclosing
+            depth -= 1
+        return ar
+
     def __str__(self):
         s = "\n".join(repr(ar) for ar in reversed(self._records))
         s = f"CALL STACK\n{s}\n"
@@ -1225,20 +1749,24 @@ class CallStack:
 
 
 class ActivationRecord:
-    def __init__(self, name, type, nesting_level):
+    __slots__ = ("name", "type", "nesting_level", "slots", "enclosing", "cells")
+
+    def __init__(self, name, type, nesting_level, size=0, enclosing=None):
         self.name = name
         self.type = type
         self.nesting_level = nesting_level
-        self.members = {}
-
-    def __setitem__(self, key, value):
-        self.members[key] = value
+        # one slot per symbol of the scope, see Symbol.slot
+        self.slots = [None] * size
+        # record of the enclosing scope
+        self.enclosing = enclosing
+        # number of array elements allocated by the record
+        self.cells = 0
 
-    def __getitem__(self, key):
-        return self.members[key]
+    def __setitem__(self, slot, value):
+        self.slots[slot] = value
 
-    def get(self, key):
-        return self.members.get(key)
+    def __getitem__(self, slot):
+        return self.slots[slot]
 
     def __str__(self):
         lines = [
@@ -1246,8 +1774,8 @@ class ActivationRecord:
                 level=self.nesting_level, type=self.type.value, name=self.name,
             )
         ]
-        for name, val in self.members.items():
-            lines.append(f"   {name:<20}: {val}")
+        for slot, val in enumerate(self.slots):
+            lines.append(f"   {slot:<20}: {val}")
 
         s = "\n".join(lines)
         return s
@@ -1256,11 +1784,44 @@ class ActivationRecord:
         return self.__str__()
 
 
+class Wait:
+    """Step value of a program that will be idle for ``ticks`` more ticks.
+
+    Yielded on the step of a timed module action that lasts longer than one
+    tick, so the scheduler can put the robot to sleep instead of resuming
+    it just to burn ticks.
+    """
+
+    __slots__ = ("ticks",)
+
+    def __init__(self, ticks: int):
+        self.ticks = ticks
+
+    def __repr__(self):
+        return f"<Wait(ticks={self.ticks})>"
+
+
 class Interpreter(NodeVisitorGenerator):
-    def __init__(self, tree, modules: dict = None):
+    """Walks a tree annotated by SemanticAnalyzer, see Var.address.
+
+    ``check_value`` is called with every value stored in a variable or
+    passed to a procedure, e.g. Budget.check_value.
+    """
+
+    def __init__(
+        self,
+        tree,
+        modules: dict = None,
+        max_depth: int = MAX_CALL_DEPTH,
+        max_cells: int = MAX_ARRAY_CELLS,
+        check_value: typing.Callable = None,
+    ):
         self.tree = tree
-        self.call_stack = CallStack()
+        self.call_stack = CallStack(max_depth, max_cells)
         self.modules = modules or {}
+        self.check_value = check_value
+        # ticks of the timed module actions, see RobotModule
+        self.durations = {}
 
     def log(self, msg):
         if _SHOULD_LOG_STACK:
@@ -1271,7 +1832,12 @@ class Interpreter(NodeVisitorGenerator):
         program_name = node.name
         self.log(f"ENTER: PROGRAM {program_name}")
 
-        ar = ActivationRecord(name=program_name, type=ARType.PROGRAM, nesting_level=1,)
+        ar = ActivationRecord(
+            name=program_name,
+            type=ARType.PROGRAM,
+            nesting_level=1,
+            size=node.n_slots,
+        )
         self.call_stack.push(ar)
 
         for module in node.uses:
@@ -1280,8 +1846,10 @@ class Interpreter(NodeVisitorGenerator):
                     error_code=ErrorCode.ID_NOT_FOUND, token=node, message=module
                 )
             else:
+                other = self.modules[module].other
                 for key, value in self.modules[module].func.items():
-                    ar[key] = value
+                    ar[node.functions[key]] = value
+                    self.durations[key] = other[key].get("duration")
 
         self.log(str(self.call_stack))
 
@@ -1297,13 +1865,24 @@ class Interpreter(NodeVisitorGenerator):
         yield from self.visit(node.compound_statement)
 
     def visit_VarDecl(self, node):
-        # Do nothing
+        type_node = node.type_node
+        if isinstance(type_node, ArrayType):
+            ar = self.call_stack.peek()
+            ar[node.var_node.address[1]] = self.call_stack.allocate(
+                ar,
+                ARRAY_TYPECODES[type_node.element.value],
+                type_node.high - type_node.low + 1,
+            )
         yield
 
     def visit_Type(self, node):
         # Do nothing
         yield
 
+    def visit_ProcedureDecl(self, node):
+        self.call_stack.peek()[node.slot] = node
+        yield
+
     def visit_BinOp(self, node):
         left = self.visit(node.left)
         right = self.visit(node.right)
@@ -1319,28 +1898,30 @@ class Interpreter(NodeVisitorGenerator):
             except StopIteration as e:
                 right = e.value
                 break
-        if node.op.type == TokenType.PLUS:
-            return left + right
-        elif node.op.type == TokenType.MINUS:
-            return left - right
-        elif node.op.type == TokenType.MUL:
-            return left * right
-        elif node.op.type == TokenType.INTEGER_DIV:
-            if right == 0:
-                raise Error(ErrorCode.ZERO_DIVISION, token=right)
-            return left // right
-        elif node.op.type == TokenType.FLOAT_DIV:
-            if right == 0:
-                raise Error(ErrorCode.ZERO_DIVISION, token=right)
-            return left / right
-        elif node.op.type == TokenType.EQUAL:
-            return int(left == right)
-        elif node.op.type == TokenType.NOT_EQUAL:
-            return int(left != right)
-        elif node.op.type == TokenType.MORE:
-            return int(left > right)
-        elif node.op.type == TokenType.LESS:
-            return int(left < right)
+        return node.operator(left, right)
+
+    def visit_BoolOp(self, node):
+        value = self.visit(node.left)
+        while True:
+            try:
+                yield next(value)
+            except StopIteration as e:
+                value = e.value
+                break
+        # the right operand takes no steps if the left one decides
+        if node.op.type == TokenType.AND:
+            if not value:
+                return 0
+        elif value:
+            return 1
+        value = self.visit(node.right)
+        while True:
+            try:
+                yield next(value)
+            except StopIteration as e:
+                value = e.value
+                break
+        return int(bool(value))
 
     def visit_IfElseStatement(self, node):
         value = self.visit(node.comp)
@@ -1378,11 +1959,11 @@ class Interpreter(NodeVisitorGenerator):
             n += 1
 
     def visit_Num(self, node):
-        yield
+        for _ in range(node.steps):
+            yield
         return node.value
 
     def visit_UnaryOp(self, node):
-        op = node.op.type
         expr = self.visit(node.expr)
         while True:
             try:
@@ -1390,18 +1971,13 @@ class Interpreter(NodeVisitorGenerator):
             except StopIteration as e:
                 expr = e.value
                 break
-
-        if op == TokenType.PLUS:
-            return +expr
-        elif op == TokenType.MINUS:
-            return -expr
+        return node.operator(expr)
 
     def visit_Compound(self, node):
         for child in node.children:
             yield from self.visit(child)
 
     def visit_Assign(self, node):
-        var_name = node.left.value
         var_value = self.visit(node.right)
         while True:
             try:
@@ -1410,21 +1986,53 @@ class Interpreter(NodeVisitorGenerator):
                 var_value = e.value
                 break
 
-        ar = self.call_stack.peek()
-        ar[var_name] = var_value
+        left = node.left
+        if isinstance(left, Subscript):
+            index = self.visit(left.index)
+            while True:
+                try:
+                    yield next(index)
+                except StopIteration as e:
+                    index = e.value
+                    break
+            depth, slot = left.var_node.address
+            items = self.call_stack.record(depth)[slot]
+            offset = array_index(items, index, left.low, left.var_node.value)
+            store_element(items, offset, var_value, left.var_node.value)
+            return
+
+        if self.check_value is not None:
+            self.check_value(var_value)
+        depth, slot = left.address
+        self.call_stack.record(depth)[slot] = var_value
 
     def visit_Var(self, node):
-        var_name = node.value
-
-        ar = self.call_stack.peek()
-        var_value = ar.get(var_name)
-        if isinstance(var_value, types.FunctionType):
+        if node.is_func:
+            # a module function read as a variable is 0, see SemanticAnalyzer
             var_value = 0
+        else:
+            depth, slot = node.address
+            var_value = self.call_stack.record(depth)[slot]
         yield
         return var_value
 
-    def visit_NoOp(self, node):
+    def visit_Subscript(self, node):
+        index = self.visit(node.index)
+        while True:
+            try:
+                yield next(index)
+            except StopIteration as e:
+                index = e.value
+                break
+        depth, slot = node.var_node.address
+        items = self.call_stack.record(depth)[slot]
+        offset = array_index(items, index, node.low, node.var_node.value)
         yield
+        return items[offset]
+
+    def visit_NoOp(self, node):
+        for _ in range(node.steps):
+            yield
 
     def visit_ProcedureCall(self, node):
         params = []
@@ -1438,10 +2046,22 @@ class Interpreter(NodeVisitorGenerator):
                     break
 
             params.append(param)
-        ar = self.call_stack.peek()
-        func = ar.get(node.proc_name)
+        depth, slot = node.address
+        record = self.call_stack.record(depth)
+        func = record[slot]
         if func is None:
             return -1
+        if isinstance(func, ProcedureDecl):
+            yield from self.call(func, params, record)
+            return
+        duration = self.durations.get(node.proc_name)
+        if duration is not None:
+            value = func(*params)
+            if value and duration > 1:
+                yield Wait(duration - 1)
+            else:
+                yield
+            return value
         func = func(*params)
         while True:
             try:
@@ -1451,6 +2071,19 @@ class Interpreter(NodeVisitorGenerator):
                 break
         return value
 
+    def call(self, node, params, enclosing):
+        self.log(f"ENTER: PROCEDURE {node.proc_name}")
+        if self.check_value is not None:
+            for value in params:
+                self.check_value(value)
+        ar = self.call_stack.enter(node.proc_name, node.n_slots, enclosing)
+        ar.slots[: len(params)] = params
+        # the call itself takes a step
+        yield
+        yield from self.visit(node.block_node)
+        self.log(f"LEAVE: PROCEDURE {node.proc_name}")
+        self.call_stack.leave()
+
     def interpret(self):
         tree = self.tree
         if tree is None:
@@ -0,0 +1,25 @@
+"""The functions of the robot modules, shared with the server.
+
+The server checks programs without the game and its dependencies, so the
+interface of every module is kept here as plain data: ``n_params`` and
+``duration`` of each function, see RobotModule.
+"""
+
+import typing
+
+MODULE_FUNCTIONS: typing.Dict[str, typing.Dict[str, dict]] = {
+    "debug": {
+        "writeln": {"n_params": -1, "duration": 1},
+    },
+    "legs": {
+        "up": {"n_params": 0, "duration": 2},
+        "down": {"n_params": 0, "duration": 2},
+        "left": {"n_params": 0, "duration": 2},
+        "right": {"n_params": 0, "duration": 2},
+    },
+}
+
+
+def describe(module: str) -> typing.Dict[str, dict]:
+    """A copy of the functions of the module, its RobotModule.other."""
+    return {func: dict(spec) for func, spec in MODULE_FUNCTIONS[module].items()}
@@ -0,0 +1,194 @@
+"""AST optimization pass run between SemanticAnalyzer and execution."""
+
+from .interpreter import (
+    NodeVisitor,
+    AST,
+    Token,
+    TokenType,
+    Num,
+    NoOp,
+    Compound,
+    Subscript,
+)
+
+
+class OptimizerStats:
+    def __init__(self):
+        self.folded = 0
+        self.branches = 0
+        self.loops = 0
+        self.flattened = 0
+        self.nodes_before = 0
+        self.nodes_after = 0
+
+    def report(self):
+        return (
+            f"folded {self.folded} expressions, "
+            f"resolved {self.branches} if statements, "
+            f"removed {self.loops} while loops, "
+            f"flattened {self.flattened} compounds: "
+            f"{self.nodes_before} -> {self.nodes_after} nodes"
+        )
+
+    def __repr__(self):
+        return f"<OptimizerStats({self.report()})>"
+
+
+class Optimizer(NodeVisitor):
+    """Folds constant expressions and removes statically dead code.
+
+    With ``preserve_steps`` the optimized program takes exactly as many
+    steps as the original one: a folded expression becomes a Num that
+    takes the steps of all its constants and a removed condition leaves a
+    NoOp that takes its steps, so mission results do not change. Without
+    it every constant takes a single step and dead code takes none.
+    """
+
+    def __init__(self, preserve_steps: bool = True, stats: OptimizerStats = None):
+        self.preserve_steps = preserve_steps
+        # may be shared to sum up the statistics of many programs
+        self.stats = stats if stats is not None else OptimizerStats()
+
+    def optimize(self, tree):
+        self.stats.nodes_before += count_nodes(tree)
+        tree = self.visit(tree)
+        self.stats.nodes_after += count_nodes(tree)
+        return tree
+
+    def skip(self, node):
+        """Statement replacing a removed constant condition."""
+        if self.preserve_steps:
+            return NoOp(steps=node.steps)
+        return Compound()
+
+    def visit_Program(self, node):
+        node.block = self.visit(node.block)
+        return node
+
+    def visit_Block(self, node):
+        node.declarations = [self.visit(decl) for decl in node.declarations]
+        node.compound_statement = self.visit(node.compound_statement)
+        return node
+
+    def visit_VarDecl(self, node):
+        return node
+
+    def visit_ProcedureDecl(self, node):
+        node.block_node = self.visit(node.block_node)
+        return node
+
+    def visit_Compound(self, node):
+        children = []
+        for child in node.children:
+            child = self.visit(child)
+            if isinstance(child, Compound):
+                self.stats.flattened += 1
+                children.extend(child.children)
+            else:
+                children.append(child)
+        node.children = children
+        return node
+
+    def visit_NoOp(self, node):
+        return node
+
+    def visit_Num(self, node):
+        return node
+
+    def visit_Var(self, node):
+        return node
+
+    def visit_Subscript(self, node):
+        node.index = self.visit(node.index)
+        return node
+
+    def visit_Assign(self, node):
+        node.right = self.visit(node.right)
+        if isinstance(node.left, Subscript):
+            self.visit(node.left)
+        return node
+
+    def visit_ProcedureCall(self, node):
+        node.actual_params = [self.visit(param) for param in node.actual_params]
+        return node
+
+    def visit_UnaryOp(self, node):
+        node.expr = expr = self.visit(node.expr)
+        if not isinstance(expr, Num):
+            return node
+        # the operator bound by SemanticAnalyzer, the one the engines use
+        return self.constant(node, node.operator(expr.value), expr.steps)
+
+    def visit_BinOp(self, node):
+        node.left = left = self.visit(node.left)
+        node.right = right = self.visit(node.right)
+        if not isinstance(left, Num) or not isinstance(right, Num):
+            return node
+        if right.value == 0 and node.op.type in (
+            TokenType.INTEGER_DIV,
+            TokenType.FLOAT_DIV,
+        ):
+            # the error is raised when the program gets there
+            return node
+        value = node.operator(left.value, right.value)
+        return self.constant(node, value, left.steps + right.steps)
+
+    def visit_BoolOp(self, node):
+        node.left = left = self.visit(node.left)
+        node.right = right = self.visit(node.right)
+        if not isinstance(left, Num):
+            return node
+        if bool(left.value) == (node.op.type == TokenType.OR):
+            # decided by the left operand, the right one is never evaluated
+            return self.constant(node, int(bool(left.value)), left.steps)
+        if isinstance(right, Num):
+            return self.constant(node, int(bool(right.value)), left.steps + right.steps)
+        return node
+
+    def constant(self, node, value, steps):
+        """Num of the value of a folded expression node, of its type."""
+        self.stats.folded += 1
+        if isinstance(value, float):
+            token_type = TokenType.REAL_CONST
+        else:
+            token_type = TokenType.INTEGER_CONST
+        token = Token(token_type, value, node.token.lineno, node.token.column)
+        return Num(token, steps if self.preserve_steps else 1, node.type)
+
+    def visit_IfElseStatement(self, node):
+        node.comp = comp = self.visit(node.comp)
+        node.on_true = self.visit(node.on_true)
+        node.on_false = self.visit(node.on_false)
+        if not isinstance(comp, Num):
+            return node
+        self.stats.branches += 1
+        branch = node.on_true if comp.value else node.on_false
+        compound = Compound()
+        compound.children = [self.skip(comp), branch]
+        return compound
+
+    def visit_WhileStatement(self, node):
+        node.comp = comp = self.visit(node.comp)
+        node.body = self.visit(node.body)
+        if not isinstance(comp, Num) or comp.value:
+            return node
+        self.stats.loops += 1
+        return self.skip(comp)
+
+
+def count_nodes(node) -> int:
+    count = 1
+    for name in node.__slots__:
+        value = getattr(node, name)
+        if isinstance(value, AST):
+            count += count_nodes(value)
+        elif isinstance(value, list):
+            count += sum(count_nodes(item) for item in value if isinstance(item, AST))
+    return count
+
+
+def optimize(tree, preserve_steps: bool = True, stats: OptimizerStats = None):
+    """Optimize an analyzed tree in place, returns it and the statistics."""
+    optimizer = Optimizer(preserve_steps, stats)
+    tree = optimizer.optimize(tree)
+    return tree, optimizer.stats
@@ -0,0 +1,367 @@
+"""Flat-loop virtual machine for compiled ShizoSkript programs."""
+
+from .compiler import Op, CodeObject, Procedure, MAX_LOOP_ITERATIONS
+from .interpreter import (
+    Error,
+    ErrorCode,
+    Wait,
+    CallStack,
+    ActivationRecord,
+    ARType,
+    array_index,
+    store_element,
+)
+from .budget import Budget
+
+STEP = Op.STEP
+CONST = Op.CONST
+LOAD = Op.LOAD
+STORE = Op.STORE
+ADD = Op.ADD
+SUB = Op.SUB
+MUL = Op.MUL
+INTEGER_DIV = Op.INTEGER_DIV
+FLOAT_DIV = Op.FLOAT_DIV
+EQUAL = Op.EQUAL
+NOT_EQUAL = Op.NOT_EQUAL
+MORE = Op.MORE
+LESS = Op.LESS
+BINARY_NONE = Op.BINARY_NONE
+NEG = Op.NEG
+POS = Op.POS
+JUMP = Op.JUMP
+JUMP_IF_FALSE = Op.JUMP_IF_FALSE
+JUMP_IF_TRUE = Op.JUMP_IF_TRUE
+JUMP_IF_FALSE_OR_POP = Op.JUMP_IF_FALSE_OR_POP
+JUMP_IF_TRUE_OR_POP = Op.JUMP_IF_TRUE_OR_POP
+BOOL = Op.BOOL
+LOAD_OUTER = Op.LOAD_OUTER
+STORE_OUTER = Op.STORE_OUTER
+DEFINE = Op.DEFINE
+RETURN = Op.RETURN
+ARRAY = Op.ARRAY
+LOAD_ELEMENT = Op.LOAD_ELEMENT
+STORE_ELEMENT = Op.STORE_ELEMENT
+LOAD_FUNC = Op.LOAD_FUNC
+LOOP_FUSED = Op.LOOP_FUSED
+LOOP_ENTER = Op.LOOP_ENTER
+LOOP_NEXT = Op.LOOP_NEXT
+POP = Op.POP
+CALL = Op.CALL
+HALT = Op.HALT
+
+
+class VM:
+    """Executes a CodeObject, yielding once per interpreter step.
+
+    ``VM(code, modules).run()`` is a drop-in replacement for
+    ``Interpreter(tree, modules).interpret()``.
+
+    The whole state of the program is kept in the attributes between two
+    steps, so a pickled VM continues in another process with a new run():
+    the pc, the value stack, the records and the return addresses.
+    """
+
+    def __init__(self, code: CodeObject, modules: dict = None, budget: Budget = None):
+        self.code = code
+        self.modules = modules or {}
+        self.budget = budget if budget is not None else Budget()
+        self.pc = 0
+        self.stack = []
+        # records of the program and the running procedure calls
+        self.call_stack = CallStack(self.budget.call_depth, self.budget.array_cells)
+        self.call_stack.push(
+            ActivationRecord(
+                name=code.name,
+                type=ARType.PROGRAM,
+                nesting_level=1,
+                size=len(code.names),
+            )
+        )
+        # return addresses of the running procedure calls
+        self.returns = []
+        self.slots = self.call_stack.peek().slots
+        # ticks of the timed module action in a global slot, None for
+        # generators
+        self.durations = [None] * len(code.names)
+        # the (FusedLoop, generator) running, see __getstate__
+        self.fused = None
+        # the generator of the module function running
+        self.action = None
+
+        index = {name: i for i, name in enumerate(code.names)}
+        for module in code.uses:
+            if module not in self.modules:
+                raise Error(
+                    error_code=ErrorCode.ID_NOT_FOUND, token=None, message=module
+                )
+            other = self.modules[module].other
+            for key, value in self.modules[module].func.items():
+                if key in index:
+                    self.slots[index[key]] = value
+                    self.durations[index[key]] = other[key].get("duration")
+
+    def name(self, pc: int, arg) -> str:
+        """Name of the variable of the (depth, slot, ...) argument of the
+        instruction before pc, for the error messages."""
+        return self.code.scope(pc - 1, arg[0])[arg[1]]
+
+    def __getstate__(self):
+        """The VM between two steps. Inside a fused loop it is pickled as
+        if it ran the plain instructions of the loop, with the values the
+        loop keeps in local variables on the stack, and the restored VM
+        goes on with them."""
+        if self.action is not None:
+            raise TypeError(f"can not pickle a VM in a module action at {self.pc}")
+        state = self.__dict__.copy()
+        state["fused"] = None
+        if self.fused is not None:
+            loop, generator = self.fused
+            values = generator.gi_frame.f_locals
+            stack = [values[name] for name in loop.stacks[self.pc]]
+            state["stack"] = self.stack + stack
+        return state
+
+    def run(self):
+        code = self.code.code
+        consts = self.code.consts
+        procedures = self.code.procedures
+        loops = self.code.loops
+        call_stack = self.call_stack
+        returns = self.returns
+        # record of the running scope
+        record = call_stack.peek()
+        slots = record.slots
+        durations = self.durations
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        budget = self.budget
+        charge = budget.charge
+        check_value = budget.check_value
+        check_values = budget.int_limit is not None
+        pc = self.pc
+        # instructions since the budget was last charged
+        executed = 0
+
+        while True:
+            op, arg = code[pc]
+            pc += 1
+            executed += 1
+            if op == LOAD:
+                push(slots[arg])
+                self.pc = pc
+                charge(executed)
+                executed = 0
+                yield
+            elif op == CONST:
+                push(consts[arg])
+                self.pc = pc
+                charge(executed)
+                executed = 0
+                yield
+            elif op == STORE:
+                value = pop()
+                if check_values:
+                    check_value(value)
+                slots[arg] = value
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP_IF_TRUE:
+                if pop():
+                    pc = arg
+            elif op == LOOP_NEXT:
+                if stack[-1] < MAX_LOOP_ITERATIONS:
+                    stack[-1] += 1
+                else:
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == ADD:
+                right = pop()
+                stack[-1] = stack[-1] + right
+            elif op == SUB:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif op == LESS:
+                right = pop()
+                stack[-1] = int(stack[-1] < right)
+            elif op == MORE:
+                right = pop()
+                stack[-1] = int(stack[-1] > right)
+            elif op == EQUAL:
+                right = pop()
+                stack[-1] = int(stack[-1] == right)
+            elif op == NOT_EQUAL:
+                right = pop()
+                stack[-1] = int(stack[-1] != right)
+            elif op == MUL:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif op == INTEGER_DIV:
+                right = pop()
+                if right == 0:
+                    raise Error(ErrorCode.ZERO_DIVISION, token=right)
+                stack[-1] = stack[-1] // right
+            elif op == FLOAT_DIV:
+                right = pop()
+                if right == 0:
+                    raise Error(ErrorCode.ZERO_DIVISION, token=right)
+                stack[-1] = stack[-1] / right
+            elif op == STEP:
+                self.pc = pc
+                charge(executed)
+                executed = 0
+                yield
+            elif op == CALL:
+                depth, slot, n_params = arg
+                if n_params:
+                    params = stack[-n_params:]
+                    del stack[-n_params:]
+                else:
+                    params = ()
+                enclosing = record
+                while depth:
+                    enclosing = enclosing.enclosing
+                    depth -= 1
+                func = enclosing.slots[slot]
+                if func.__class__ is Procedure:
+                    if check_values:
+                        for value in params:
+                            check_value(value)
+                    record = call_stack.enter(func.name, func.n_slots, enclosing)
+                    slots = record.slots
+                    slots[:n_params] = params
+                    returns.append(pc)
+                    pc = func.entry
+                    self.pc = pc
+                    charge(executed)
+                    executed = 0
+                    yield
+                elif func is not None:
+                    self.pc = pc
+                    charge(executed)
+                    executed = 0
+                    duration = durations[slot]
+                    if duration is None:
+                        self.action = func(*params)
+                        yield from self.action
+                        self.action = None
+                    elif func(*params) and duration > 1:
+                        yield Wait(duration - 1)
+                    else:
+                        yield
+            elif op == RETURN:
+                call_stack.leave()
+                record = call_stack.peek()
+                slots = record.slots
+                pc = returns.pop()
+            elif op == LOAD_OUTER:
+                depth, slot = arg
+                enclosing = record
+                while depth:
+                    enclosing = enclosing.enclosing
+                    depth -= 1
+                push(enclosing.slots[slot])
+                self.pc = pc
+                charge(executed)
+                executed = 0
+                yield
+            elif op == STORE_OUTER:
+                depth, slot = arg
+                enclosing = record
+                while depth:
+                    enclosing = enclosing.enclosing
+                    depth -= 1
+                value = pop()
+                if check_values:
+                    check_value(value)
+                enclosing.slots[slot] = value
+            elif op == LOAD_ELEMENT:
+                depth, slot, low = arg
+                enclosing = record
+                while depth:
+                    enclosing = enclosing.enclosing
+                    depth -= 1
+                items = enclosing.slots[slot]
+                index = stack[-1]
+                if index.__class__ is not int or not low <= index < low + len(items):
+                    # raises the error
+                    array_index(items, index, low, self.name(pc, arg))
+                stack[-1] = items[index - low]
+                self.pc = pc
+                charge(executed)
+                executed = 0
+                yield
+            elif op == STORE_ELEMENT:
+                depth, slot, low = arg
+                enclosing = record
+                while depth:
+                    enclosing = enclosing.enclosing
+                    depth -= 1
+                items = enclosing.slots[slot]
+                index = pop()
+                value = pop()
+                if index.__class__ is not int or not low <= index < low + len(items):
+                    array_index(items, index, low, self.name(pc, arg))
+                try:
+                    items[index - low] = value
+                except (TypeError, OverflowError):
+                    # raises the error
+                    store_element(items, index - low, value, self.name(pc, arg))
+            elif op == ARRAY:
+                slot, typecode, size = arg
+                slots[slot] = call_stack.allocate(record, typecode, size)
+                self.pc = pc
+                charge(executed)
+                executed = 0
+                yield
+            elif op == DEFINE:
+                slot, index = arg
+                slots[slot] = procedures[index]
+            elif op == LOAD_FUNC:
+                # a module function read as a variable is 0
+                push(0)
+                self.pc = pc
+                charge(executed)
+                executed = 0
+                yield
+            elif op == LOOP_ENTER:
+                push(0)
+            elif op == LOOP_FUSED:
+                loop = loops[arg]
+                generator = loop.function(
+                    self, record, executed, budget, check_values, check_value, consts
+                )
+                self.fused = (loop, generator)
+                executed = yield from generator
+                self.fused = None
+                pc = loop.end
+            elif op == POP:
+                pop()
+            elif op == NEG:
+                stack[-1] = -stack[-1]
+            elif op == POS:
+                stack[-1] = +stack[-1]
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if stack[-1]:
+                    pop()
+                else:
+                    stack[-1] = 0
+                    pc = arg
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    stack[-1] = 1
+                    pc = arg
+                else:
+                    pop()
+            elif op == BOOL:
+                stack[-1] = int(bool(stack[-1]))
+            elif op == BINARY_NONE:
+                pop()
+                stack[-1] = None
+            elif op == HALT:
+                self.pc = pc - 1
+                charge(executed)
+                return
@@ -0,0 +1,175 @@
+"""Every limit of a Budget stops a program with a BudgetError, in the VM
+and in the fused loops alike.
+
+    $ python -m unittest discover -s tests
+"""
+
+import unittest
+
+from rsinterpreter.interpreter import Lexer, Parser, SemanticAnalyzer, BudgetError
+from rsinterpreter.compiler import Compiler
+from rsinterpreter.vm import VM
+from rsinterpreter.budget import Budget
+from rsinterpreter.fusion import fuse
+from rsinterpreter.game import CircusMission
+
+FOREVER = """
+    program forever;
+    var a: integer;
+    begin
+        a := 0;
+        while 1 = 1 do begin a := a + 1 end
+    end.
+"""
+
+DOUBLING = {
+    "store": """
+        program doubling;
+        var a, i: integer;
+        begin
+            a := 1; i := 0;
+            while i < 100 do begin a := a + a; i := i + 1 end
+        end.
+    """,
+    "store outer": """
+        program doubling;
+        var a: integer;
+        procedure double(n: integer);
+        var i: integer;
+        begin
+            i := 0;
+            while i < n do begin a := a + a; i := i + 1 end
+        end;
+        begin
+            a := 1;
+            double(100)
+        end.
+    """,
+    "store outer, not fused": """
+        program doubling;
+        var a: integer;
+        procedure double;
+        begin a := a + a end;
+        procedure repeat(n: integer);
+        begin
+            if n > 0 then begin double(); repeat(n - 1) end
+        end;
+        begin
+            a := 1;
+            repeat(20); repeat(20); repeat(20); repeat(20); repeat(20)
+        end.
+    """,
+    "negative": """
+        program doubling;
+        var a, i: integer;
+        begin
+            a := 0 - 1; i := 0;
+            while i < 100 do begin a := a * 2; i := i + 1 end
+        end.
+    """,
+}
+
+
+def run(text: str, budget: Budget, fused: bool = True):
+    """Run the program in the VM, returns the error message or None."""
+    tree = Parser(Lexer(text)).parse()
+    SemanticAnalyzer({}).visit(tree)
+    compiler = Compiler({})
+    code = compiler.compile(tree)
+    if fused:
+        fuse(code, compiler.loops)
+    try:
+        for _ in VM(code, budget=budget).run():
+            pass
+    except BudgetError as e:
+        return e.message
+    return None
+
+
+class BudgetTest(unittest.TestCase):
+    def assertLimit(self, text: str, message: str, **limits):
+        """Both VMs stop at the same instruction, with the message."""
+        used = []
+        for fused in (False, True):
+            budget = Budget(**limits)
+            with self.subTest(fused=fused):
+                self.assertEqual(run(text, budget, fused), "BudgetError: " + message)
+            used.append(budget.used)
+        self.assertEqual(used[0], used[1])
+
+    def test_instructions(self):
+        self.assertLimit(FOREVER, "more than 100 instructions", instructions=100)
+
+        budget = Budget()
+        self.assertIsNone(run(DOUBLING["store"], budget))
+        # exactly the instructions the program needs are enough
+        self.assertIsNone(run(DOUBLING["store"], Budget(instructions=budget.used)))
+        self.assertEqual(
+            run(DOUBLING["store"], Budget(instructions=budget.used - 1)),
+            f"BudgetError: more than {budget.used - 1} instructions",
+        )
+
+    def test_seconds(self):
+        budget = Budget(seconds=0)
+        self.assertEqual(run(FOREVER, budget), "BudgetError: longer than 0 seconds")
+        self.assertTrue(budget.timed_out)
+        self.assertIsNone(run(DOUBLING["store"], Budget(seconds=60)))
+
+    def test_int_bits(self):
+        for title, text in DOUBLING.items():
+            with self.subTest(title):
+                self.assertLimit(text, "a value larger than 64 bits", int_bits=64)
+                self.assertIsNone(run(text, Budget(int_bits=101)))
+
+    def test_int_bits_bounds(self):
+        text = "program big; var a: integer; begin a := {} end."
+        budget = Budget(int_bits=8)
+        self.assertIsNone(run(text.format(255), budget))
+        self.assertIsNone(run(text.format("0 - 255"), budget))
+        self.assertIsNotNone(run(text.format(256), budget))
+        self.assertIsNotNone(run(text.format("0 - 256"), budget))
+        # reals are not bounded
+        real = "program big; var a: real; begin a := 1000.5 end."
+        self.assertIsNone(run(real, budget))
+
+    def test_frames(self):
+        text = """
+            program walk;
+            use legs;
+            begin right(); right(); down(); down() end.
+        """
+        code = CircusMission.compile(Parser(Lexer(text)).parse())
+        mission = CircusMission(code, seed=1, budget=Budget(frames=3))
+        with self.assertRaises(BudgetError) as error:
+            mission.play()
+        self.assertEqual(error.exception.message, "BudgetError: more than 3 frames")
+        self.assertIsNotNone(CircusMission(code, budget=Budget(frames=30)).play())
+
+    def test_call_depth(self):
+        text = """
+            program recursion;
+            procedure down(n: integer);
+            begin if n > 0 then begin down(n - 1) end end;
+            begin down({}) end.
+        """
+        self.assertLimit(text.format(100), "more than 8 nested calls", call_depth=8)
+        self.assertIsNone(run(text.format(7), Budget(call_depth=8)))
+
+    def test_array_cells(self):
+        text = """
+            program arrays;
+            var a: array[1..{}] of integer;
+            procedure more;
+            var b: array[1..5] of integer;
+            begin b[1] := 1 end;
+            begin a[1] := 1; more() end.
+        """
+        self.assertLimit(text.format(20), "more than 10 array elements", array_cells=10)
+        # the cells of the procedure count while it runs
+        self.assertLimit(text.format(6), "more than 10 array elements", array_cells=10)
+        self.assertIsNone(run(text.format(5), Budget(array_cells=10)))
+        self.assertLimit(text.format(100000), "more than 65536 array elements")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""The program and result caches of the worker.
+
+    $ python -m unittest discover -s tests
+"""
+
+import unittest
+
+from rsinterpreter.cache import LRUCache, ProgramCache, ResultCache, normalize
+from rsinterpreter.game import CircusMission
+from rsinterpreter.interpreter import ErrorCode
+
+PROGRAM = """program walk;
+use legs;
+begin
+    up();
+    left()
+end.
+"""
+
+
+class NoModulesMission(CircusMission):
+    @staticmethod
+    def build():
+        return []
+
+
+class FakeManager:
+    """The dict() of a multiprocessing.Manager, without the process."""
+
+    def dict(self):
+        return {}
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.store("a", 1)
+        cache.store("b", 2)
+        self.assertEqual(cache.lookup("a"), 1)
+        # "b" is the least recently used one now
+        cache.store("c", 3)
+        self.assertIsNone(cache.lookup("b"))
+        self.assertEqual(cache.lookup("a"), 1)
+        self.assertEqual(cache.lookup("c"), 3)
+        self.assertEqual(
+            cache.stats(), {"hits": 3, "misses": 1, "size": 2, "shared_size": None}
+        )
+
+    def test_shared(self):
+        manager = FakeManager()
+        first = LRUCache(maxsize=2)
+        first.share(manager)
+        second = LRUCache(maxsize=2)
+        second.manager, second.shared = manager, first.shared
+
+        first.store("a", 1)
+        self.assertEqual(second.lookup("a"), 1)
+        self.assertEqual(second.stats()["size"], 1)
+        first.store("b", 2)
+        first.store("c", 3)
+        self.assertEqual(list(first.shared), ["b", "c"])
+        # still in the LRU of the second process
+        self.assertEqual(second.lookup("a"), 1)
+        first.clear()
+        self.assertEqual(first.stats()["shared_size"], 0)
+
+
+class ProgramCacheTest(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize("a  \n\tb\t\n\n  "), "a\n\tb")
+
+    def test_key(self):
+        key = ProgramCache.key(PROGRAM, CircusMission)
+        self.assertEqual(key, ProgramCache.key(PROGRAM, CircusMission))
+        self.assertNotEqual(key, ProgramCache.key(PROGRAM + " ", CircusMission))
+        self.assertNotEqual(key, ProgramCache.key(PROGRAM, NoModulesMission))
+
+    def test_get(self):
+        cache = ProgramCache(maxsize=4)
+        entry = cache.get(PROGRAM, CircusMission)
+        self.assertIsNone(entry.error)
+        self.assertIsNotNone(entry.code)
+        # trailing whitespace doesn't make another entry
+        self.assertIs(cache.get(PROGRAM.replace("\n", "  \n"), CircusMission), entry)
+        self.assertEqual(entry.key, ProgramCache.key(normalize(PROGRAM), CircusMission))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_errors(self):
+        cache = ProgramCache(maxsize=4)
+        entry = cache.get(PROGRAM, NoModulesMission)
+        self.assertIsNone(entry.code)
+        self.assertEqual(entry.error.error_code, ErrorCode.ID_NOT_FOUND)
+        # the error is cached as well
+        self.assertIs(cache.get(PROGRAM, NoModulesMission), entry)
+
+        entry = cache.get("program broken; begin", CircusMission)
+        self.assertIsNone(entry.code)
+        self.assertIn("ParserError", entry.error.message)
+
+    def test_eviction(self):
+        cache = ProgramCache(maxsize=2)
+        texts = [PROGRAM.replace("up()", "up()" + "; up()" * n) for n in range(3)]
+        entries = [cache.get(text, CircusMission) for text in texts]
+        self.assertIsNot(cache.get(texts[0], CircusMission), entries[0])
+        self.assertIs(cache.get(texts[2], CircusMission), entries[2])
+        self.assertEqual(len(cache.entries), 2)
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_key(self):
+        cache = ResultCache(maxsize=4)
+        cache.put("circus", "abc", 7, {"verdict": "win"})
+        self.assertEqual(cache.get("circus", "abc", 7), {"verdict": "win"})
+        self.assertIsNone(cache.get("circus", "abc", 8))
+        self.assertIsNone(cache.get("circus", "abd", 7))
+        self.assertIsNone(cache.get("maze", "abc", 7))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_eviction(self):
+        cache = ResultCache(maxsize=2)
+        for seed in range(3):
+            cache.put("circus", "abc", seed, {"seed": seed})
+        self.assertIsNone(cache.get("circus", "abc", 0))
+        self.assertEqual(cache.get("circus", "abc", 2), {"seed": 2})
+
+    def test_seeded_runs(self):
+        # a cached result stands for every run with the same seed
+        code = ProgramCache.compile("", PROGRAM, CircusMission).code
+        missions = [CircusMission(code, seed=3) for _ in range(2)]
+        runs = [(mission.play(), mission.texts) for mission in missions]
+        self.assertEqual(runs[0], runs[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
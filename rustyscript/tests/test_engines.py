@@ -0,0 +1,444 @@
+"""The tree walking Interpreter, the VM and the VM with fused loops must run
+every program the same way: the same steps, variables and errors.
+
+    $ python -m unittest discover -s tests
+"""
+
+import pickle
+import random
+import unittest
+
+from rsinterpreter.interpreter import (
+    Lexer,
+    Parser,
+    SemanticAnalyzer,
+    Interpreter,
+    Error,
+    Wait,
+)
+from rsinterpreter.compiler import Compiler
+from rsinterpreter.vm import VM
+from rsinterpreter.budget import Budget
+from rsinterpreter.optimizer import optimize
+from rsinterpreter.fusion import fuse
+from rsinterpreter.game import CircusMission, Mission, MAX_STEPS
+
+# steps of a program that are compared at most
+MAX_TRACE = 5000
+
+PROGRAMS = {
+    "nested loops": """
+        program nested;
+        var i, j, x: integer;
+        begin
+            i := 0; x := 0;
+            while i < 20 do begin
+                j := 0;
+                while j < i and x > 0 - 1 do begin
+                    x := x + j - i div 3;
+                    j := j + 1
+                end;
+                i := i + 1
+            end
+        end.
+    """,
+    "zero division in a loop": """
+        program zero;
+        var a, b: integer;
+        begin
+            a := 0;
+            while a < 10 do begin a := a + 1; b := 10 div (5 - a) end
+        end.
+    """,
+    "loops in procedures": """
+        program procs;
+        var x: integer;
+        procedure count(n: integer);
+        var i: integer;
+        begin
+            i := 0;
+            while i < n do begin x := x + i; i := i + 1 end;
+            if n > 0 then begin count(n - 1) end
+        end;
+        begin
+            x := 0;
+            count(6)
+        end.
+    """,
+    "conditions": """
+        program conditions;
+        var i, x: integer;
+        begin
+            i := 0; x := 0;
+            while i < 300 and (x > 0 - 1 or i = 0) do begin
+                if x > 5 or i div 2 * 2 = i and x < 3 then begin x := x + 1 end;
+                x := x + (i > 100 and x < 50);
+                i := i + 1
+            end
+        end.
+    """,
+    "real arithmetic": """
+        program reals;
+        var i: integer;
+        x, y: real;
+        begin
+            i := 0; x := 0.5; y := 0;
+            while i < 100 do begin
+                y := (x * 2 + i) / 3 - -y / 4;
+                if y > 10 then begin y := y - 10.5 end;
+                i := i + 1
+            end;
+            y := y / (x - 0.5)
+        end.
+    """,
+    "iteration limit": """
+        program forever;
+        var a: integer;
+        begin
+            a := 0;
+            while 1 = 1 do begin a := a + 1 end;
+            a := a * 2
+        end.
+    """,
+    "module calls": """
+        program walk;
+        use legs;
+        var i, x: integer;
+        begin
+            i := 0; x := up + 1;
+            while i < 5 do begin
+                up(); x := x + left;
+                i := i + 1
+            end
+        end.
+    """,
+}
+
+# programs squaring a value 12 times, to 3 ** 4096; they stop soon even
+# when the value is not checked
+INT_BITS_PROGRAMS = {
+    "assignments": """
+        program grow;
+        var a, i: integer;
+        begin
+            a := 3; i := 0;
+            while i < 12 do begin a := a * a; i := i + 1 end
+        end.
+    """,
+    "arguments": """
+        program grow;
+        procedure sq(a: integer; n: integer);
+        begin
+            if n > 0 then begin sq(a * a, n - 1) end
+        end;
+        begin sq(3, 12) end.
+    """,
+}
+
+
+class Legs:
+    """The call shape of LegsModule, recording the moves instead."""
+
+    name = "legs"
+
+    def __init__(self):
+        self.moves = []
+        self.func = {"up": self.up, "down": self.down, "left": self.left}
+        self.other = {
+            "up": {"n_params": 0, "duration": 2},
+            "down": {"n_params": 0, "duration": 2},
+            "left": {"n_params": 0, "duration": 2},
+        }
+
+    def up(self):
+        self.moves.append("up")
+        return 1
+
+    def down(self):
+        self.moves.append("down")
+        return 0
+
+    def left(self):
+        self.moves.append("left")
+        return 1
+
+
+def expression(rng, real: bool, depth: int = 0) -> str:
+    choice = rng.random()
+    if depth > 2 or choice < 0.3:
+        return str(rng.randint(0, 5))
+    if choice < 0.5:
+        return rng.choice("abc")
+    if choice < 0.55:
+        return rng.choice(["up", "left"])
+    if choice < 0.65:
+        return "-" + expression(rng, real, depth + 1)
+    operators = ["+", "-", "*", "/"] if real else ["+", "-", "+", " div "]
+    left = expression(rng, real, depth + 1)
+    right = expression(rng, real, depth + 1)
+    return f"({left}{rng.choice(operators)}{right})"
+
+
+def condition(rng, real: bool, depth: int = 0) -> str:
+    if depth < 2 and rng.random() < 0.3:
+        left = condition(rng, real, depth + 1)
+        right = condition(rng, real, depth + 1)
+        return f"({left}{rng.choice([' and ', ' or '])}{right})"
+    left = expression(rng, real)
+    right = expression(rng, real)
+    return f"{left} {rng.choice(['<', '>', '=', '<>'])} {right}"
+
+
+def statement(rng, real: bool, depth: int = 0) -> str:
+    choice = rng.random()
+    if depth > 3 or choice < 0.35:
+        return f"{rng.choice('abc')} := {expression(rng, real)}"
+    if choice < 0.45:
+        return rng.choice(["up()", "down()", "left()"])
+    if choice < 0.65:
+        text = f"if {condition(rng, real)} then {compound(rng, real, depth + 1)}"
+        if rng.random() < 0.5:
+            text += f" else {compound(rng, real, depth + 1)}"
+        return text
+    if choice < 0.85:
+        return f"while {condition(rng, real)} do {compound(rng, real, depth + 1)}"
+    if choice < 0.9:
+        return ""
+    return compound(rng, real, depth + 1)
+
+
+def compound(rng, real: bool, depth: int = 0) -> str:
+    statements = [statement(rng, real, depth) for _ in range(rng.randint(1, 4))]
+    return "begin " + "; ".join(statements) + " end"
+
+
+def random_program(rng) -> str:
+    """A well typed program of integer or real variables, the pure parts of
+    it are fused, the rest runs in the VM. Half of the programs run in a
+    procedure, so their variables are local or outer ones."""
+    real = rng.random() < 0.3
+    kind = "real" if real else "integer"
+    body = "; ".join(statement(rng, real) for _ in range(rng.randint(1, 5)))
+    if rng.random() < 0.5:
+        return (
+            f"program p; use legs; var a, b, c: {kind}; begin "
+            f"a := 0; b := 1; c := 2; {body} end."
+        )
+    return (
+        f"program p; use legs; var a, b: {kind}; "
+        f"procedure f(c: {kind}); begin {body} end; "
+        f"begin a := 0; b := 1; f(2); f(a) end."
+    )
+
+
+def program_slots(call_stack) -> tuple:
+    """The numbers in the variables of the program."""
+    try:
+        record = call_stack.peek()
+    except IndexError:
+        # the first step of the Interpreter is before the program starts
+        return ()
+    while record.enclosing is not None:
+        record = record.enclosing
+    return tuple(value for value in record.slots if isinstance(value, (int, float)))
+
+
+def run(
+    engine: str,
+    text: str,
+    optimized: bool = False,
+    pause: int = None,
+    int_bits: int = None,
+):
+    """The steps of the program in an engine, its moves and its error.
+    Every step is the value yielded, the variables of the program and, in
+    the VMs, the pc and the instructions charged to the budget. After
+    ``pause`` steps the VM is pickled and goes on in the unpickled copy.
+    Values of more than ``int_bits`` bits stop the program."""
+    modules = {"legs": Legs()}
+    tree = Parser(Lexer(text)).parse()
+    SemanticAnalyzer(modules).visit(tree)
+    if optimized:
+        tree, _ = optimize(tree)
+    if engine == "tree walker":
+        interpreter = Interpreter(
+            tree, modules=modules, check_value=Budget(int_bits=int_bits).check_value
+        )
+        steps = interpreter.interpret()
+        call_stack = interpreter.call_stack
+        vm = None
+    else:
+        compiler = Compiler(modules)
+        code = compiler.compile(tree)
+        if engine == "fused vm":
+            fuse(code, compiler.loops)
+        vm = VM(code, modules=modules, budget=Budget(int_bits=int_bits))
+        steps = vm.run()
+        call_stack = vm.call_stack
+
+    trace = []
+    error = None
+    try:
+        while len(trace) < MAX_TRACE:
+            if len(trace) == pause:
+                vm = pickle.loads(pickle.dumps(vm))
+                modules = vm.modules
+                call_stack = vm.call_stack
+                steps = vm.run()
+            try:
+                value = next(steps)
+            except StopIteration:
+                break
+            if value.__class__ is Wait:
+                value = value.ticks
+            step = (value, program_slots(call_stack))
+            if vm is not None:
+                step += (vm.pc, vm.budget.used)
+            trace.append(step)
+    except Error as e:
+        error = (e.__class__.__name__, e.error_code, e.message)
+    return trace, modules["legs"].moves, error
+
+
+class RunTestCase(unittest.TestCase):
+    def assertSameRun(self, result, expected, engine: str):
+        trace, moves, error = result
+        expected_trace, expected_moves, expected_error = expected
+        for index, (step, expected_step) in enumerate(zip(trace, expected_trace)):
+            if step != expected_step:
+                self.fail(f"{engine}, step {index}: {step} != {expected_step}")
+        self.assertEqual(len(trace), len(expected_trace), engine)
+        self.assertEqual(moves, expected_moves, engine)
+        self.assertEqual(error, expected_error, engine)
+
+
+class EngineTest(RunTestCase):
+    def check(self, text: str, int_bits: int = None):
+        expected = run("tree walker", text, int_bits=int_bits)
+        for optimized in (False, True):
+            title = "optimized " if optimized else ""
+            vm = run("bytecode vm", text, optimized, int_bits=int_bits)
+            # the tree walker knows neither pcs nor the budget
+            steps = ([step[:2] for step in vm[0]],) + vm[1:]
+            self.assertSameRun(steps, expected, title + "bytecode vm")
+            fused = run("fused vm", text, optimized, int_bits=int_bits)
+            self.assertSameRun(fused, vm, title + "fused vm")
+        return expected
+
+    def test_programs(self):
+        for title, text in PROGRAMS.items():
+            with self.subTest(title):
+                self.check(text)
+
+    def test_random_programs(self):
+        for seed in range(150):
+            text = random_program(random.Random(seed))
+            with self.subTest(seed=seed, text=text):
+                self.check(text)
+
+    def test_int_bits(self):
+        for title, text in INT_BITS_PROGRAMS.items():
+            with self.subTest(title):
+                _, _, error = self.check(text, int_bits=64)
+                self.assertEqual(error[0], "BudgetError")
+        for seed in range(50):
+            text = random_program(random.Random(seed))
+            with self.subTest(seed=seed, text=text):
+                self.check(text, int_bits=2)
+
+    def test_fused(self):
+        """The pure loops of PROGRAMS are fused, the loop calling the module
+        is not, so the tests above compare the fused code at all."""
+        fused = {
+            "nested loops": 1,
+            "loops in procedures": 1,
+            "iteration limit": 1,
+            "module calls": 0,
+        }
+        for title, n_loops in fused.items():
+            modules = {"legs": Legs()}
+            tree = Parser(Lexer(PROGRAMS[title])).parse()
+            SemanticAnalyzer(modules).visit(tree)
+            compiler = Compiler(modules)
+            code = compiler.compile(tree)
+            self.assertEqual(fuse(code, compiler.loops), n_loops, title)
+
+
+class SnapshotTest(RunTestCase):
+    KEY = b"test key"
+    TEXT = """
+        program circus;
+        use legs;
+        var i, j, x: integer;
+        begin
+            i := 0; x := 0;
+            while i < 4 do begin
+                right();
+                j := 0;
+                while j < 3 and x > 0 - 1 do begin x := x + j div 2; j := j + 1 end;
+                i := i + 1
+            end;
+            down(); down(); left(); left(); up(); up()
+        end.
+    """
+
+    def test_pickle_in_fused_loop(self):
+        """A VM pickled inside a fused loop goes on with the plain
+        instructions of the loop, its stack rebuilt from the loop's
+        variables."""
+        rng = random.Random(0)
+        for title in ("nested loops", "conditions", "iteration limit"):
+            text = PROGRAMS[title]
+            expected = run("bytecode vm", text)
+            for pause in rng.sample(range(1, len(expected[0])), 40):
+                with self.subTest(title, pause=pause):
+                    resumed = run("fused vm", text, pause=pause)
+                    self.assertSameRun(resumed, expected, "resumed fused vm")
+
+    @staticmethod
+    def outcome(mission: Mission, result) -> tuple:
+        return result, mission.n_steps, mission.texts, mission.budget.used
+
+    def test_pause_in_fused_loop(self):
+        code = CircusMission.compile(Parser(Lexer(self.TEXT)).parse())
+        self.assertTrue(code.loops)
+        mission = CircusMission(code, seed=5)
+        expected = self.outcome(mission, mission.play())
+
+        # the program ends before the mission does
+        self.assertLessEqual(expected[1], MAX_STEPS)
+        fused = 0
+        for turns in range(1, 8):
+            mission = CircusMission(code, seed=5)
+            result = None
+            while result is None:
+                result = mission.play(turns=turns)
+                if mission.player.vm.fused is not None:
+                    fused += 1
+                mission = Mission.restore(mission.snapshot(self.KEY), self.KEY)
+            with self.subTest(turns=turns):
+                self.assertEqual(self.outcome(mission, result), expected)
+        self.assertGreater(fused, 0)
+
+    def test_signature(self):
+        code = CircusMission.compile(Parser(Lexer(self.TEXT)).parse())
+        mission = CircusMission(code, seed=5)
+        mission.play(turns=3)
+        blob = mission.snapshot(self.KEY)
+        with self.assertRaises(Error):
+            Mission.restore(blob, b"other key")
+        with self.assertRaises(Error):
+            Mission.restore(blob[:-1] + bytes([blob[-1] ^ 1]), self.KEY)
+        with self.assertRaises(Error):
+            Mission.restore(blob, self.KEY, max_size=100)
+
+        budget = Budget(instructions=mission.budget.used + 10, call_depth=4)
+        mission = Mission.restore(blob, self.KEY, budget=budget)
+        self.assertEqual(mission.budget.instructions, budget.instructions)
+        self.assertEqual(mission.player.vm.call_stack.max_depth, 4)
+        with self.assertRaises(Error):
+            mission.play()
+
+
+if __name__ == "__main__":
+    unittest.main()
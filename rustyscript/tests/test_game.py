@@ -0,0 +1,88 @@
+"""Frame modes of the missions: FINAL and NONE runs must end the same way
+as ALL runs, with the last frame of the ALL run or with no frames.
+
+    $ python -m unittest discover -s tests
+"""
+
+import unittest
+
+from rsinterpreter.interpreter import Lexer, Parser, Error
+from rsinterpreter.game import CircusMission, FrameMode, MAX_STEPS
+
+PROGRAMS = {
+    "win": """
+        program win;
+        use legs;
+        begin
+            right(); right(); down(); down(); left(); left(); up(); up()
+        end.
+    """,
+    "program ends": """
+        program ends;
+        use legs;
+        begin right(); down(); right() end.
+    """,
+    "step limit": """
+        program forever;
+        use legs;
+        var i: integer;
+        begin
+            i := 0;
+            while 1 = 1 do begin
+                i := i + 1;
+                if i div 3 * 3 = i then begin right() end else begin left() end
+            end
+        end.
+    """,
+    "error": """
+        program error;
+        use legs;
+        var a: integer;
+        begin right(); a := 0; a := 1 div a end.
+    """,
+}
+
+
+def play(code, frame_mode: FrameMode, frame_every: int) -> tuple:
+    mission = CircusMission(
+        code, seed=3, frame_mode=frame_mode, frame_every=frame_every
+    )
+    try:
+        result = mission.play()
+    except Error as e:
+        result = e.message
+    return result, mission.n_steps, mission.texts
+
+
+class FrameModeTest(unittest.TestCase):
+    def test_modes(self):
+        for name, text in PROGRAMS.items():
+            code = CircusMission.compile(Parser(Lexer(text)).parse())
+            for frame_every in (1, 2, 3):
+                with self.subTest(name, frame_every=frame_every):
+                    result, n_steps, texts = play(code, FrameMode.ALL, frame_every)
+                    final = play(code, FrameMode.FINAL, frame_every)
+                    self.assertEqual(final[:2], (result, n_steps))
+                    if not isinstance(result, dict):
+                        # an error answers without frames
+                        self.assertEqual(final[2], [])
+                    elif name == "program ends" and frame_every > 1:
+                        # ALL has no frame of the last step here, FINAL does
+                        self.assertEqual(len(final[2]), 1)
+                    else:
+                        self.assertEqual(final[2], texts[-1:])
+
+                    self.assertEqual(
+                        play(code, FrameMode.NONE, frame_every), (result, n_steps, [])
+                    )
+
+    def test_step_limit(self):
+        code = CircusMission.compile(Parser(Lexer(PROGRAMS["step limit"])).parse())
+        result, n_steps, texts = play(code, FrameMode.FINAL, 2)
+        self.assertEqual(result["result"], 0)
+        self.assertEqual(n_steps, MAX_STEPS + 1)
+        self.assertEqual(len(texts), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""The one-pass Lexer, and its incremental mode that reuses the tokens of an
+earlier version of the text: it must give exactly the tokens of a full
+re-lex of the new text.
+
+    $ python -m unittest discover -s tests
+"""
+
+import random
+import unittest
+
+from rsinterpreter.interpreter import Lexer, LexerError, TokenType
+
+SOURCE = """program walk;
+use legs;
+var i, x: integer; { a comment
+over two lines }
+y: real;
+begin
+    i := 0; x := up + 1; y := 0.5;
+    while i <> 10 do begin
+        x := x + left * 3 div 2;
+        y := y / 2.25;
+        i := i + 1
+    end
+end.
+"""
+
+# pieces of tokens the edits are made of, they join and split tokens
+PIECES = list("ab19 .:=<>(){}\n;+-") + ["..", ":=", "0.", "begin", "end", "\t"]
+
+
+def lex(text, previous=None):
+    """The tokens of the text as tuples, or the message of the lexer error."""
+    lexer = Lexer(text)
+    try:
+        tokens = lexer.tokenize(previous)
+    except LexerError as e:
+        return lexer, e.message
+    return lexer, [(t.type, t.value, t.lineno, t.column) for t in tokens]
+
+
+def edit(rng, text):
+    start = rng.randint(0, len(text))
+    end = min(len(text), start + rng.choice([0, 0, 1, 2, 5]))
+    inserted = "".join(rng.choice(PIECES) for _ in range(rng.choice([0, 1, 1, 2])))
+    return text[:start] + inserted + text[end:]
+
+
+class LexerTest(unittest.TestCase):
+    def test_tokens(self):
+        _, tokens = lex("x:=y[1..2]<>3.5 {c}\n  DiV z")
+        self.assertEqual(
+            tokens,
+            [
+                (TokenType.ID, "x", 1, 1),
+                (TokenType.ASSIGN, ":=", 1, 2),
+                (TokenType.ID, "y", 1, 4),
+                (TokenType.LBRACKET, "[", 1, 5),
+                (TokenType.INTEGER_CONST, 1, 1, 6),
+                (TokenType.RANGE, "..", 1, 7),
+                (TokenType.INTEGER_CONST, 2, 1, 9),
+                (TokenType.RBRACKET, "]", 1, 10),
+                (TokenType.NOT_EQUAL, "<>", 1, 11),
+                (TokenType.REAL_CONST, 3.5, 1, 13),
+                (TokenType.INTEGER_DIV, "DIV", 2, 3),
+                (TokenType.ID, "z", 2, 7),
+                (TokenType.EOF, None, None, None),
+            ],
+        )
+
+    def test_error(self):
+        _, message = lex("x := 1;\n  y := $")
+        self.assertEqual(
+            message, "LexerError: Lexer error on '$' line: 2 column: 8",
+        )
+
+    def test_get_next_token(self):
+        lexer = Lexer("a b")
+        values = [lexer.get_next_token().value for _ in range(4)]
+        self.assertEqual(values, ["a", "b", None, None])
+
+    def test_incremental(self):
+        for seed in range(300):
+            rng = random.Random(seed)
+            text = SOURCE
+            previous, _ = lex(text)
+            for _ in range(10):
+                text = edit(rng, text)
+                lexer, tokens = lex(text, previous)
+                _, expected = lex(text)
+                self.assertEqual(tokens, expected, (seed, text))
+                previous = lexer
+
+    def test_incremental_reuses_prefix(self):
+        previous = Lexer(SOURCE)
+        old = previous.tokenize()
+        text = SOURCE.replace("i + 1", "i + 7")
+        tokens = Lexer(text).tokenize(previous)
+        changed = next(n for n, token in enumerate(tokens) if token.value == 7)
+        self.assertTrue(all(a is b for a, b in zip(old[:changed], tokens)))
+
+
+if __name__ == "__main__":
+    unittest.main()
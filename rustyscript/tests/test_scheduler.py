@@ -0,0 +1,96 @@
+"""The order in which the Scheduler runs the robots of an arena.
+
+    $ python -m unittest discover -s tests
+"""
+
+import unittest
+
+from rsinterpreter.interpreter import Wait
+from rsinterpreter.scheduler import Scheduler
+
+# names of the robots that stepped since the last tick
+trace = []
+
+
+class Robot:
+    """A player whose program yields the given step values."""
+
+    def __init__(self, name: str, steps: list, quantum: int = None):
+        self.name = name
+        self.quantum = quantum
+        self.interpreter = self.program(steps)
+
+    def program(self, steps):
+        for value in steps:
+            trace.append(self.name)
+            yield value
+
+
+def run(players, quantum: int = 10) -> list:
+    """Names of the robots in the order they stepped, with "-" for every
+    idle tick, and the ticks yielded by run()."""
+    del trace[:]
+    scheduler = Scheduler(players, quantum=quantum)
+    order = []
+    ticks = []
+    for span in scheduler.run():
+        ticks.append(span)
+        if trace:
+            order.extend(trace)
+            del trace[:]
+        else:
+            order.extend("-" * span)
+    # every tick is accounted for
+    assert scheduler.tick == sum(ticks) == len(order)
+    return order, ticks
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_round_robin(self):
+        order, ticks = run(
+            [Robot("a", [None] * 5), Robot("b", [None] * 3), Robot("c", [None])],
+            quantum=2,
+        )
+        self.assertEqual("".join(order), "aabbcaaba")
+        self.assertEqual(set(ticks), {1})
+
+    def test_quantum_of_robot(self):
+        order, _ = run([Robot("a", [None] * 4, quantum=3), Robot("b", [None] * 4)], 1)
+        self.assertEqual("".join(order), "aaababbb")
+
+    def test_wait(self):
+        # a sleeps through the next 3 ticks and is back after b's quantum
+        order, _ = run(
+            [Robot("a", [Wait(3), None, None]), Robot("b", [None] * 6)], quantum=4
+        )
+        self.assertEqual("".join(order), "abbbbaabb")
+
+    def test_wake_order(self):
+        # robots waking up on the same tick run in the order they slept
+        order, _ = run(
+            [
+                Robot("a", [Wait(4), None]),
+                Robot("b", [Wait(3), None]),
+                Robot("c", [Wait(2), None]),
+                Robot("d", [Wait(1), None, None]),
+            ]
+        )
+        self.assertEqual("".join(order), "abcd-abcdd")
+
+    def test_idle(self):
+        order, ticks = run(
+            [Robot("a", [Wait(5), None]), Robot("b", [Wait(10), Wait(0), None])]
+        )
+        # a is idle for the 5 ticks after its step, b for 10
+        self.assertEqual("".join(order), "ab----a-----bb")
+        # the idle spans are yielded at once
+        self.assertEqual(ticks, [1, 1, 4, 1, 5, 1, 1])
+
+    def test_finished(self):
+        order, _ = run([Robot("a", []), Robot("b", [Wait(2)]), Robot("c", [None])])
+        # b ends once its last action is over
+        self.assertEqual("".join(order), "bc-")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,17 +2,13 @@ import asyncio
 import logging
 
 import asyncssh
-from pygments.lexers.html import HtmlLexer
 
-from shizoserver.utils import tip_say, input_code, eval_code, play_frames
+from shizoserver.utils import tip_say, input_code, eval_code_stream, play_stream
 from shizoserver.texts import LOGO, INTRO
 from shizoserver.levels import LEVELS, levels_style
 from shizoserver.menu.login import login
-from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.contrib.ssh import PromptToolkitSSHServer
-from prompt_toolkit.lexers import PygmentsLexer
-from prompt_toolkit.shortcuts import ProgressBar, print_formatted_text
-from prompt_toolkit.shortcuts.dialogs import input_dialog, yes_no_dialog
+from prompt_toolkit.shortcuts import print_formatted_text
 from prompt_toolkit.shortcuts.prompt import PromptSession
 from prompt_toolkit import HTML
 from prompt_toolkit.validation import Validator
@@ -64,12 +60,11 @@ async def interact() -> None:
     level = LEVELS[int(level)]
     print(tip_say(level['description']), style=levels_style)
     while True:
-        code = await input_code()
-        result = await eval_code(level['name'], code)
+        code = await input_code(level['name'])
+        result = await play_stream(eval_code_stream(level['name'], code))
         if result.get('error'):
             print(HTML(f'<red>{result["error"]}</red>'))
             continue
-        await play_frames(result['texts'])
         print(HTML(f'[<magenta>*</magenta>] Всего шагов: {result["n_steps"]}'))
         if result['result']:
             print(HTML('<lime>Вы победили!</lime>'))
@@ -0,0 +1,48 @@
+FRAME_FORMAT = 1
+
+
+class FrameDecoder:
+    """Decodes the delta encoded frame blocks of one run.
+
+    See rsinterpreter/frames.py in the game worker for the format.
+    """
+
+    def __init__(self):
+        self.palette = []
+        self.width = 0
+        self.chars = []
+        self.colors = []
+
+    def decode(self, block):
+        """Yield the frames of a block one by one as rows of (char, color)."""
+        if isinstance(block, list):
+            # legacy format: a list of full frames
+            yield from block
+            return
+        if block['v'] != FRAME_FORMAT:
+            raise ValueError(f'Unsupported frame format: {block["v"]}')
+
+        self.palette.extend(block['palette'])
+        for frame in block['frames']:
+            if isinstance(frame, dict):
+                self.width = frame['w']
+                self.chars = list(frame['k'])
+                self.colors = list(frame['c'])
+            else:
+                for i in range(0, len(frame), 3):
+                    self.chars[frame[i]] = frame[i + 1]
+                    self.colors[frame[i]] = frame[i + 2]
+            yield self.frame()
+
+    def frame(self):
+        width = self.width
+        palette = self.palette
+        if not width:
+            return []
+        return [
+            [
+                (self.chars[i], palette[self.colors[i]])
+                for i in range(start, start + width)
+            ]
+            for start in range(0, len(self.chars), width)
+        ]
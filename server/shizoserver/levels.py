@@ -9,6 +9,9 @@ LEVELS = [
     {
         'name': 'circus',
         'visible': 'Волк слабее робота, но в цирке не выступает',
+        # robot modules of the level, the same as build() of the mission
+        # in the game worker; their functions are in rsinterpreter/modules.py
+        'modules': ['legs'],
         'description': (
             "<b>- Привет, ты тут новенький?</b>\n"
             "<b>Я Ю. Дитский, приятно познакомиться.</b>\n"
@@ -0,0 +1,118 @@
+from aio_pika.pool import Pool
+
+import aio_pika
+import asyncio
+import uuid
+import json
+
+CHANNEL_POOL_SIZE = 16
+
+
+class RPCClient:
+    """One connection and one exclusive reply queue per server process.
+
+    Requests are published with ``reply_to`` set to the reply queue and a
+    fresh ``correlation_id``; replies are pushed by the broker and resolve
+    the future waiting for that id.
+    """
+
+    def __init__(self, url: str, channel_pool_size: int = CHANNEL_POOL_SIZE):
+        self.url = url
+        self.channel_pool_size = channel_pool_size
+        self.connection = None
+        self.channel_pool = None
+        self.callback_queue = None
+        self.futures = {}
+        self.streams = {}
+        self._connect_lock = None
+
+    async def connect(self):
+        if self.connection is not None:
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.connection is not None:
+                return
+            connection = await aio_pika.connect_robust(self.url)
+            channel = await connection.channel()
+            self.callback_queue = await channel.declare_queue(
+                exclusive=True, auto_delete=True
+            )
+            await self.callback_queue.consume(self.on_response, no_ack=True)
+            self.channel_pool = Pool(
+                connection.channel, max_size=self.channel_pool_size
+            )
+            self.connection = connection
+
+    async def close(self):
+        if self.connection is None:
+            return
+        await self.channel_pool.close()
+        await self.connection.close()
+        self.connection = None
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+        self.streams.clear()
+
+    async def on_response(self, message: aio_pika.IncomingMessage):
+        stream = self.streams.get(message.correlation_id)
+        if stream is not None:
+            stream.put_nowait(json.loads(message.body.decode('utf-8')))
+            return
+        future = self.futures.pop(message.correlation_id, None)
+        if future is not None and not future.done():
+            future.set_result(json.loads(message.body.decode('utf-8')))
+
+    async def publish(self, routing_key: str, payload: dict,
+                      correlation_id: str, timeout: float):
+        async with self.channel_pool.acquire() as channel:
+            await channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=json.dumps(payload).encode('utf-8'),
+                    correlation_id=correlation_id,
+                    reply_to=self.callback_queue.name,
+                    # nobody waits for the result after the deadline
+                    expiration=timeout,
+                ),
+                routing_key=routing_key,
+            )
+
+    async def call(self, routing_key: str, payload: dict, timeout: float) -> dict:
+        await self.connect()
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_event_loop().create_future()
+        self.futures[correlation_id] = future
+        try:
+            await self.publish(routing_key, payload, correlation_id, timeout)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.futures.pop(correlation_id, None)
+
+    async def stream(self, routing_key: str, payload: dict, timeout: float):
+        """Yield the replies to one request in ``seq`` order.
+
+        The request is answered with any number of messages, the last one
+        has ``done`` set. ``timeout`` limits the wait for every next message,
+        not the whole stream.
+        """
+        await self.connect()
+        correlation_id = uuid.uuid4().hex
+        queue = asyncio.Queue()
+        self.streams[correlation_id] = queue
+        try:
+            await self.publish(routing_key, payload, correlation_id, timeout)
+            expected = 0
+            pending = {}
+            while True:
+                while expected not in pending:
+                    message = await asyncio.wait_for(queue.get(), timeout)
+                    pending[message['seq']] = message
+                message = pending.pop(expected)
+                expected += 1
+                yield message
+                if message.get('done'):
+                    return
+        finally:
+            self.streams.pop(correlation_id, None)
@@ -0,0 +1,145 @@
+from prompt_toolkit.document import Document
+from prompt_toolkit.lexers import Lexer as PromptLexer
+from prompt_toolkit.styles.pygments import pygments_token_to_classname
+from pygments.lexer import RegexLexer, words
+from pygments.token import (
+    Comment, Error, Keyword, Name, Number, Operator, Punctuation, Whitespace
+)
+from rsinterpreter.interpreter import TokenType, RESERVED_KEYWORDS, SYMBOL_TOKENS
+from rsinterpreter.modules import MODULE_FUNCTIONS
+
+from .levels import LEVELS
+
+import re
+import typing
+
+# lines kept highlighted by one editor
+LINE_CACHE_SIZE = 1024
+
+TYPES = {TokenType.INTEGER, TokenType.REAL}
+WORD_OPERATORS = {TokenType.INTEGER_DIV, TokenType.AND, TokenType.OR}
+PUNCTUATION = {
+    TokenType.LPAREN, TokenType.RPAREN, TokenType.LBRACKET, TokenType.RBRACKET,
+    TokenType.SEMI, TokenType.DOT, TokenType.RANGE, TokenType.COLON,
+    TokenType.COMMA,
+}
+
+KEYWORDS = [
+    word.lower() for word, token_type in RESERVED_KEYWORDS.items()
+    if token_type not in TYPES | WORD_OPERATORS
+]
+TYPE_NAMES = sorted(token_type.value.lower() for token_type in TYPES)
+OPERATOR_WORDS = sorted(token_type.value.lower() for token_type in WORD_OPERATORS)
+MODULES = sorted({module for level in LEVELS for module in level['modules']})
+FUNCTIONS = sorted({
+    func for module in MODULES for func in MODULE_FUNCTIONS[module]
+})
+
+
+def symbols(kinds: typing.Callable[[TokenType], bool]) -> typing.List[str]:
+    return sorted(
+        (value for value, token_type in SYMBOL_TOKENS.items() if kinds(token_type)),
+        key=len, reverse=True,
+    )
+
+
+class ShizoLexer(RegexLexer):
+    """Pygments lexer of ShizoSkript built from the interpreter's tables."""
+
+    name = 'ShizoSkript'
+    aliases = ['shizoskript']
+    flags = re.IGNORECASE
+
+    tokens = {
+        'root': [
+            (r'\s+', Whitespace),
+            (r'\{', Comment.Multiline, 'comment'),
+            (words(KEYWORDS, suffix=r'\b'), Keyword),
+            (words(TYPE_NAMES, suffix=r'\b'), Keyword.Type),
+            (words(OPERATOR_WORDS, suffix=r'\b'), Operator.Word),
+            (words(MODULES, suffix=r'\b'), Name.Namespace),
+            (words(FUNCTIONS, suffix=r'\b'), Name.Builtin),
+            # not the first dot of '..', '0..9' is a range
+            (r'\d+(\.(?!\.)\d*)?', Number),
+            (r'[^\W\d_][^\W_]*', Name),
+            # before the punctuation, so that ':=' is not read as ':'
+            (words(symbols(lambda t: t not in PUNCTUATION)), Operator),
+            (words(symbols(lambda t: t in PUNCTUATION)), Punctuation),
+            (r'.', Error),
+        ],
+        'comment': [
+            (r'[^}]+', Comment.Multiline),
+            (r'\}', Comment.Multiline, '#pop'),
+        ],
+    }
+
+
+def comment_open_after(line: str, in_comment: bool) -> bool:
+    """Whether a comment is still open at the end of the line."""
+    pos = 0
+    while True:
+        if in_comment:
+            pos = line.find('}', pos)
+            if pos < 0:
+                return True
+            in_comment = False
+        else:
+            pos = line.find('{', pos)
+            if pos < 0:
+                return False
+            in_comment = True
+        pos += 1
+
+
+class ShizoHighlighter(PromptLexer):
+    """Highlights the editor line by line with ShizoLexer.
+
+    Comments are the only tokens spanning lines, so a line is fully
+    described by its text and whether a comment is open at its start;
+    the fragments of unchanged lines are reused from keystroke to
+    keystroke and only the lines on screen are ever lexed.
+    """
+
+    def __init__(self):
+        self.lexer = ShizoLexer()
+        self.cache = {}
+
+    def highlight(self, line: str, in_comment: bool):
+        key = (line, in_comment)
+        fragments = self.cache.get(key)
+        if fragments is None:
+            stack = ('root', 'comment') if in_comment else ('root',)
+            fragments = [
+                ('class:' + pygments_token_to_classname(token), value)
+                for _, token, value in self.lexer.get_tokens_unprocessed(line, stack)
+            ]
+            if len(self.cache) >= LINE_CACHE_SIZE:
+                self.cache.clear()
+            self.cache[key] = fragments
+        return fragments
+
+    def lex_document(self, document: Document):
+        lines = document.lines
+        # is a comment open at the start of the line
+        open_comments = [False]
+
+        def get_line(lineno: int):
+            if lineno >= len(lines):
+                return []
+            while len(open_comments) <= lineno:
+                i = len(open_comments) - 1
+                open_comments.append(comment_open_after(lines[i], open_comments[i]))
+            return self.highlight(lines[lineno], open_comments[lineno])
+
+        return get_line
+
+
+def completions(mission: str) -> typing.List[str]:
+    """Words offered by the editor on the level."""
+    modules = next(
+        (level['modules'] for level in LEVELS if level['name'] == mission), []
+    )
+    names = KEYWORDS + TYPE_NAMES + OPERATOR_WORDS + sorted(modules)
+    for module in modules:
+        names.extend(MODULE_FUNCTIONS[module])
+    return names
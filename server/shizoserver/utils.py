@@ -1,15 +1,15 @@
 from prompt_toolkit import print_formatted_text, HTML
 from prompt_toolkit import PromptSession
-from prompt_toolkit.lexers import PygmentsLexer
 from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.shortcuts import clear
-from pygments.lexers.pascal import DelphiLexer
 
-import aio_pika
+from .rpc import RPCClient
+from .frames import FrameDecoder, FRAME_FORMAT
+from .validation import validate, ProgramValidator, DiagnosticProcessor
+from .syntax import ShizoHighlighter, completions
+
 import asyncio
 import environs
-import uuid
-import json
 
 TIMEOUT = 120
 FACE = (
@@ -26,6 +26,7 @@ COLORS = {
 
 env: environs.Env = environs.Env()
 RABBITMQ_CONNECTION_URI: str = env.str('RABBITMQ_CONNECTION_URI')
+rpc = RPCClient(RABBITMQ_CONNECTION_URI)
 
 
 def tip_say(text: str):
@@ -48,62 +49,58 @@ def tip_say(text: str):
     return HTML("\n".join("".join(i) for i in text))
 
 
-class ShizoLexer(DelphiLexer):
-    KEYWORDS = {
-        'program', 'use',
-        'do', 'begin', 'end',
-        'while', 'if', 'then'
-    }
-
-    BUILTIN = {
-        'legs': {'up', 'down', 'left', 'right'}
-    }
-
-    def __init__(self, **options):
-        super().__init__()
-        self.keywords = set()
-        self.keywords.update(self.KEYWORDS)
-        self.builtins = set()
-
-
-async def input_code() -> str:
+async def input_code(mission: str) -> str:
     session = PromptSession()
-    completer = WordCompleter(["program", "begin", "use", "do", "then", "if", "end", "while"])
+    completer = WordCompleter(completions(mission), ignore_case=True)
     print_formatted_text(HTML('\n<b>Введите код:</b>'))
     return await session.prompt_async(
         HTML('<lime>.</lime> '), multiline=True, is_password=False,
         prompt_continuation=lambda _, __, ___: HTML('<lime>.</lime> '),
-        lexer=PygmentsLexer(ShizoLexer), completer=completer,
-        complete_in_thread=True
+        lexer=ShizoHighlighter(), completer=completer,
+        complete_in_thread=True,
+        validator=ProgramValidator(mission), validate_while_typing=True,
+        input_processors=[DiagnosticProcessor()],
     )
 
 
-async def eval_code(mission: str, code: str):
-    connection = await aio_pika.connect_robust(RABBITMQ_CONNECTION_URI)
-    async with connection:
-        channel = await connection.channel()
-        response_queue = f'game_result.{uuid.uuid4().hex}'
-        queue = await channel.declare_queue(response_queue, auto_delete=True)
-        await channel.default_exchange.publish(
-            aio_pika.Message(
-                body=json.dumps(
-                    {
-                        'code': code,
-                        'level': mission,
-                        'response_queue': response_queue
-                    }
-                ).encode('utf-8')
-            ), routing_key='play_mission'
-        )
+async def eval_code_stream(mission: str, code: str, seed: int = 0):
+    """Play the mission on a game worker, yielding the frames while the
+    robot is still running.
 
-        for i in range(TIMEOUT * 2):
-            event = await queue.get(no_ack=True, fail=False)
-            if event is not None:
-                break
-            await asyncio.sleep(0.5)
-        data = json.loads(event.body.decode('utf-8'))
-    await connection.close()
-    return data
+    Every message but the last one has ``frames``; the last one has
+    ``done`` and the verdict, or ``error`` if the program was rejected.
+    """
+    # parsing a long program would hold up every other SSH session
+    error = await asyncio.get_event_loop().run_in_executor(
+        None, validate, mission, code
+    )
+    if error is not None:
+        yield {'done': True, 'error': error}
+        return
+    try:
+        async for message in rpc.stream(
+            'play_mission',
+            {
+                'code': code,
+                'level': mission,
+                'seed': seed,
+                'stream': True,
+                'format': FRAME_FORMAT,
+            },
+            timeout=TIMEOUT,
+        ):
+            yield message
+    except asyncio.TimeoutError:
+        yield {'done': True, 'error': 'Робот думал слишком долго, попробуйте ещё раз!'}
+
+
+async def play_stream(messages) -> dict:
+    """Play the frames from eval_code_stream and return the final message."""
+    decoder = FrameDecoder()
+    async for message in messages:
+        if message.get('done'):
+            return message
+        await play_frames(decoder.decode(message['frames']))
 
 
 async def play_frames(frames: list):
@@ -0,0 +1,130 @@
+from prompt_toolkit.application import get_app
+from prompt_toolkit.document import Document
+from prompt_toolkit.eventloop import run_in_executor_with_context
+from prompt_toolkit.layout.processors import (
+    Processor, Transformation, TransformationInput
+)
+from prompt_toolkit.layout.utils import explode_text_fragments
+from prompt_toolkit.validation import Validator, ValidationError
+from rsinterpreter.interpreter import Lexer, Parser, SemanticAnalyzer, Error
+from rsinterpreter.modules import describe
+
+from .levels import LEVELS
+
+import asyncio
+import threading
+import typing
+
+# seconds without typing before the program is checked again
+DIAGNOSTICS_DELAY = 0.3
+
+
+class ModuleSpec:
+    """The interface of a robot module, all SemanticAnalyzer needs of it."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.other = describe(name)
+        self.func = dict.fromkeys(self.other)
+
+
+MODULES = {
+    level['name']: {name: ModuleSpec(name) for name in level['modules']}
+    for level in LEVELS
+}
+
+
+def check(lexer: Lexer, modules: dict, previous: Lexer = None):
+    """Raise the first error the game worker would find in the program."""
+    lexer.tokenize(previous)
+    tree = Parser(lexer).parse()
+    SemanticAnalyzer(modules).visit(tree)
+
+
+def validate(mission: str, code: str) -> typing.Optional[str]:
+    """Check the program the way the game worker does before running it.
+
+    Returns the error message of the worker or None if the program is
+    valid (or the level is unknown here, then the worker answers).
+    """
+    modules = MODULES.get(mission)
+    if modules is None:
+        return None
+    try:
+        check(Lexer(code), modules)
+    except Error as e:
+        return e.message
+    return None
+
+
+class ProgramValidator(Validator):
+    """Finds the first error of the program while it is being typed.
+
+    The check runs in a thread once the user stops typing for
+    DIAGNOSTICS_DELAY, and only relexes the text from the first change
+    since the previous check.
+    """
+
+    def __init__(self, mission: str):
+        self.modules = MODULES.get(mission, {})
+        # lexer of the last checked text
+        self.lexer = None
+        self.lock = threading.Lock()
+
+    def validate(self, document: Document) -> None:
+        lexer = Lexer(document.text)
+        with self.lock:
+            try:
+                check(lexer, self.modules, self.lexer)
+            except Error as e:
+                error = e
+            else:
+                error = None
+            if lexer.tokens is not None:
+                self.lexer = lexer
+        if error is not None:
+            raise ValidationError(
+                cursor_position=error_position(document, error),
+                message=error.message,
+            )
+
+    async def validate_async(self, document: Document) -> None:
+        await asyncio.sleep(DIAGNOSTICS_DELAY)
+        if get_app().current_buffer.document != document:
+            # still typing, the buffer validates the new text again
+            return
+        await run_in_executor_with_context(lambda: self.validate(document))
+
+
+def error_position(document: Document, error: Error) -> int:
+    lineno = getattr(error.token, 'lineno', None)
+    if lineno is None:
+        return len(document.text)
+    return document.translate_row_col_to_index(lineno - 1, error.token.column - 1)
+
+
+class DiagnosticProcessor(Processor):
+    """Underlines the word at the position of the validation error."""
+
+    def apply_transformation(self, ti: TransformationInput) -> Transformation:
+        error = ti.buffer_control.buffer.validation_error
+        if error is None:
+            return Transformation(ti.fragments)
+        row, column = ti.document.translate_index_to_position(error.cursor_position)
+        if row != ti.lineno:
+            return Transformation(ti.fragments)
+
+        line = ti.document.lines[row]
+        end = column + 1
+        while end < len(line) and line[column].isalnum() and line[end].isalnum():
+            end += 1
+        fragments = explode_text_fragments(ti.fragments)
+        for i in range(ti.source_to_display(column), ti.source_to_display(end)):
+            if i < len(fragments):
+                style, text = fragments[i][:2]
+                fragments[i] = (style + ' underline fg:ansired', text)
+            else:
+                # the error is at the end of the line
+                fragments.append(('underline fg:ansired', ' '))
+                break
+        return Transformation(fragments)
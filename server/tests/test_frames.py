@@ -0,0 +1,82 @@
+"""Frames encoded by the game worker must decode to the same frames here.
+
+The worker's rsinterpreter is copied next to shizoserver in the image, run
+the tests with it on the path:
+
+    $ PYTHONPATH=../rustyscript python -m unittest discover -s tests
+"""
+
+import random
+import unittest
+
+from rsinterpreter.frames import FrameEncoder, FRAME_FORMAT as WORKER_FORMAT
+from shizoserver.frames import FrameDecoder, FRAME_FORMAT
+
+CHARS = ['.', '@', '#', '*', '->']
+COLORS = ['dust', 'player_0', 'player_1', 'wall', 'red']
+
+
+def random_frames(rng, n: int) -> list:
+    frames = []
+    width, height = 3, 3
+    for _ in range(n):
+        if rng.random() < 0.1:
+            width, height = rng.randint(1, 4), rng.randint(1, 4)
+        size = (len(frames[-1][0]), len(frames[-1])) if frames else None
+        if rng.random() < 0.7 and size == (width, height):
+            # the same arena a step later
+            frame = [list(row) for row in frames[-1]]
+        else:
+            frame = [[('.', 'dust')] * width for _ in range(height)]
+        for _ in range(rng.randint(0, 3)):
+            frame[rng.randrange(height)][rng.randrange(width)] = (
+                rng.choice(CHARS), rng.choice(COLORS),
+            )
+        frames.append(frame)
+    return frames
+
+
+class FramesTest(unittest.TestCase):
+    def test_format(self):
+        self.assertEqual(FRAME_FORMAT, WORKER_FORMAT)
+
+    def test_round_trip(self):
+        for seed in range(200):
+            rng = random.Random(seed)
+            frames = random_frames(rng, rng.randint(1, 30))
+            encoder = FrameEncoder()
+            decoder = FrameDecoder()
+            decoded = []
+            start = 0
+            while start < len(frames):
+                end = start + rng.randint(1, 5)
+                block = encoder.encode(frames[start:end])
+                decoded.extend(decoder.decode(block))
+                start = end
+            self.assertEqual(
+                decoded,
+                [[list(row) for row in frame] for frame in frames],
+                seed,
+            )
+
+    def test_delta(self):
+        first = [[('.', 'dust'), ('@', 'player_0')]]
+        second = [[('@', 'player_0'), ('.', 'dust')]]
+        block = FrameEncoder().encode([first, first, second])
+        self.assertEqual(block['palette'], ['dust', 'player_0'])
+        self.assertEqual(
+            block['frames'],
+            [{'w': 2, 'k': '.@', 'c': [0, 1]}, [], [0, '@', 1, 1, '.', 0]],
+        )
+
+    def test_legacy(self):
+        frames = [[[('.', 'dust')]]]
+        self.assertEqual(list(FrameDecoder().decode(frames)), frames)
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            list(FrameDecoder().decode({'v': 0, 'palette': [], 'frames': []}))
+
+
+if __name__ == '__main__':
+    unittest.main()
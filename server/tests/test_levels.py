@@ -0,0 +1,40 @@
+"""The levels of the server must describe the missions of the game worker.
+
+Imports the game, so the worker's dependencies are needed as well:
+
+    $ PYTHONPATH=../rustyscript python -m unittest discover -s tests
+"""
+
+import unittest
+
+from rsinterpreter.game import MISSIONS
+from shizoserver.levels import LEVELS
+from shizoserver.validation import MODULES
+from shizoserver.syntax import FUNCTIONS, completions
+
+
+class LevelsTest(unittest.TestCase):
+    def test_missions(self):
+        self.assertEqual(sorted(level['name'] for level in LEVELS), sorted(MISSIONS))
+
+    def test_modules(self):
+        for level in LEVELS:
+            with self.subTest(level['name']):
+                modules = {
+                    module.name: module for module in MISSIONS[level['name']].build()
+                }
+                self.assertEqual(sorted(level['modules']), sorted(modules))
+                for name, spec in MODULES[level['name']].items():
+                    self.assertEqual(spec.other, modules[name].other)
+                    self.assertEqual(list(spec.func), list(modules[name].func))
+
+                words = completions(level['name'])
+                for module in modules.values():
+                    self.assertIn(module.name, words)
+                    for func in module.func:
+                        self.assertIn(func, words)
+                        self.assertIn(func, FUNCTIONS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""The server must reject exactly the programs the game worker rejects,
+with the same message, and point the editor at the error.
+
+    $ PYTHONPATH=../rustyscript python -m unittest discover -s tests
+"""
+
+import random
+import unittest
+
+from prompt_toolkit.document import Document
+from prompt_toolkit.validation import ValidationError
+from rsinterpreter.cache import ProgramCache
+from rsinterpreter.game import MISSIONS
+from shizoserver.validation import validate, ProgramValidator
+from shizoserver.syntax import ShizoHighlighter
+
+PROGRAM = """program walk;
+use legs;
+var i: integer;
+begin
+    i := 0; { go round
+    the arena }
+    while i < 2 do begin right(); i := i + 1 end;
+    down()
+end.
+"""
+
+BROKEN = {
+    'lexer': PROGRAM.replace('i := 0', 'i := $'),
+    'parser': PROGRAM.replace('do begin', 'do'),
+    'unknown function': PROGRAM.replace('down()', 'jump()'),
+    'parameters': PROGRAM.replace('down()', 'down(1)'),
+    'unknown module': PROGRAM.replace('use legs', 'use wings'),
+    'undeclared': PROGRAM.replace('i := 0', 'j := 0'),
+}
+
+
+def worker_error(mission: str, code: str):
+    """The error the game worker answers with, or None."""
+    error = ProgramCache.compile('', code, MISSIONS[mission]).error
+    return None if error is None else error.message
+
+
+class ValidateTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertIsNone(validate('circus', PROGRAM))
+        self.assertIsNone(worker_error('circus', PROGRAM))
+
+    def test_errors(self):
+        for title, code in BROKEN.items():
+            with self.subTest(title):
+                error = validate('circus', code)
+                self.assertIsNotNone(error)
+                self.assertEqual(error, worker_error('circus', code))
+
+    def test_unknown_level(self):
+        # the worker answers for levels the server doesn't know
+        self.assertIsNone(validate('no such level', BROKEN['parser']))
+
+
+class ProgramValidatorTest(unittest.TestCase):
+    def test_position(self):
+        validator = ProgramValidator('circus')
+        validator.validate(Document(PROGRAM))
+        code = BROKEN['unknown function']
+        with self.assertRaises(ValidationError) as error:
+            validator.validate(Document(code))
+        self.assertEqual(error.exception.cursor_position, code.index('jump'))
+        self.assertEqual(error.exception.message, validate('circus', code))
+
+    def test_end_of_text(self):
+        code = 'program walk; begin'
+        with self.assertRaises(ValidationError) as error:
+            ProgramValidator('circus').validate(Document(code))
+        self.assertEqual(error.exception.cursor_position, len(code))
+
+    def test_typing(self):
+        # every keystroke relexes from the first change, with the same result
+        # as a fresh check of the text
+        rng = random.Random(1)
+        validator = ProgramValidator('circus')
+        text = ''
+        for _ in range(3):
+            for position in range(len(PROGRAM) + 1):
+                text = PROGRAM[:position]
+                if rng.random() < 0.2 and position:
+                    # a typo, fixed by the next keystroke
+                    text = text[:-1] + rng.choice('$;{ x')
+                try:
+                    validator.validate(Document(text))
+                    message = None
+                except ValidationError as error:
+                    message = error.message
+                self.assertEqual(message, validate('circus', text), text)
+
+
+class HighlighterTest(unittest.TestCase):
+    def test_lines(self):
+        document = Document(PROGRAM)
+        get_line = ShizoHighlighter().lex_document(document)
+        lines = [get_line(lineno) for lineno in range(len(document.lines))]
+        for fragments, line in zip(lines, document.lines):
+            self.assertEqual(''.join(text for _, text in fragments), line)
+        self.assertEqual(get_line(len(document.lines)), [])
+
+        styles = {text: style for fragments in lines for style, text in fragments}
+        self.assertEqual(styles['program'], 'class:pygments.keyword')
+        self.assertEqual(styles['integer'], 'class:pygments.keyword.type')
+        self.assertEqual(styles['legs'], 'class:pygments.name.namespace')
+        self.assertEqual(styles['right'], 'class:pygments.name.builtin')
+        self.assertEqual(styles[':='], 'class:pygments.operator')
+        # the comment goes on in the next line
+        self.assertEqual(
+            {style for style, _ in lines[5]}, {'class:pygments.comment.multiline'}
+        )
+
+    def test_error(self):
+        get_line = ShizoHighlighter().lex_document(Document('a := $'))
+        self.assertEqual(get_line(0)[-1], ('class:pygments.error', '$'))
+
+
+if __name__ == '__main__':
+    unittest.main()